@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Compare the binary codec with JSON on walk replies
+#
+# Encodes and decodes a reply to a walk of the interface table, as the
+# server and client do with binary framing and with the JSON fallback. The
+# values are built from the SNMP types a real ifTable holds.
+#
+# Usage: python bench/codec.py [rows] [rounds]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp_client
+
+class Peer(snmp_client._JsonRpcPeer):
+    pass
+
+def make_reply(rows):
+    """ Walk reply of ifDescr, ifType, ifSpeed, ifPhysAddress, ifLastChange, ifHCInOctets and ifAlias """
+    var_binds = []
+    for ifindex in range(1, rows + 1):
+        for (column, value) in [
+            ('1.3.6.1.2.1.2.2.1.2', snmp_client.OctetString('GigabitEthernet1/0/%d' % ifindex)),
+            ('1.3.6.1.2.1.2.2.1.3', snmp_client.Integer32(6)),
+            ('1.3.6.1.2.1.2.2.1.5', snmp_client.Gauge32(1000000000)),
+            ('1.3.6.1.2.1.2.2.1.6', snmp_client.OctetString('\x00\x1b\x54\x00\x00' + chr(ifindex % 256))),
+            ('1.3.6.1.2.1.2.2.1.9', snmp_client.TimeTicks(123456 + ifindex)),
+            ('1.3.6.1.2.1.31.1.1.1.6', snmp_client.Counter64(2 ** 40 + ifindex)),
+            ('1.3.6.1.2.1.31.1.1.1.18', snmp_client.OctetString('uplink %d' % ifindex))
+        ]:
+            var_binds.append([snmp_client.ObjectIdentifier('%s.%d' % (column, ifindex)), value])
+    return dict(jsonrpc='2.0', id=1, result=var_binds)
+
+def measure(encode, decode, reply, rounds):
+    """ Best seconds of rounds to encode and decode reply, and the encoded size """
+    encode_times = []
+    decode_times = []
+    for attempt in range(rounds):
+        start = time.time()
+        data = encode(reply)
+        middle = time.time()
+        decode(data)
+        encode_times.append(middle - start)
+        decode_times.append(time.time() - middle)
+    return (min(encode_times), min(decode_times), len(data))
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    reply = make_reply(rows)
+    values = len(reply['result'])
+    codec = snmp_client._BinaryCodec()
+    peer = Peer()
+
+    print('%d var binds, best of %d rounds' % (values, rounds))
+    print('%8s %12s %12s %10s' % ('codec', 'encode/s', 'decode/s', 'bytes'))
+    for (name, encode, decode) in [('binary', codec.encode, codec.decode),
+                                   ('json', peer.serialize, peer.unserialize)]:
+        (encode_time, decode_time, size) = measure(encode, decode, reply, rounds)
+        print('%8s %12d %12d %10d' % (name, values / encode_time, values / decode_time, size))
+
+if __name__ == '__main__':
+    main()
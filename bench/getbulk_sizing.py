@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Compare adaptive GETBULK max-repetitions with fixed values
+#
+# Walks tables of a simulated agent through _Walk of the connection plugin
+# and counts the requests and bytes each sizing needs. Time is simulated as
+# one round trip per request, so the results do not depend on the machine.
+#
+# Usage: python bench/getbulk_sizing.py [rtt in ms]
+
+import os
+import sys
+import bisect
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+from pysnmp.proto import rfc1902, rfc1905
+
+# Columns of the walked tables, like ifName, ifAlias and ifHighSpeed
+COLUMNS = ['1.3.6.1.2.1.31.1.1.1.1', '1.3.6.1.2.1.31.1.1.1.18', '1.3.6.1.2.1.31.1.1.1.15']
+
+SCENARIOS = [
+    # rows, columns, value size, agent message size, agent answers tooBig instead of truncating
+    (48, 1, 8, 1472, False),
+    (500, 1, 8, 1472, False),
+    (500, 3, 24, 1472, False),
+    (500, 3, 24, 1472, True),
+    (2000, 1, 8, 8192, False),
+    (500, 1, 8, 484, True),
+]
+
+FIXED = [10, 25, 50]
+
+# Our own message size limit, raised from the SNMP_MAX_MESSAGE_SIZE default
+# of 1472 to the largest UDP payload, so the agents with larger messages are
+# not capped by us. The agents that truncate or answer tooBig teach the
+# connection their limit either way. max-repetitions still stops at
+# SNMP_MAX_REPETITIONS.
+MAX_MESSAGE_SIZE = 65507
+
+_TOO_BIG = rfc1902.Integer(snmp._ERROR_STATUS_TOO_BIG)
+
+class SimulatedAgent(object):
+    """ Agent serving a table from memory, truncating or answering tooBig beyond its message size """
+
+    def __init__(self, rows, columns, value_size, max_message_size, too_big):
+        self._values = dict()
+        for column in COLUMNS[:columns]:
+            for row in range(1, rows + 1):
+                oid = snmp._oid_subids(column) + (row,)
+                if column == COLUMNS[2]:
+                    self._values[oid] = rfc1902.Gauge32(1000)
+                else:
+                    self._values[oid] = rfc1902.OctetString('x' * value_size)
+        self._oids = sorted(self._values)
+        self._max_message_size = max_message_size
+        self._too_big = too_big
+        self.requests = 0
+        self.bytes = 0
+
+    def get_bulk(self, var_names, max_repetitions):
+        """ Answer a GETBULK, returns error status and var-bind table """
+        self.requests = self.requests + 1
+        cursors = [tuple(name.asTuple()) for name in var_names]
+        table = []
+        size = snmp._PDU_OVERHEAD
+        for repetition in range(max_repetitions):
+            row = []
+            for position, oid in enumerate(cursors):
+                index = bisect.bisect_right(self._oids, oid)
+                if index < len(self._oids):
+                    oid = self._oids[index]
+                    row.append((rfc1902.ObjectName(oid), self._values[oid]))
+                else:
+                    row.append((rfc1902.ObjectName(oid), rfc1905.endOfMibView))
+                cursors[position] = oid
+            row_size = snmp._estimate_size(row)
+            if size + row_size > self._max_message_size:
+                if self._too_big:
+                    self.bytes = self.bytes + snmp._PDU_OVERHEAD
+                    return (_TOO_BIG, [])
+                break
+            table.append(row)
+            size = size + row_size
+        self.bytes = self.bytes + size
+        return (0, table)
+
+def make_connection(agent, fixed=None):
+    """ Connection answering from agent, adapting unless fixed is given """
+    conn = object.__new__(snmp._SnmpConnection)
+    conn.max_message_size = MAX_MESSAGE_SIZE
+    conn.max_var_binds = snmp.SNMP_MAX_VAR_BINDS
+    if fixed is None:
+        conn.max_repetitions = snmp._DEFAULT_MAX_REPETITIONS
+    else:
+        conn.max_repetitions = fixed
+        conn.update_max_repetitions = lambda *args: None
+        conn.reduce_max_repetitions = lambda too_big=False: False
+
+    # Responses are queued rather than delivered from inside the request
+    conn.queue = collections.deque()
+
+    def get_bulk(var_names, callback, non_repeaters=0, max_repetitions=10):
+        (cb_fun, cb_ctx) = callback
+        (error_status, table) = agent.get_bulk(var_names, max_repetitions)
+        conn.queue.append(lambda: cb_fun(None, None, error_status, 0, table, cb_ctx))
+
+    conn.get_bulk = get_bulk
+    return conn
+
+def walk(conn, columns):
+    """ Walk columns, returns the number of rows or None on errors """
+    rows = set()
+    result = []
+
+    def on_var_binds(var_binds):
+        for column, index, value in var_binds:
+            rows.add(index)
+
+    snmp._Walk(conn, COLUMNS[:columns], on_var_binds, result.append).start()
+    while conn.queue:
+        conn.queue.popleft()()
+    if result != [None]:
+        return None
+    return len(rows)
+
+def run(scenario, fixed, rtt):
+    (rows, columns, value_size, max_message_size, too_big) = scenario
+    agent = SimulatedAgent(rows, columns, value_size, max_message_size, too_big)
+    conn = make_connection(agent, fixed)
+
+    # The second walk shows what the connection learned in the first
+    results = []
+    for attempt in range(2):
+        agent.requests = 0
+        agent.bytes = 0
+        if walk(conn, columns) != rows:
+            results.append('failed')
+        else:
+            results.append('%4d req %7.2f s %7d B' % (agent.requests, agent.requests * rtt, agent.bytes))
+    return results
+
+def main():
+    rtt = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.05
+    print('Simulated round trip time: %d ms' % (rtt * 1000))
+    for scenario in SCENARIOS:
+        (rows, columns, value_size, max_message_size, too_big) = scenario
+        print('')
+        print('%d rows x %d columns, %d byte values, agent message size %d, %s' %
+              (rows, columns, value_size, max_message_size, 'tooBig' if too_big else 'truncating'))
+        print('  %-10s %-32s %s' % ('sizing', 'first walk', 'second walk'))
+        for fixed in [None] + FIXED:
+            (first, second) = run(scenario, fixed, rtt)
+            print('  %-10s %-32s %s' % ('adaptive' if fixed is None else 'fixed %d' % fixed, first, second))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Measure how the pipe dispatchers scale with the size of a message
+#
+# Sends single messages of growing size through a pipe between a
+# _TransmitDispatcher and a _ReceiveDispatcher, as a large module output or
+# walk response does. With linear buffers the throughput stays about the
+# same for every size.
+#
+# Usage: python bench/pipe_buffers.py [largest size in MB]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+class Receiver(object):
+    """ Stands in for _Server, counting what arrives """
+
+    def __init__(self):
+        self.received = 0
+        self.eof = False
+
+    def handle_line(self, line):
+        self.received = self.received + len(line)
+
+    def handle_frame(self, frame):
+        self.received = self.received + len(frame)
+
+    def handle_eof(self):
+        self.eof = True
+
+def transfer(size, binary):
+    """ Send one message of size bytes, returns the seconds it took """
+    loop = snmp._EventLoop()
+    (read_fd, write_fd) = os.pipe()
+    receiver = Receiver()
+    transmit = snmp._TransmitDispatcher(write_fd, loop)
+    receive = snmp._ReceiveDispatcher(read_fd, receiver, loop)
+    receive.binary = binary
+    os.close(read_fd)
+    os.close(write_fd)
+
+    message = b'x' * size
+    start = time.time()
+    if binary:
+        transmit.send_frame(message)
+    else:
+        transmit.send_line(message)
+    while receiver.received < size:
+        loop.run_once()
+    elapsed = time.time() - start
+
+    transmit.close()
+    receive.close()
+    return elapsed
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    size = 64 * 1024
+    print('%10s %14s %14s' % ('size', 'lines MB/s', 'frames MB/s'))
+    while size <= largest * 1024 * 1024:
+        rates = []
+        for binary in (False, True):
+            best = min(transfer(size, binary) for attempt in range(3))
+            rates.append(size / best / 1024 / 1024)
+        print('%10d %14.1f %14.1f' % (size, rates[0], rates[1]))
+        size = size * 4
+
+if __name__ == '__main__':
+    main()
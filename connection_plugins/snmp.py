@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import sys
 import subprocess
 import shutil
 import os
@@ -25,8 +26,19 @@ import json
 import syslog
 import traceback
 import base64
-import asyncore
 import time
+import socket
+import hashlib
+import errno
+import collections
+import math
+import heapq
+import functools
+import re
+import locale
+import StringIO
+import shlex
+import signal
 
 from ansible import utils, constants, errors
 from ansible.callbacks import vvv
@@ -34,17 +46,40 @@ from pysnmp.carrier.asynsock import dispatch
 from pysnmp.entity.rfc3413.oneliner import cmdgen
 from pysnmp.entity.rfc3413 import mibvar
 from pysnmp.entity import engine
+from pysnmp.entity import config
 from pysnmp.proto import rfc1902
 from pysnmp.proto import rfc1905
+from pysnmp.proto.secmod.rfc3414 import service as usm
 from pyasn1.type import univ
 from pysnmp.carrier.asynsock.dgram import udp
 
+try:
+    from pysnmp.proto import errind
+except ImportError:
+    # Older pysnmp versions report errors as plain strings
+    errind = None
+
+# Ansible loads connection plugins by path, so their directory is not on sys.path
+_plugin_dir = os.path.dirname(os.path.abspath(__file__))
+if _plugin_dir not in sys.path:
+    sys.path.append(_plugin_dir)
+
+import snmp_client
+from snmp_client import (SnmpError, SnmpValue, OctetString, ObjectIdentifier, Integer32, Counter32, IpAddress,
+                         Gauge32, TimeTicks, Opaque, Counter64, SnmpClient, SnmpRequest, SnmpStream,
+                         _snmp_types, _JsonRpcPeer, _oid_subids, _FRAME_HEADER)
+
 __all__ = ['Connection',
            'SnmpValue', 'OctetString', 'ObjectIdentifier', 'Integer32', 'Counter32', 'IpAddress', 'Gauge32', 'TimeTicks', 'Opaque', 'Counter64',
-           'SnmpClient', 'SnmpError']
+           'SnmpClient', 'SnmpRequest', 'SnmpStream', 'SnmpError']
 
 _cache = dict()
-_snmp_engine = None
+
+# Engines shared by the connections of this process, see _get_snmp_engine
+_snmp_engines = []
+
+# Marks trie nodes without a value, as None is a valid value
+_NO_VALUE = object()
 
 p = constants.load_config_file()
 SNMP_AUTH_PROTOCOL = constants.get_config(p, 'snmp', 'auth_protocol', 'SNMP_AUTH_PROTOCOL', 'none').lower()
@@ -53,6 +88,69 @@ SNMP_ENGINE_ID     = constants.get_config(p, 'snmp', 'engine_id', 'SNMP_ENGINE_I
 SNMP_COMMUNITY     = constants.get_config(p, 'snmp', 'community', 'SNMP_COMMUNITY', None)
 SNMP_AUTH_KEY      = constants.get_config(p, 'snmp', 'auth_key', 'SNMP_AUTH_KEY', None)
 SNMP_PRIV_KEY      = constants.get_config(p, 'snmp', 'priv_key', 'SNMP_PRIV_KEY', None)
+SNMP_STATE_DIR     = os.path.expanduser(constants.get_config(p, 'snmp', 'state_dir', 'SNMP_STATE_DIR', '~/.ansible/snmp'))
+SNMP_BROKER        = constants.get_config(p, 'snmp', 'broker', 'SNMP_BROKER', False, boolean=True)
+SNMP_IN_PROCESS = constants.get_config(p, 'snmp', 'in_process', 'SNMP_IN_PROCESS', False, boolean=True)
+SNMP_BROKER_IDLE_TIMEOUT = constants.get_config(p, 'snmp', 'broker_idle_timeout', 'SNMP_BROKER_IDLE_TIMEOUT', 300, integer=True)
+SNMP_FRAMING = constants.get_config(p, 'snmp', 'framing', 'SNMP_FRAMING', 'binary').lower()
+SNMP_TIMER_RESOLUTION = constants.get_config(p, 'snmp', 'timer_resolution', 'SNMP_TIMER_RESOLUTION', 0.1, floating=True)
+SNMP_MAX_REPETITIONS = constants.get_config(p, 'snmp', 'max_repetitions', 'SNMP_MAX_REPETITIONS', 100, integer=True)
+SNMP_TIMEOUT = constants.get_config(p, 'snmp', 'timeout', 'SNMP_TIMEOUT', 1.0, floating=True)
+SNMP_TIMEOUT_MIN = constants.get_config(p, 'snmp', 'timeout_min', 'SNMP_TIMEOUT_MIN', 0.2, floating=True)
+SNMP_TIMEOUT_MAX = constants.get_config(p, 'snmp', 'timeout_max', 'SNMP_TIMEOUT_MAX', 10.0, floating=True)
+SNMP_RETRIES = constants.get_config(p, 'snmp', 'retries', 'SNMP_RETRIES', 5, integer=True)
+SNMP_MAX_VAR_BINDS = constants.get_config(p, 'snmp', 'max_var_binds', 'SNMP_MAX_VAR_BINDS', 64, integer=True)
+SNMP_MAX_MESSAGE_SIZE = constants.get_config(p, 'snmp', 'max_message_size', 'SNMP_MAX_MESSAGE_SIZE', 1472, integer=True)
+SNMP_WALK_CACHE_TTL = constants.get_config(p, 'snmp', 'walk_cache_ttl', 'SNMP_WALK_CACHE_TTL', 0, integer=True)
+SNMP_WALK_CACHE_SIZE = constants.get_config(p, 'snmp', 'walk_cache_size', 'SNMP_WALK_CACHE_SIZE', 256, integer=True)
+SNMP_KEY_CACHE = constants.get_config(p, 'snmp', 'key_cache', 'SNMP_KEY_CACHE', False, boolean=True)
+SNMP_ENGINE_CACHE = constants.get_config(p, 'snmp', 'engine_cache', 'SNMP_ENGINE_CACHE', True, boolean=True)
+SNMP_INDEX_UPTIME_TOLERANCE = constants.get_config(p, 'snmp', 'index_uptime_tolerance', 'SNMP_INDEX_UPTIME_TOLERANCE', 10.0, floating=True)
+
+# Error status values from RFC 3416
+_ERROR_STATUS_TOO_BIG = 1
+
+# Initial max-repetitions for GETBULK before anything is learned about a host
+_DEFAULT_MAX_REPETITIONS = 10
+
+# Room left in a message for headers and security parameters
+_PDU_OVERHEAD = 100
+
+# Streaming walks pause while more than this many bytes wait for the module
+_STREAM_BACKLOG = 1024 * 1024
+
+# Command line of a module as run by Ansible: environment, interpreter,
+# module and the removal of its temporary directory. Values of the
+# environment may be quoted by the shell rules.
+_MODULE_COMMAND = re.compile(r'^((?:[A-Za-z_][A-Za-z0-9_]*=(?:[^\s\'"]|\'[^\']*\'|"(?:[^"\\]|\\.)*")*\s+)*)'
+                             r'(?:\S*/env\s+)?\S*python[0-9.]*\s+(\S+)'
+                             r'(?:\s*;\s*rm -rf (\S+) >/dev/null 2>&1)?\s*$')
+
+# Modules importing this line use nothing but the client library to talk SNMP.
+# SNMP_IN_PROCESS runs them inside the Ansible process instead of a python
+# of their own. Afterwards argv, sys.path, the standard streams, environment,
+# working directory, umask, locale, signal handlers and the modules they
+# imported are restored, but modules must not:
+#  - start threads or processes that outlive them
+#  - call syslog.openlog or set up logging
+#  - change modules that Ansible has imported itself, including os and sys
+#  - rely on atexit handlers, which are never run
+_IN_PROCESS_MARKER = '\nimport snmp_client'
+
+# Drift allowed between the clocks of a device and the controller, as a
+# fraction of the time since an interface index was saved
+_INDEX_CLOCK_DRIFT = 0.001
+
+# Bytes read from a pipe at a time
+_READ_SIZE = 65536
+
+_OID_SYS_UP_TIME = '1.3.6.1.2.1.1.3.0'
+_OID_IF_TABLE_LAST_CHANGE = '1.3.6.1.2.1.31.1.5.0'
+_OID_IF_NAME = '1.3.6.1.2.1.31.1.1.1.1'
+_OID_DOT1D_BASE_PORT_IF_INDEX = '1.3.6.1.2.1.17.1.4.1.2'
+
+# Tables which a SET invalidates the interface index for
+_INDEX_TABLES = [(1, 3, 6, 1, 2, 1, 2, 2), (1, 3, 6, 1, 2, 1, 31, 1, 1)]
 
 class Connection(object):
     """ SNMP based connections """
@@ -63,15 +161,15 @@ class Connection(object):
         self.port = port if port else 161
         self.has_pipelining = False
 
-    def _get_snmp_auth(self):
-        """ Get SNMP auth object """
+    def _get_snmp_auth_params(self):
+        """ Get SNMP authentication parameters """
 
         # If become_method is snmp we assume SNMPv3
         if not self.runner.become or self.runner.become_method != 'snmp':
             if SNMP_COMMUNITY is None:
                 raise errors.AnsibleError('Missing SNMP community or become_method is not snmp')
 
-            return cmdgen.CommunityData(SNMP_COMMUNITY)
+            return dict(community=SNMP_COMMUNITY)
 
         if self.runner.become_user is None:
             raise errors.AnsibleError('Missing become_user setting')
@@ -80,50 +178,70 @@ class Connection(object):
         auth_key = SNMP_AUTH_KEY
         if auth_key is None:
             auth_key = self.runner.become_pass
-        if SNMP_AUTH_PROTOCOL == 'md5':
-            auth_protocol = cmdgen.usmHMACMD5AuthProtocol
-        elif SNMP_AUTH_PROTOCOL == 'sha':
-            auth_protocol = cmdgen.usmHMACSHAAuthProtocol
-        elif SNMP_AUTH_PROTOCOL == 'none':
-            auth_protocol = cmdgen.usmNoAuthProtocol
+        if SNMP_AUTH_PROTOCOL == 'none':
             auth_key = None
-        else:
+        elif SNMP_AUTH_PROTOCOL not in _AUTH_PROTOCOLS:
             raise errors.AnsibleError('Unsupported SNMP authentication protocol: %s' % SNMP_AUTH_PROTOCOL)
 
         # Privacy protocol
         priv_key = SNMP_PRIV_KEY
         if priv_key is None:
             priv_key = self.runner.become_pass
-        if SNMP_PRIV_PROTOCOL == 'des':
-            priv_protocol = cmdgen.usmDESPrivProtocol
-        elif SNMP_PRIV_PROTOCOL == 'aes':
-            priv_protocol = cmdgen.usmAesCfb128Protocol
-        elif SNMP_PRIV_PROTOCOL == 'none':
-            priv_protocol = cmdgen.usmNoPrivProtocol
+        if SNMP_PRIV_PROTOCOL == 'none':
             priv_key = None
-        else:
+        elif SNMP_PRIV_PROTOCOL not in _PRIV_PROTOCOLS:
             raise errors.AnsibleError('Unsupported SNMP privacy protocol: %s' % SNMP_PRIV_PROTOCOL)
 
-        return cmdgen.UsmUserData(self.runner.become_user,
-                                  authProtocol=auth_protocol, authKey=auth_key,
-                                  privProtocol=priv_protocol, privKey=priv_key,
-                                  contextEngineId=SNMP_ENGINE_ID)
+        return dict(user=self.runner.become_user,
+                    auth_protocol=SNMP_AUTH_PROTOCOL, auth_key=auth_key,
+                    priv_protocol=SNMP_PRIV_PROTOCOL, priv_key=priv_key,
+                    engine_id=SNMP_ENGINE_ID)
+
+    def _get_snmp_key(self):
+        """ Get key identifying the host and authentication context """
+        return _snmp_key(self.host, self.port, self._get_snmp_auth_params())
 
     def _get_snmp_connection(self):
-        key = '%s:%d' % (self.host, self.port)
+        key = self._get_snmp_key()
         if key in _cache:
             return _cache[key]
 
-        conn = _SnmpConnection(self.host, self.port, self._get_snmp_auth())
+        conn = _SnmpConnection(self.host, self.port, self._get_snmp_auth_params(), key)
         _cache[key] = conn
         return conn
 
+    def _get_broker_path(self):
+        # A broker runs with the settings it was started with
+        return os.path.join(_get_state_dir(), 'broker-%s.sock' % _broker_config_key()[:16])
+
+    def _start_broker(self):
+        """ Make sure the broker is listening """
+        path = self._get_broker_path()
+        if _probe_broker(path):
+            return path
+
+        vvv('START BROKER %s' % path, host=self.host)
+        _spawn_broker(path)
+
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            if _probe_broker(path):
+                return path
+            time.sleep(0.05)
+
+        raise errors.AnsibleError('SNMP broker did not start: %s' % path)
+
     def connect(self, port=None):
         return self
 
     def exec_command(self, cmd, tmp_path, become_user=None, sudoable=False, executable='/bin/sh', in_data=None):
         if in_data:
             raise errors.AnsibleError('Internal Error: this modules does not support optimized module pipelining')
+
+        if SNMP_IN_PROCESS and not SNMP_BROKER:
+            res = self._exec_module_in_process(cmd)
+            if res is not None:
+                return res
        
         if executable:
             local_cmd = executable.split() + ['-c', cmd]
@@ -131,21 +249,28 @@ class Connection(object):
             local_cmd = cmd
         executable = executable.split()[0] if executable else None
 
-        pipe_to_server = os.pipe()
-        pipe_from_server = os.pipe()
-
         # os.environ is special, so we copy it into a dictionary and modify the dictionary instead
         env = dict()
         for key in os.environ.keys():
             env[key] = os.environ[key]
-        env['SNMP_PIPE_IN'] = str(pipe_from_server[0])
-        env['SNMP_PIPE_OUT'] = str(pipe_to_server[1])
 
         if 'PYTHONPATH' in env:
             env['PYTHONPATH'] = os.path.dirname(__file__) + ':' + env['PYTHONPATH']
         else:
             env['PYTHONPATH'] = os.path.dirname(__file__)
 
+        # Modules only import snmp_client, which does not read the Ansible configuration
+        env['SNMP_FRAMING'] = SNMP_FRAMING
+
+        if SNMP_BROKER:
+            return self._exec_command_broker(local_cmd, executable, env)
+
+        pipe_to_server = os.pipe()
+        pipe_from_server = os.pipe()
+
+        env['SNMP_PIPE_IN'] = str(pipe_from_server[0])
+        env['SNMP_PIPE_OUT'] = str(pipe_to_server[1])
+
         vvv('EXEC %s' % (local_cmd), host=self.host)
         p = subprocess.Popen(local_cmd,
                              shell=isinstance(local_cmd, basestring),
@@ -156,19 +281,20 @@ class Connection(object):
                              stderr=subprocess.PIPE,
                              env=env)
 
-        # pysnmp insist on using its own socket map, so we use that instead
         conn = self._get_snmp_connection()
-        sock_map = conn.dispatcher.getSocketMap()
-        stdout = _BufferedDispatcher(asyncore.file_wrapper(p.stdout.fileno()), map=sock_map)
-        stderr = _BufferedDispatcher(asyncore.file_wrapper(p.stderr.fileno()), map=sock_map)
-        server = _Server(conn, pipe_to_server[0], pipe_from_server[1], map=sock_map)
+        stdout = _BufferedDispatcher(p.stdout.fileno(), conn.loop)
+        stderr = _BufferedDispatcher(p.stderr.fileno(), conn.loop)
+        server = _Server(conn, pipe_to_server[0], pipe_from_server[1], conn.loop)
 
         while stdout.readable() or stderr.readable():
-            asyncore.poll(0.5, map=sock_map)
-            conn.dispatcher.handleTimerTick(time.time())
+            conn.loop.run_once()
 
         p.wait()
 
+        stdout.close()
+        stderr.close()
+        server.close()
+
         os.close(pipe_to_server[0])
         os.close(pipe_to_server[1])
         os.close(pipe_from_server[0])
@@ -176,6 +302,50 @@ class Connection(object):
         
         return (p.returncode, '', stdout.data, stderr.data)
 
+    def _exec_module_in_process(self, cmd):
+        """ Run a plain invocation of a client library module here, None for anything else """
+        match = _MODULE_COMMAND.match(cmd)
+        if match is None:
+            return None
+        (assignments, module_path, tmp_path) = match.groups()
+
+        try:
+            with open(module_path) as f:
+                source = f.read()
+        except IOError:
+            return None
+        if _IN_PROCESS_MARKER not in source:
+            return None
+
+        env = dict(assignment.split('=', 1) for assignment in shlex.split(assignments))
+
+        vvv('EXEC IN PROCESS %s' % module_path, host=self.host)
+        try:
+            (rc, stdout, stderr) = _run_module(self._get_snmp_connection(), module_path, source, env)
+        finally:
+            if tmp_path is not None:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        return (rc, '', stdout, stderr)
+
+    def _exec_command_broker(self, local_cmd, executable, env):
+        """ Run module against the long-lived broker """
+        path = self._start_broker()
+        env['SNMP_SOCKET'] = path
+        env['SNMP_SESSION'] = _broker_call(path, 'open', self.host, self.port, self._get_snmp_auth_params())
+
+        vvv('EXEC %s' % (local_cmd), host=self.host)
+        p = subprocess.Popen(local_cmd,
+                             shell=isinstance(local_cmd, basestring),
+                             cwd=self.runner.basedir,
+                             executable=executable,
+                             stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             env=env)
+
+        (stdout, stderr) = p.communicate()
+        return (p.returncode, '', stdout, stderr)
+
     def _transfer_file(self, in_path, out_path):
         """ transfer a file from local to local """
         if not os.path.exists(in_path):
@@ -199,178 +369,1537 @@ class Connection(object):
     def close(self):
         pass
 
-class _SnmpConnection(object):
-    def __init__(self, host, port, auth):
+_AUTH_PROTOCOLS = dict(md5=cmdgen.usmHMACMD5AuthProtocol,
+                       sha=cmdgen.usmHMACSHAAuthProtocol,
+                       none=cmdgen.usmNoAuthProtocol)
+
+_PRIV_PROTOCOLS = dict(des=cmdgen.usmDESPrivProtocol,
+                       aes=cmdgen.usmAesCfb128Protocol,
+                       none=cmdgen.usmNoPrivProtocol)
+
+def _snmp_key(host, port, auth_params):
+    """ Get key identifying a host and authentication context """
+    data = json.dumps([host, port, auth_params], sort_keys=True)
+    return hashlib.sha1(data).hexdigest()
+
+def _broker_config_key():
+    """ Get key identifying the settings a broker serves sessions with """
+    settings = sorted((name, value) for name, value in globals().items() if name.startswith('SNMP_'))
+    return hashlib.sha1(json.dumps(settings)).hexdigest()
+
+def _build_snmp_auth(params):
+    """ Build pysnmp auth object from authentication parameters """
+    if 'community' in params:
+        return cmdgen.CommunityData(params['community'])
+
+    return cmdgen.UsmUserData(params['user'],
+                              authProtocol=_AUTH_PROTOCOLS[params['auth_protocol']], authKey=params['auth_key'],
+                              privProtocol=_PRIV_PROTOCOLS[params['priv_protocol']], privKey=params['priv_key'],
+                              contextEngineId=params['engine_id'])
+
+def _get_state_dir():
+    """ Get directory for sockets and other state, creating it if needed """
+    try:
+        os.makedirs(SNMP_STATE_DIR, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return SNMP_STATE_DIR
+
+def _write_state_file(path, data):
+    """ Atomically replace path with data as JSON, readable by the owner only """
+    tmp_path = '%s.%d' % (path, os.getpid())
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+    except:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _probe_broker(path):
+    """ Check whether a broker is accepting connections on path """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+def _broker_call(path, method, *params):
+    """ Call a method of the broker and return the result """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        pipe = sock.makefile('rwb')
+        pipe.write(json.dumps(dict(jsonrpc='2.0', method=method, params=params, id=1)) + '\n')
+        pipe.flush()
+        line = pipe.readline()
+    except socket.error as e:
+        raise errors.AnsibleError('SNMP broker failed: %s' % e)
+    finally:
+        sock.close()
+
+    if not line:
+        raise errors.AnsibleError('SNMP broker closed the connection')
+    reply = json.loads(line)
+    if 'error' in reply:
+        raise errors.AnsibleError('SNMP broker failed: %s' % reply['error']['message'])
+    return str(reply['result'])
+
+def _exit_status(code, stderr):
+    """ Get the exit status of sys.exit(code) as the interpreter would """
+    if code is None:
+        return 0
+    if isinstance(code, (int, long)):
+        return code
+    stderr.write('%s\n' % code)
+    return 1
+
+def _get_signal_handlers():
+    """ Get the handlers of all signals that can be caught """
+    handlers = dict()
+    for signum in range(1, signal.NSIG):
+        handler = signal.getsignal(signum)
+        if handler is not None and signum not in (signal.SIGKILL, signal.SIGSTOP):
+            handlers[signum] = handler
+    return handlers
+
+def _run_module(conn, path, source, env):
+    """ Run a module as if python had been started on it, returns (rc, stdout, stderr) """
+    code = compile(source, path, 'exec')
+    stdout = StringIO.StringIO()
+    stderr = StringIO.StringIO()
+    server = _LocalServer(conn)
+
+    saved_argv = sys.argv
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    saved_stdout = sys.stdout
+    saved_stderr = sys.stderr
+    saved_environ = dict(os.environ)
+    saved_cwd = os.getcwd()
+    saved_umask = os.umask(0o022)
+    saved_locale = locale.setlocale(locale.LC_ALL)
+    saved_signal_handlers = _get_signal_handlers()
+    client_class = snmp_client.SnmpClient
+    try:
+        os.umask(saved_umask)
+        sys.argv = [path]
+        sys.path.insert(0, os.path.dirname(path))
+        sys.stdout = stdout
+        sys.stderr = stderr
+        os.environ.update(env)
+        snmp_client.SnmpClient = functools.partial(_LocalClient, server)
+
+        rc = 0
+        try:
+            exec(code, dict(__name__='__main__', __file__=path))
+        except SystemExit as e:
+            rc = _exit_status(e.code, stderr)
+        except Exception:
+            stderr.write(traceback.format_exc())
+            rc = 1
+    finally:
+        snmp_client.SnmpClient = client_class
+        for signum, handler in _get_signal_handlers().items():
+            if handler != saved_signal_handlers.get(signum, handler):
+                signal.signal(signum, saved_signal_handlers[signum])
+        locale.setlocale(locale.LC_ALL, saved_locale)
+        os.umask(saved_umask)
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        sys.stdout = saved_stdout
+        sys.stderr = saved_stderr
+        for name in set(sys.modules) - saved_modules:
+            del sys.modules[name]
+        sys.path[:] = saved_path
+        sys.argv = saved_argv
+        server.close()
+
+    return (rc, stdout.getvalue(), stderr.getvalue())
+
+def _read_state(name):
+    """ Read a JSON file of the state directory, empty if unreadable """
+    try:
+        with open(os.path.join(_get_state_dir(), name)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return dict()
+
+def _update_state(name, update):
+    """ Apply update to a JSON file of the state directory, keeping entries written meanwhile """
+    data = _read_state(name)
+    update(data)
+
+    path = os.path.join(_get_state_dir(), name)
+    try:
+        _write_state_file(path, data)
+    except (IOError, OSError) as e:
+        syslog.syslog(syslog.LOG_WARNING, 'Failed to save %s: %s' % (path, e))
+
+def _spawn_broker(path):
+    """ Start a detached broker process """
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+
+        # Do not keep pipes of the Ansible worker alive
+        os.closerange(3, subprocess.MAXFD)
+        null = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(null, fd)
+        os.close(null)
+
+        broker = _Broker(path)
+        broker.serve()
+    except Exception:
+        syslog.syslog(syslog.LOG_ERR, 'SNMP broker failed: %s' % traceback.format_exc())
+    finally:
+        os._exit(0)
+
+class _Broker(object):
+    """ Long-lived process serving SNMP sessions to the modules of every host """
+
+    def __init__(self, path):
+        self._path = path
+        self._servers = set()
+        self._sessions = dict()
+
+        # Time each session was last opened, attached or left
+        self._last_used = dict()
+
+    def _listen(self):
+        """ Bind the socket unless another broker beat us to it """
+        lock = open(self._path + '.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if _probe_broker(self._path):
+                return None
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(self._path)
+            os.chmod(self._path, 0o600)
+            sock.listen(64)
+            return sock
+        finally:
+            lock.close()
+
+    def serve(self):
+        sock = self._listen()
+        if sock is None:
+            return
+
+        listener = _ListenDispatcher(sock, self)
+
+        last_active = time.time()
+        try:
+            while True:
+                _event_loop.run_once(max(0, last_active + SNMP_BROKER_IDLE_TIMEOUT - time.time()))
+                now = time.time()
+                self._expire(now - SNMP_BROKER_IDLE_TIMEOUT)
+
+                if self._servers or any(shared.dispatcher.jobsArePending() for shared in _snmp_engines):
+                    last_active = now
+                elif now - last_active > SNMP_BROKER_IDLE_TIMEOUT:
+                    break
+        finally:
+            listener.close()
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+
+    def _expire(self, deadline):
+        """ Close connections and drop sessions unused since deadline """
+        for server in list(self._servers):
+            if server.last_active < deadline:
+                server.close()
+
+        in_use = set(server.session_key() for server in self._servers)
+        for key, last_used in self._last_used.items():
+            if last_used < deadline and key not in in_use:
+                del self._sessions[key]
+                del self._last_used[key]
+
+    def open_session(self, host, port, auth_params):
+        """ Get the session key of a host, creating the session if needed """
+        key = _snmp_key(host, port, auth_params)
+        if key not in self._sessions:
+            self._sessions[key] = _SnmpConnection(host, port, auth_params, key)
+        self._last_used[key] = time.time()
+        return key
+
+    def get_session(self, key):
+        if key in self._sessions:
+            self._last_used[key] = time.time()
+        return self._sessions.get(key)
+
+    def add_server(self, server):
+        self._servers.add(server)
+
+    def remove_server(self, server):
+        self._servers.discard(server)
+        key = server.session_key()
+        if key in self._sessions:
+            self._last_used[key] = time.time()
+
+class _EventLoop(object):
+    """ poll() based event loop for the pipes and the pysnmp transports """
+
+    def __init__(self):
+        self._dispatchers = []
+        self._handlers = dict()
+        self._poller = select.poll()
+
+        # Events each descriptor is registered for with the poller
+        self._events = dict()
+
+        # Heap of [time, sequence, active] lists, see add_deadline
+        self._deadlines = []
+        self._sequence = 0
+
+        # Time of the last timer tick run
+        self._tick_time = None
+
+    def add_dispatcher(self, dispatcher):
+        """ Drive the transports and timers of a pysnmp dispatcher """
+        self._dispatchers.append(dispatcher)
+
+    def add(self, handler):
+        self._handlers[handler.fileno()] = handler
+
+    def remove(self, handler):
+        fd = handler.fileno()
+        if self._handlers.get(fd) is handler:
+            del self._handlers[fd]
+            self._unregister(fd)
+
+    def add_deadline(self, when):
+        """ Wake up no later than when, returns a handle for cancel_deadline """
+        self._sequence = self._sequence + 1
+        deadline = [when, self._sequence, True]
+        heapq.heappush(self._deadlines, deadline)
+        return deadline
+
+    def cancel_deadline(self, deadline):
+        deadline[2] = False
+
+    def _unregister(self, fd):
+        if self._events.pop(fd, None) is not None:
+            self._poller.unregister(fd)
+
+    def _tick(self, now):
+        """ Run the pysnmp timer ticks due by now, returns whether any ran """
+        if self._tick_time is None or now < self._tick_time:
+            # First run or the clock went backwards
+            self._tick_time = now
+            for dispatcher in self._dispatchers:
+                dispatcher.handleTimerTick(now)
+            return True
+
+        # Every tick counts, as pysnmp expires requests by tick number
+        ticked = False
+        while self._tick_time + SNMP_TIMER_RESOLUTION <= now:
+            self._tick_time = self._tick_time + SNMP_TIMER_RESOLUTION
+            for dispatcher in self._dispatchers:
+                dispatcher.handleTimerTick(self._tick_time)
+            ticked = True
+        return ticked
+
+    def _timeout(self, now, limit):
+        """ Seconds to sleep for at most, None meaning for good """
+        while self._deadlines and (not self._deadlines[0][2] or self._deadlines[0][0] <= now):
+            heapq.heappop(self._deadlines)
+
+        timeout = limit
+        if self._deadlines:
+            wait = self._deadlines[0][0] - now
+        elif any(dispatcher.jobsArePending() for dispatcher in self._dispatchers):
+            wait = self._tick_time + SNMP_TIMER_RESOLUTION - now
+        else:
+            return timeout
+        return wait if timeout is None else min(timeout, wait)
+
+    def _update_registrations(self):
+        handlers = dict()
+        for dispatcher in self._dispatchers:
+            handlers.update(dispatcher.getSocketMap())
+        handlers.update(self._handlers)
+
+        for fd in [fd for fd in self._events if fd not in handlers]:
+            self._unregister(fd)
+
+        for fd, handler in handlers.items():
+            events = 0
+            if handler.readable():
+                events = events | select.POLLIN | select.POLLPRI
+            if handler.writable():
+                events = events | select.POLLOUT
+            registered = self._events.get(fd)
+            if events == registered:
+                continue
+            if not events:
+                self._unregister(fd)
+            elif registered is None:
+                self._poller.register(fd, events)
+                self._events[fd] = events
+            else:
+                self._poller.modify(fd, events)
+                self._events[fd] = events
+        return handlers
+
+    def run_once(self, limit=None):
+        """ Wait for and handle events, sleeping for limit seconds at most """
+        now = time.time()
+        ticked = self._tick(now)
+        handlers = self._update_registrations()
+
+        # Timers may have completed requests without any descriptor to tell
+        timeout = 0 if ticked else self._timeout(now, limit)
+        try:
+            if timeout is None:
+                events = self._poller.poll()
+            else:
+                events = self._poller.poll(max(0, int(math.ceil(timeout * 1000))))
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+
+        for fd, flags in events:
+            handler = handlers.get(fd)
+            if handler is None:
+                continue
+            try:
+                if flags & select.POLLIN:
+                    handler.handle_read_event()
+                if flags & select.POLLOUT:
+                    handler.handle_write_event()
+                if flags & select.POLLPRI:
+                    handler.handle_expt_event()
+                if flags & (select.POLLHUP | select.POLLERR | select.POLLNVAL) and not flags & select.POLLIN:
+                    handler.handle_close()
+            except Exception:
+                handler.handle_error()
+
+        self._tick(time.time())
+
+# Event loop of the process, shared by all engines and pipes
+_event_loop = _EventLoop()
+
+class _FileDispatcher(object):
+    """ Non-blocking duplicate of a descriptor driven by an _EventLoop """
+
+    def __init__(self, fd, loop):
+        self._fd = os.dup(fd)
+        flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._loop = loop
+        self._closed = False
+        loop.add(self)
+
+    def fileno(self):
+        return self._fd
+
+    def readable(self):
+        return False
+
+    def writable(self):
+        return False
+
+    def recv(self, size):
+        """ Read data, returns None if nothing is available and '' at EOF """
+        try:
+            return os.read(self._fd, size)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return None
+            return ''
+
+    def send(self, data):
+        """ Write data, returns the number of bytes written """
+        try:
+            return os.write(self._fd, data)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            # The reader is gone, there is no point in keeping the data
+            self.close()
+            return 0
+
+    def handle_read_event(self):
+        pass
+
+    def handle_write_event(self):
+        pass
+
+    def handle_expt_event(self):
+        pass
+
+    def handle_close(self):
+        # Readers see the hang-up as end of file
+        if self.readable():
+            self.handle_read_event()
+        else:
+            self.close()
+
+    def handle_error(self):
+        syslog.syslog(syslog.LOG_ERR, 'SNMP connection plugin: %s' % traceback.format_exc())
+        self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._loop.remove(self)
+        os.close(self._fd)
+
+class _ListenDispatcher(_FileDispatcher):
+    def __init__(self, sock, broker):
+        _FileDispatcher.__init__(self, sock.fileno(), _event_loop)
+        self._sock = socket.fromfd(self._fd, socket.AF_UNIX, socket.SOCK_STREAM)
+        self._broker = broker
+
+    def readable(self):
+        return True
+
+    def handle_read_event(self):
+        try:
+            (sock, address) = self._sock.accept()
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNABORTED):
+                return
+            raise
+
+        # The dispatchers duplicate the descriptor, so the socket can be closed
+        server = _Server(None, sock.fileno(), sock.fileno(), _event_loop,
+                         on_close=self._broker.remove_server, broker=self._broker)
+        self._broker.add_server(server)
+        sock.close()
+
+    def close(self):
+        if not self._closed:
+            self._sock.close()
+        _FileDispatcher.close(self)
+
+def _error_indication_is(error_indication, name):
+    """ Check error indication against a name from pysnmp.proto.errind """
+    if errind is not None and error_indication is getattr(errind, name, None):
+        return True
+    return error_indication == name
+
+def _estimate_size(var_binds):
+    """ Rough estimate of the encoded size of var-binds in bytes """
+    size = 0
+    for name, value in var_binds:
+        size = size + len(name) + 4
+        if isinstance(value, univ.OctetString):
+            size = size + len(value) + 2
+        else:
+            size = size + 6
+    return size
+
+class _OidTrie(object):
+    """ Index of values by OID, given as tuples of sub-identifiers """
+
+    def __init__(self):
+        # Each node is a [value, children] list
+        self._root = [_NO_VALUE, dict()]
+
+    def _find(self, oid, create=False):
+        node = self._root
+        for subid in oid:
+            child = node[1].get(subid)
+            if child is None:
+                if not create:
+                    return None
+                child = [_NO_VALUE, dict()]
+                node[1][subid] = child
+            node = child
+        return node
+
+    def get(self, oid, default=None):
+        node = self._find(oid)
+        if node is None or node[0] is _NO_VALUE:
+            return default
+        return node[0]
+
+    def add(self, oid, value):
+        self._find(oid, create=True)[0] = value
+
+    def remove(self, oid):
+        """ Remove the value of oid, pruning nodes left empty """
+        path = [self._root]
+        for subid in oid:
+            node = path[-1][1].get(subid)
+            if node is None:
+                return
+            path.append(node)
+
+        path[-1][0] = _NO_VALUE
+        for i in xrange(len(oid), 0, -1):
+            node = path[i]
+            if node[0] is not _NO_VALUE or node[1]:
+                break
+            del path[i - 1][1][oid[i - 1]]
+
+    def prefixes(self, oid):
+        """ Get the values registered at oid and its prefixes """
+        values = []
+        node = self._root
+        if node[0] is not _NO_VALUE:
+            values.append(node[0])
+        for subid in oid:
+            node = node[1].get(subid)
+            if node is None:
+                break
+            if node[0] is not _NO_VALUE:
+                values.append(node[0])
+        return values
+
+    def subtree(self, oid):
+        """ Get the values registered at oid and below it """
+        values = []
+        node = self._find(oid)
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            if node[0] is not _NO_VALUE:
+                values.append(node[0])
+            stack.extend(node[1].values())
+        return values
+
+def _format_index(index):
+    """ Format the sub-identifiers of a row index as a dotted string """
+    return '.'.join([str(subid) for subid in index])
+
+def _copy_value(value):
+    if isinstance(value, SnmpValue):
+        return type(value)(value.value)
+    return value
+
+def _copy_walk(res):
+    """ Copy a walk result down to its values, so the cache cannot be changed through it """
+    copied = dict()
+    for index, row in res.items():
+        if isinstance(row, list):
+            copied[index] = [_copy_value(value) for value in row]
+        else:
+            copied[index] = _copy_value(row)
+    return copied
+
+class _WalkCache(object):
+    """ LRU cache of walk results expiring after ttl seconds """
+
+    def __init__(self, ttl, max_entries):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._generations = dict()
+        self._columns = dict()
+
+    def generation(self, conn_key):
+        return self._generations.get(conn_key, 0)
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        (expires, value) = entry
+        if expires < time.time():
+            self._forget(key)
+            return None
+
+        # Most recently used entries are kept at the end
+        self._entries[key] = entry
+        return _copy_walk(value)
+
+    def put(self, key, value, generation):
+        if self._ttl <= 0 or generation != self.generation(key[0]):
+            return
+
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + self._ttl, _copy_walk(value))
+
+        columns = self._columns.get(key[0])
+        if columns is None:
+            columns = self._columns[key[0]] = _OidTrie()
+        for column in key[1]:
+            keys = columns.get(column)
+            if keys is None:
+                keys = set()
+                columns.add(column, keys)
+            keys.add(key)
+
+        while len(self._entries) > self._max_entries:
+            (oldest, entry) = self._entries.popitem(last=False)
+            self._forget(oldest)
+
+    def _forget(self, key):
+        """ Drop an entry that may already be gone from the LRU """
+        self._entries.pop(key, None)
+
+        columns = self._columns.get(key[0])
+        if columns is None:
+            return
+        for column in key[1]:
+            keys = columns.get(column)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    columns.remove(column)
+
+    def invalidate(self, conn_key, object_ids):
+        """ Drop cached walks of a connection overlapping any of object_ids """
+        self._generations[conn_key] = self.generation(conn_key) + 1
+
+        columns = self._columns.get(conn_key)
+        if columns is None:
+            return
+
+        stale = set()
+        for object_id in object_ids:
+            for keys in columns.prefixes(object_id) + columns.subtree(object_id):
+                stale.update(keys)
+        for key in stale:
+            self._forget(key)
+
+_walk_cache = _WalkCache(SNMP_WALK_CACHE_TTL, SNMP_WALK_CACHE_SIZE)
+
+class _InterfaceIndex(object):
+    """ Mapping of ifIndex to ifName and dot1dBasePort of a device, saved across runs """
+
+    def __init__(self, sys_up_time, if_table_last_change, rows, saved_at):
+        self.sys_up_time = sys_up_time
+        self.if_table_last_change = if_table_last_change
+        self.rows = rows
+        self.saved_at = saved_at
+
+    def is_valid(self, sys_up_time, if_table_last_change, now):
+        if sys_up_time is None or if_table_last_change is None:
+            return False
+        if self.if_table_last_change != if_table_last_change:
+            return False
+
+        # sysUpTime counts hundredths of a second
+        elapsed = now - self.saved_at
+        if elapsed < 0:
+            return False
+        tolerance = SNMP_INDEX_UPTIME_TOLERANCE + elapsed * _INDEX_CLOCK_DRIFT
+        return abs((sys_up_time - self.sys_up_time) / 100.0 - elapsed) <= tolerance
+
+    @staticmethod
+    def _path(key):
+        return os.path.join(_get_state_dir(), 'index-%s.json' % key)
+
+    @classmethod
+    def load(cls, key):
+        try:
+            with open(cls._path(key)) as f:
+                data = json.load(f)
+            return cls(data['sys_up_time'], data['if_table_last_change'], data['rows'], data['saved_at'])
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, key):
+        _write_state_file(self._path(key), dict(sys_up_time=self.sys_up_time,
+                                                if_table_last_change=self.if_table_last_change,
+                                                rows=self.rows,
+                                                saved_at=self.saved_at))
+
+    @classmethod
+    def remove(cls, key):
+        try:
+            os.unlink(cls._path(key))
+        except OSError:
+            pass
+
+class _RttEstimator(object):
+    """ Retransmission timeout of a host from its round-trip times, as in RFC 6298 """
+
+    def __init__(self, initial, floor, ceiling, granularity):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+        self._floor = floor
+        self._ceiling = ceiling
+        self._granularity = granularity
+        self._sequence = 0
+        self._backoff_sequence = 0
+        self._clamp()
+
+    def _clamp(self):
+        self.rto = min(max(self.rto, self._floor), self._ceiling)
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = self.srtt + max(self._granularity, 4 * self.rttvar)
+        self._clamp()
+
+    def transmitted(self):
+        """ Number a transmission, to be passed to backoff if it times out """
+        self._sequence = self._sequence + 1
+        return self._sequence
+
+    def backoff(self, sequence):
+        """ Double the timeout, unless the transmission was sent before the last backoff """
+        if sequence <= self._backoff_sequence:
+            return
+        self._backoff_sequence = self._sequence
+        self.rto = self.rto * 2
+        self._clamp()
+
+def _key_octets(value):
+    """ Get the octets of a passphrase, key, protocol or engine ID """
+    if value is None:
+        return ''
+    if hasattr(value, 'asOctets'):
+        return value.asOctets()
+    if hasattr(value, 'asTuple'):
+        value = value.asTuple()
+    if isinstance(value, tuple):
+        return '.'.join([str(subid) for subid in value])
+    return str(value)
+
+class _UsmKeyCache(object):
+    """ Cache of hashed passphrases and localized keys of USM users """
+
+    def __init__(self, persist):
+        self._persist = persist
+        self._keys = None
+
+    def _read(self):
+        """ Read the saved keys as their octets and whether they are OctetStrings """
+        keys = dict()
+        try:
+            for digest, entry in _read_state('usm-keys.json').items():
+                if isinstance(entry, list):
+                    keys[digest] = (base64.b64decode(entry[0]), entry[1] == 'OctetString')
+                else:
+                    keys[digest] = (base64.b64decode(entry), False)
+        except (TypeError, AttributeError, IndexError):
+            return dict()
+        return keys
+
+    def _write(self):
+        keys = dict()
+        for digest, (octets, octet_string) in self._keys.items():
+            if octet_string:
+                keys[digest] = [base64.b64encode(octets), 'OctetString']
+            else:
+                keys[digest] = base64.b64encode(octets)
+        _update_state('usm-keys.json', lambda data: data.update(keys))
+
+    def get(self, compute, *parts):
+        """ Get a key as the type compute returns, computing it if it is not cached """
+        if self._keys is None:
+            self._keys = self._read() if self._persist else dict()
+
+        digest = hashlib.sha256(''.join(['%d:%s' % (len(part), part) for part in map(_key_octets, parts)])).hexdigest()
+        entry = self._keys.get(digest)
+        if entry is None:
+            key = compute()
+            if key is None:
+                # No key at all without authentication or privacy
+                return None
+            entry = (_key_octets(key), isinstance(key, univ.OctetString))
+            self._keys[digest] = entry
+            if self._persist:
+                self._write()
+
+        (octets, octet_string) = entry
+        if octet_string:
+            return univ.OctetString(octets)
+        return octets
+
+_usm_key_cache = _UsmKeyCache(SNMP_KEY_CACHE)
+
+class _EngineStateStore(object):
+    """ Authoritative engine ID, boots and time of hosts, saved across runs """
+
+    _NAME = 'usm-engines.json'
+
+    def __init__(self, persist):
+        self._persist = persist
+        self._states = None
+
+    def _load(self):
+        if self._states is None:
+            self._states = _read_state(self._NAME) if self._persist else dict()
+
+    def get(self, address):
+        """ Get (engine_id, context_engine_id, context_name, boots, time) """
+        self._load()
+        state = self._states.get('%s:%s' % address)
+        if state is None:
+            return None
+
+        try:
+            engine_time = state['time'] + max(0, int(time.time()) - state['saved'])
+            return (base64.b64decode(state['engine_id']), base64.b64decode(state['context_engine_id']),
+                    base64.b64decode(state['context_name']), state['boots'], engine_time)
+        except (KeyError, TypeError):
+            return None
+
+    def put(self, address, engine_id, context_engine_id, context_name, boots, engine_time):
+        self._load()
+        key = '%s:%s' % address
+        state = dict(engine_id=base64.b64encode(engine_id),
+                     context_engine_id=base64.b64encode(context_engine_id),
+                     context_name=base64.b64encode(context_name),
+                     boots=boots, time=engine_time, saved=int(time.time()))
+        self._states[key] = state
+        if self._persist:
+            _update_state(self._NAME, lambda data: data.__setitem__(key, state))
+
+    def remove(self, address):
+        self._load()
+        key = '%s:%s' % address
+        self._states.pop(key, None)
+        if self._persist:
+            _update_state(self._NAME, lambda data: data.pop(key, None))
+
+_engine_state_store = _EngineStateStore(SNMP_ENGINE_CACHE)
+
+def _get_usm_state(snmp_engine):
+    """ Get the engine ID cache and timeline of an engine, None if pysnmp keeps them elsewhere """
+    try:
+        engine_ids = snmp_engine.messageProcessingSubsystems[3]._SnmpV3MessageProcessingModel__engineIdCache
+        timeline = snmp_engine.securityModels[3]._SnmpUSMSecurityModel__timeline
+    except (KeyError, AttributeError):
+        return None
+    return (engine_ids, timeline)
+
+class _CachedAuthService(object):
+    """ Authentication service of pysnmp taking its keys from the key cache """
+
+    def __init__(self, service):
+        self._service = service
+
+    def __getattr__(self, name):
+        return getattr(self._service, name)
+
+    def hashPassphrase(self, authKey):
+        return _usm_key_cache.get(lambda: self._service.hashPassphrase(authKey),
+                                  'hash', self._service.serviceID, authKey)
+
+    def localizeKey(self, authKey, snmpEngineID):
+        return _usm_key_cache.get(lambda: self._service.localizeKey(authKey, snmpEngineID),
+                                  'localize', self._service.serviceID, authKey, snmpEngineID)
+
+class _CachedPrivService(object):
+    """ Privacy service of pysnmp taking its keys from the key cache """
+
+    def __init__(self, service):
+        self._service = service
+
+    def __getattr__(self, name):
+        return getattr(self._service, name)
+
+    def hashPassphrase(self, authProtocol, privKey):
+        return _usm_key_cache.get(lambda: self._service.hashPassphrase(authProtocol, privKey),
+                                  'hash', self._service.serviceID, authProtocol, privKey)
+
+    def localizeKey(self, authProtocol, privKey, snmpEngineID):
+        return _usm_key_cache.get(lambda: self._service.localizeKey(authProtocol, privKey, snmpEngineID),
+                                  'localize', self._service.serviceID, authProtocol, privKey, snmpEngineID)
+
+def _install_usm_key_cache():
+    """ Make pysnmp localize USM keys through the key cache """
+    for services, wrapper in ((config.authServices, _CachedAuthService),
+                              (config.privServices, _CachedPrivService),
+                              (usm.SnmpUSMSecurityModel.authServices, _CachedAuthService),
+                              (usm.SnmpUSMSecurityModel.privServices, _CachedPrivService)):
+        for service_id, service in services.items():
+            if not isinstance(service, wrapper):
+                services[service_id] = wrapper(service)
+
+class _SnmpEngine(object):
+    """ SNMP engine and dispatcher shared by connections to many hosts """
+
+    def __init__(self):
+        _install_usm_key_cache()
         self.dispatcher = dispatch.AsynsockDispatcher()
+        self.dispatcher.setTimerResolution(SNMP_TIMER_RESOLUTION)
         self.engine = engine.SnmpEngine()
         self.engine.registerTransportDispatcher(self.dispatcher)
         self.generator = cmdgen.AsynCommandGenerator(self.engine)
-        self.auth = auth
-        self.transport = cmdgen.UdpTransportTarget((host, port))
+        self._users = dict()
+        _event_loop.add_dispatcher(self.dispatcher)
+
+    def accepts(self, auth_params):
+        """ Check whether an authentication context can use the engine """
+        if 'user' not in auth_params:
+            return True
+        keys = self._users.get((auth_params['user'], auth_params['engine_id']))
+        return keys is None or keys == _usm_keys(auth_params)
+
+    def add_user(self, auth_params):
+        if 'user' in auth_params:
+            self._users[(auth_params['user'], auth_params['engine_id'])] = _usm_keys(auth_params)
+
+def _usm_keys(auth_params):
+    return (auth_params['auth_protocol'], auth_params['auth_key'],
+            auth_params['priv_protocol'], auth_params['priv_key'])
+
+def _get_snmp_engine(auth_params):
+    """ Get a shared engine usable with an authentication context """
+    for shared in _snmp_engines:
+        if shared.accepts(auth_params):
+            break
+    else:
+        shared = _SnmpEngine()
+        _snmp_engines.append(shared)
+
+    shared.add_user(auth_params)
+    return shared
+
+class _SnmpConnection(object):
+    def __init__(self, host, port, auth_params, key):
+        self.key = key
+        shared = _get_snmp_engine(auth_params)
+        self.dispatcher = shared.dispatcher
+        self.engine = shared.engine
+        self.generator = shared.generator
+        self.loop = _event_loop
+        self.auth = _build_snmp_auth(auth_params)
+
+        # Retransmissions are done here, so each one can get its own timeout
+        self.rtt = _RttEstimator(SNMP_TIMEOUT, SNMP_TIMEOUT_MIN, SNMP_TIMEOUT_MAX, SNMP_TIMER_RESOLUTION)
+        self.transport = cmdgen.UdpTransportTarget((host, port), timeout=SNMP_TIMEOUT, retries=0)
+        self._timeout = None
+
+        # Engine discovery is skipped if the engine of the host is known
+        self._usm_state = _get_usm_state(self.engine) if 'user' in auth_params else None
+        self._engine_state = None
+        self._engine_state_restored = False
+        if self._usm_state is not None:
+            self._restore_engine_state()
+
+        # Learned from previous requests against the host
+        self.max_repetitions = _DEFAULT_MAX_REPETITIONS
+        self.max_message_size = SNMP_MAX_MESSAGE_SIZE
+        self.max_var_binds = SNMP_MAX_VAR_BINDS
+        self._var_bind_size = None
+
+        self.interface_index = None
+
+    def update_max_repetitions(self, requested, received, size, truncated):
+        """ Adapt max-repetitions after a successful GETBULK """
+        if truncated:
+            # The agent cut the response to fit its message size
+            self.max_repetitions = max(1, received)
+            self.max_message_size = min(self.max_message_size, max(size, 484))
+            return
+
+        if received < requested or received == 0:
+            return
+
+        per_repetition = float(size) / received
+        self._var_bind_size = per_repetition
+        limit = int(self.max_message_size / per_repetition)
+        self.max_repetitions = max(1, min(requested * 2, limit, SNMP_MAX_REPETITIONS))
+
+    def reduce_max_repetitions(self, too_big=False):
+        """ Back off after tooBig or a timeout, returns False at the minimum """
+        if self.max_repetitions <= 1:
+            return False
+        if too_big and self._var_bind_size is not None:
+            # The agent cannot send this many, so never grow back to it
+            self.max_message_size = min(self.max_message_size, int(self._var_bind_size * self.max_repetitions) - 1)
+        self.max_repetitions = max(1, self.max_repetitions // 2)
+        return True
+
+    def _apply_timeout(self):
+        """ Make the target use the current retransmission timeout """
+        resolution = self.dispatcher.getTimerResolution()
+        timeout = int(math.ceil(self.rtt.rto / resolution)) * resolution
+        if timeout == self._timeout:
+            return
+
+        self._timeout = timeout
+        self.transport.timeout = timeout
+        (addr_name, params_name) = self.generator.cfgCmdGen(self.auth, self.transport)
+        config.addTargetAddr(self.engine, addr_name,
+                             self.transport.transportDomain, self.transport.transportAddr,
+                             params_name, int(round(timeout * 100)), 0, self.transport.tagList)
+
+    def _restore_engine_state(self):
+        """ Seed pysnmp with the saved engine state of the host """
+        (engine_ids, timeline) = self._usm_state
+        key = (self.transport.transportDomain, self.transport.transportAddr)
+        if key in engine_ids:
+            return
+
+        state = _engine_state_store.get(self.transport.transportAddr)
+        if state is None:
+            return
+
+        (engine_id, context_engine_id, context_name, boots, engine_time) = state
+        engine_ids[key] = dict(securityEngineId=univ.OctetString(engine_id),
+                               contextEngineId=univ.OctetString(context_engine_id),
+                               contextName=univ.OctetString(context_name))
+        timeline[univ.OctetString(engine_id)] = (boots, engine_time, engine_time, int(time.time()))
+        self._engine_state = (engine_id, boots)
+        self._engine_state_restored = True
+
+    def _save_engine_state(self):
+        """ Save the engine state of the host once pysnmp has discovered it """
+        (engine_ids, timeline) = self._usm_state
+        peer = engine_ids.get((self.transport.transportDomain, self.transport.transportAddr))
+        if peer is None:
+            return
+
+        engine_id = peer['securityEngineId']
+        if engine_id not in timeline:
+            return
+        (boots, engine_time, latest_received_time, updated) = timeline[engine_id]
+
+        state = (_key_octets(engine_id), int(boots))
+        if state != self._engine_state:
+            self._engine_state = state
+            _engine_state_store.put(self.transport.transportAddr, state[0], _key_octets(peer['contextEngineId']),
+                                    _key_octets(peer['contextName']), state[1], int(engine_time) + int(time.time()) - updated)
+
+    def _forget_engine_state(self):
+        """ Drop the engine state of the host, so it is discovered again """
+        (engine_ids, timeline) = self._usm_state
+        peer = engine_ids.pop((self.transport.transportDomain, self.transport.transportAddr), None)
+        if peer is not None:
+            timeline.pop(peer['securityEngineId'], None)
+        _engine_state_store.remove(self.transport.transportAddr)
+        self._engine_state = None
+
+    def _request(self, send, callback):
+        """ Send a request, retransmitting it with backoff on timeouts """
+        (cb_fun, cb_ctx) = callback
+        retries = [SNMP_RETRIES]
+
+        def transmit():
+            self._apply_timeout()
+            sent = time.time()
+            sequence = self.rtt.transmitted()
+
+            # pysnmp times the request out on the first tick after the timeout
+            deadline = self.loop.add_deadline(sent + self._timeout + self.dispatcher.getTimerResolution())
+
+            def on_response(handle, error_indication, error_status, error_index, var_binds, ctx):
+                self.loop.cancel_deadline(deadline)
+                if _error_indication_is(error_indication, 'requestTimedOut'):
+                    self.rtt.backoff(sequence)
+                    if retries[0] > 0:
+                        retries[0] = retries[0] - 1
+                        transmit()
+                        return None
+                elif _error_indication_is(error_indication, 'notInTimeWindow') or \
+                     _error_indication_is(error_indication, 'unknownEngineID'):
+                    # The saved engine state is stale, so discover it once more
+                    if self._engine_state_restored:
+                        self._engine_state_restored = False
+                        self._forget_engine_state()
+                        transmit()
+                        return None
+                elif not error_indication:
+                    self.rtt.sample(time.time() - sent)
+                    if self._usm_state is not None:
+                        self._save_engine_state()
+                return cb_fun(handle, error_indication, error_status, error_index, var_binds, cb_ctx)
+
+            send((on_response, None))
+
+        transmit()
 
     def get(self, object_ids, callback):
-        self.generator.getCmd(self.auth, self.transport, object_ids, callback)
+        self._request(lambda cb: self.generator.getCmd(self.auth, self.transport, object_ids, cb), callback)
 
     def set(self, var_binds, callback):
-        self.generator.setCmd(self.auth, self.transport, var_binds, callback)
+        self._request(lambda cb: self.generator.setCmd(self.auth, self.transport, var_binds, cb), callback)
 
     def get_bulk(self, var_names, callback, non_repeaters=0, max_repetitions=10):
-        self.generator.bulkCmd(self.auth, self.transport, non_repeaters, max_repetitions, var_names, callback)
+        self._request(lambda cb: self.generator.bulkCmd(self.auth, self.transport, non_repeaters, max_repetitions, var_names, cb), callback)
+
+class _VarBindRequest(object):
+    """ GET or SET of var-bind groups packed into as few PDUs as the host allows """
 
-class _BufferedDispatcher(asyncore.file_dispatcher):
-    def __init__(self, fd, map=None):
-        asyncore.file_dispatcher.__init__(self, fd, map)
-        self.data = ''
+    def __init__(self, conn, groups, on_done, get=False):
+        self._conn = conn
+        self._groups = groups
+        self._on_done = on_done
+        self._get = get
+        self._pending = 0
+        self._error = None
+        self._var_binds = []
+
+    def start(self):
+        for pdu in self._partition(self._groups):
+            self._send(pdu, False)
+        if not self._pending:
+            self._on_done(None, self._var_binds)
+
+    def _partition(self, groups):
+        max_size = self._conn.max_message_size - _PDU_OVERHEAD
+        max_var_binds = self._conn.max_var_binds
+
+        pdus = []
+        pdu = []
+        size = 0
+        count = 0
+        for group in groups:
+            group_size = _estimate_size(group)
+            if pdu and (size + group_size > max_size or count + len(group) > max_var_binds):
+                pdus.append(pdu)
+                pdu = []
+                size = 0
+                count = 0
+            pdu.append(group)
+            size = size + group_size
+            count = count + len(group)
+        if pdu:
+            pdus.append(pdu)
+        return pdus
+
+    def _send(self, pdu, retried):
+        self._pending = self._pending + 1
+        var_binds = [var_bind for group in pdu for var_bind in group]
+        callback = (self._on_response, (pdu, retried))
+        if self._get:
+            self._conn.get([name for name, value in var_binds], callback)
+        else:
+            self._conn.set(var_binds, callback)
+
+    def _split(self, pdu, retried):
+        half = len(pdu) // 2
+        self._send(pdu[:half], retried)
+        self._send(pdu[half:], retried)
+
+    def _on_response(self, handle, error_indication, error_status, error_index, var_binds, ctx):
+        (pdu, retried) = ctx
+        self._pending = self._pending - 1
+
+        if self._error is None:
+            if error_indication:
+                # The response may have been lost as IP fragments, so try once with less
+                if _error_indication_is(error_indication, 'requestTimedOut') and \
+                   self._get and not retried and len(pdu) > 1:
+                    self._split(pdu, True)
+                    return
+                self._error = str(error_indication)
+            elif error_status:
+                if int(error_status) == _ERROR_STATUS_TOO_BIG and len(pdu) > 1:
+                    count = sum(len(group) for group in pdu)
+                    self._conn.max_var_binds = max(1, min(self._conn.max_var_binds, count // 2))
+                    self._split(pdu, retried)
+                    return
+                self._error = error_status.prettyPrint()
+            else:
+                self._var_binds.extend(var_binds)
+
+        if not self._pending:
+            self._on_done(self._error, self._var_binds)
+
+class _Walk(object):
+    """ Walk of one or more columns using GETBULK requests sized per host """
+
+    def __init__(self, conn, columns, on_var_binds, on_done, wait=None):
+        self._conn = conn
+        self._columns = [_oid_subids(column) for column in columns]
+        self._on_var_binds = on_var_binds
+        self._on_done = on_done
+        self._wait = wait
+
+        # Where to continue each column, None once the column is exhausted
+        self._next_object_ids = list(self._columns)
+        self._active = None
+        self._max_repetitions = None
+        self._timeout_retried = False
+        self._cancelled = False
+
+    def start(self):
+        self._request()
+
+    def cancel(self):
+        """ Stop the walk, dropping the response to a request in flight """
+        self._cancelled = True
+
+    def _request(self):
+        if self._cancelled:
+            return
+        self._active = [i for i, object_id in enumerate(self._next_object_ids) if object_id is not None]
+
+        # The learned max-repetitions is a var-bind budget shared by the columns
+        self._max_repetitions = max(1, self._conn.max_repetitions // len(self._active))
+        pysnmp_var_names = [rfc1902.ObjectName(self._next_object_ids[i]) for i in self._active]
+        self._conn.get_bulk(pysnmp_var_names, (self._on_response, None), max_repetitions=self._max_repetitions)
+
+    def _on_response(self, handle, error_indication, error_status, error_index, var_bind_table, ctx):
+        if self._cancelled:
+            return
+        width = len(self._active)
+        if error_indication:
+            # Large responses may get lost as IP fragments, so try once with less
+            if _error_indication_is(error_indication, 'requestTimedOut') and \
+               not self._timeout_retried and \
+               self._max_repetitions * width > _DEFAULT_MAX_REPETITIONS and \
+               self._conn.reduce_max_repetitions():
+                self._timeout_retried = True
+                self._request()
+                return
+            self._on_done(str(error_indication))
+        elif error_status:
+            if int(error_status) == _ERROR_STATUS_TOO_BIG and self._conn.reduce_max_repetitions(too_big=True):
+                self._request()
+                return
+            self._on_done(error_status.prettyPrint())
+        else:
+            var_binds = []
+            finished = set()
+            progressed = set()
+            size = 0
+            for row in var_bind_table:
+                size = size + _estimate_size(row)
+                for position, var_bind in enumerate(row):
+                    column = self._active[position]
+                    if column in finished:
+                        continue
+
+                    object_id = var_bind[0].asTuple()
+                    prefix = self._columns[column]
+                    if object_id[:len(prefix)] != prefix or \
+                       isinstance(var_bind[1], rfc1905.EndOfMibView):
+                        finished.add(column)
+                        continue
+
+                    var_binds.append((column, object_id[len(prefix):], var_bind[1]))
+                    self._next_object_ids[column] = object_id
+                    progressed.add(column)
+
+            for column in self._active:
+                if column in finished or column not in progressed:
+                    self._next_object_ids[column] = None
+
+            done = all(object_id is None for object_id in self._next_object_ids)
+            truncated = not done and len(var_bind_table) < self._max_repetitions
+            self._conn.update_max_repetitions(self._max_repetitions * width, len(var_bind_table) * width, size, truncated)
+
+            if var_binds:
+                self._on_var_binds(var_binds)
+
+            if done:
+                self._on_done(None)
+            elif self._wait is None or not self._wait(self._request):
+                self._request()
+
+class _BufferedDispatcher(_FileDispatcher):
+    def __init__(self, fd, loop):
+        _FileDispatcher.__init__(self, fd, loop)
+        self._buffer = bytearray()
         self._finished = False
 
-    def handle_expt(self):
-        pass
+    @property
+    def data(self):
+        return bytes(self._buffer)
 
-    def handle_read(self):
-        chunk = self.recv(1024)
+    def handle_read_event(self):
+        chunk = self.recv(_READ_SIZE)
         if chunk:
-            self.data = self.data + chunk
-        else:
+            self._buffer.extend(chunk)
+        elif chunk is not None:
             self._finished = True
 
     def readable(self):
         return not self._finished
 
-    def writable(self):
-        return False
-
-
-class _ReceiveDispatcher(asyncore.file_dispatcher):
-    def __init__(self, fd, server, map=None):
-        asyncore.file_dispatcher.__init__(self, fd, map)
+class _ReceiveDispatcher(_FileDispatcher):
+    def __init__(self, fd, server, loop):
+        _FileDispatcher.__init__(self, fd, loop)
         self._server = server
-        self._buffer = ''
+        self._buffer = bytearray()
         self._finished = False
 
+        # Newline terminated JSON until binary framing is negotiated
+        self.binary = False
+
     def readable(self):
         return not self._finished
 
-    def writable(self):
-        return False
-
-    def handle_expt(self):
-        pass
-
-    def handle_read(self):
-        chunk = self.recv(1024)
+    def handle_read_event(self):
+        chunk = self.recv(_READ_SIZE)
+        if chunk is None:
+            return
         if not chunk:
             self._finished = True
+            self._server.handle_eof()
             return
 
-        self._buffer = self._buffer + chunk
-        while True:
-            pos = self._buffer.find('\n')
-            if pos == -1:
-                break
-            line = self._buffer[:pos]
-            pos = pos + 1
-            self._buffer = self._buffer[pos:]
+        # Only the new data can contain a newline not seen before
+        search = len(self._buffer)
+        self._buffer.extend(chunk)
+
+        pos = 0
+        while not self._finished:
+            if self.binary:
+                if len(self._buffer) - pos < _FRAME_HEADER.size:
+                    break
+                (length,) = _FRAME_HEADER.unpack_from(self._buffer, pos)
+                end = pos + _FRAME_HEADER.size + length
+                if end > len(self._buffer):
+                    break
+                frame = bytes(self._buffer[pos + _FRAME_HEADER.size:end])
+                pos = end
+
+                self._server.handle_frame(frame)
+            else:
+                end = self._buffer.find(b'\n', max(search, pos))
+                if end == -1:
+                    break
+                line = bytes(self._buffer[pos:end])
+                pos = end + 1
 
-            self._server.handle_line(line)
+                self._server.handle_line(line)
 
-class _TransmitDispatcher(asyncore.file_dispatcher):
-    def __init__(self, fd, map=None):
-        asyncore.file_dispatcher.__init__(self, fd, map)
-        self._buffer = ''
+        if pos:
+            del self._buffer[:pos]
+
+class _TransmitDispatcher(_FileDispatcher):
+    def __init__(self, fd, loop):
+        _FileDispatcher.__init__(self, fd, loop)
+        self._buffer = bytearray()
+        self._offset = 0
+        self._drain_callbacks = []
 
     def send_line(self, line):
-        self._buffer = self._buffer + line + '\n'
+        self._buffer.extend(line)
+        self._buffer.extend(b'\n')
 
-    def readable(self):
-        return False
+    def send_frame(self, frame):
+        self._buffer.extend(_FRAME_HEADER.pack(len(frame)))
+        self._buffer.extend(frame)
 
-    def writable(self):
-        if self._buffer:
-            return True
-        else:
-            return False
+    def backlog(self):
+        """ Number of bytes not yet written """
+        return len(self._buffer) - self._offset
 
-    def handle_expt(self):
-        pass
+    def call_when_drained(self, callback):
+        """ Call callback once everything has been written """
+        self._drain_callbacks.append(callback)
 
-    def handle_write(self):
-        cnt = self.send(self._buffer)
-        self._buffer = self._buffer[cnt:]
-        pass
+    def writable(self):
+        return not self._closed and self.backlog() > 0
+
+    def handle_write_event(self):
+        # The view must not outlive the call, as the buffer cannot be resized while exported
+        cnt = self.send(memoryview(self._buffer)[self._offset:])
+        self._offset = self._offset + cnt
+
+        # Drop written data once it makes up most of the buffer, keeping it linear
+        if self._offset == len(self._buffer):
+            del self._buffer[:]
+            self._offset = 0
+        elif self._offset > _READ_SIZE and self._offset * 2 > len(self._buffer):
+            del self._buffer[:self._offset]
+            self._offset = 0
+
+        if not self.backlog() and self._drain_callbacks:
+            callbacks = self._drain_callbacks
+            self._drain_callbacks = []
+            for callback in callbacks:
+                callback()
 
-class _JsonRpcPeer(object):
-    def __init__(self):
-        pass
+class _Server(_JsonRpcPeer):
+    def __init__(self, conn, pipe_in, pipe_out, loop, on_close=None, broker=None):
+        self._conn = conn
+        self._broker = broker
+        self._receiver = None if pipe_in is None else _ReceiveDispatcher(pipe_in, self, loop)
+        self._transmitter = None if pipe_out is None else _TransmitDispatcher(pipe_out, loop)
+        self._on_close = on_close
+        self._closed = False
+        self.last_active = time.time()
+
+        # Walks of rpc_walk_stream in progress by request id
+        self._streams = dict()
 
     def transmit(self, json):
-        pass
+        if not self._closed:
+            self.last_active = time.time()
+            self._transmitter.send_line(json)
 
-    def serialize(self, value):
-        return json.dumps(value, default=self._default_hook)
+    def transmit_frame(self, frame):
+        if not self._closed:
+            self.last_active = time.time()
+            self._transmitter.send_frame(frame)
 
-    def unserialize(self, data):
-        return json.loads(data, object_hook=self._object_hook)
+    def session_key(self):
+        return None if self._conn is None else self._conn.key
 
-    def send(self, **kwargs):
-        self.transmit(self.serialize(kwargs) + '\n')
-
-    def _default_hook(self, o):
-        """ Convert object into JSON compatible objects """
-        if isinstance(o, OctetString):
-            return dict(__jsonclass__=['OctetString', base64.b64encode(o.value)])
-        if isinstance(o, Opaque):
-            return dict(__jsonclass__=['Opaque', self._default_hook(o.value)])
-        if isinstance(o, Integer32):
-            return dict(__jsonclass__=['Integer32', o.value])
-        if isinstance(o, SnmpValue):
-            return dict(__jsonclass__=[type(o).__name__, o.value])
-        raise ValueError('Unsupported object type: %s' % o.__class__.__name__)
-
-    def _object_hook(self, o):
-        """ Convert JSON data into objects """
-        if not isinstance(o, dict):
-            return o
-        if '__jsonclass__' in o:
-            data = o['__jsonclass__']
-            constructor = data[0]
-            if constructor == 'OctetString':
-                return OctetString(base64.b64decode(data[1]))
-            if constructor == 'ObjectIdentifier':
-                return ObjectIdentifier(data[1])
-            if constructor == 'Integer32':
-                return Integer32(data[1])
-            if constructor == 'IpAddress':
-                return IpAddress(data[1])
-            if constructor == 'Gauge32':
-                return Gauge32(data[1])
-            if constructor == 'TimeTicks':
-                return TimeTicks(data[1])
-            if constructor == 'Opaque':
-                return Opaque(self._object_hook(data[1]))
-            if constructor == 'Counter64':
-                return Counter64(data[1])
-            raise ValueError('Unsupported object type: %s' % constructor)
-        return o
+    def _backlog(self):
+        """ Bytes of replies the module has yet to read """
+        return self._transmitter.backlog()
 
-class _Server(_JsonRpcPeer):
-    def __init__(self, conn, pipe_in, pipe_out, map=None):
-        self._conn = conn
-        self._receiver = _ReceiveDispatcher(pipe_in, self, map)
-        self._transmitter = _TransmitDispatcher(pipe_out, map)
+    def handle_eof(self):
+        """ Peer closed its end, so no more requests will arrive """
+        if self._on_close is not None:
+            self.close()
 
-    def transmit(self, json):
-        self._transmitter.send(json)
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for walk in self._streams.values():
+            walk.cancel()
+        self._streams.clear()
+        if self._receiver is not None:
+            self._receiver.close()
+        if self._transmitter is not None:
+            self._transmitter.close()
+        if self._on_close is not None:
+            self._on_close(self)
 
     def handle_line(self, line):
-        request = self.unserialize(line)
+        self._dispatch(self.unserialize(line))
+
+    def handle_frame(self, frame):
+        self._dispatch(self._codec.decode(frame))
+
+    def _dispatch(self, request):
+        self.last_active = time.time()
         method = request['method']
         params = request['params']
         id = request['id']
         
         method_name = 'rpc_' + method
 
-        method = getattr(self, method_name)
-        method(id, *params)
+        method = getattr(self, method_name, None)
+        if method is None:
+            self._send_error(id, 'Unknown method: %s' % request['method'])
+            return
+
+        # Several requests may be in flight, so failures are reported per id
+        try:
+            method(id, *params)
+        except Exception as e:
+            self._send_error(id, str(e))
 
     def _send_result(self, id, result):
         self.send(jsonrpc='2.0', result=result, id=id)
@@ -378,213 +1907,293 @@ class _Server(_JsonRpcPeer):
     def _send_error(self, id, error):
         self.send(jsonrpc='2.0', error=dict(code=0, message=error), id=id)
 
+    def _send_partial(self, id, partial):
+        """ Send part of a streamed result, the final reply follows later """
+        self.send(jsonrpc='2.0', partial=partial, id=id)
+
     def _to_pysnmp(self, value):
         """ Convert connection plugin object into pysnmp objects """
-        if value is None:
-            return None
-        if isinstance(value, OctetString):
-            return rfc1902.OctetString(str(value.value))
-        if isinstance(value, ObjectIdentifier):
-            return rfc1902.ObjectName(str(value.value))
-        if isinstance(value, Integer32):
-            return rfc1902.Integer32(int(value.value))
-        if isinstance(value, Counter32):
-            return rfc1902.Counter32(long(value.value))
-        if isinstance(value, IpAddress):
-            return rfc1902.IpAddress(str(value.value))
-        if isinstance(value, Gauge32):
-            return rfc1902.Gauge32(long(value.value))
-        if isinstance(value, TimeTicks):
-            return rfc1902.TimeTicks(long(value.value))
-        if isinstance(value, Opaque):
-            return rfc1902.Opaque(value.value) # FIXME
-        if isinstance(value, Counter64):
-            return rfc1902.Counter64(str(value.value))
-        raise SnmpError('Invalid type: %s' % value.__class__.__name__)
+        return _snmp_types.to_pysnmp(value)
 
     def _from_pysnmp(self, value):
         """ Convert pysnmp objects into connection plugin objects """
-        if value is None:
-            return None
-        if isinstance(value, rfc1902.OctetString):
-            return OctetString(str(value))
-        if isinstance(value, rfc1902.ObjectName):
-            return ObjectIdentifier(str(value))
-        if isinstance(value, univ.Integer):
-            return Integer32(int(value))
-        if isinstance(value, rfc1902.Counter32):
-            return Counter32(long(value))
-        if isinstance(value, rfc1902.IpAddress):
-            return IpAddress(str(value))
-        if isinstance(value, rfc1902.Gauge32):
-            return Gauge32(long(value))
-        if isinstance(value, rfc1902.TimeTicks):
-            return TimeTicks(long(value))
-        if isinstance(value, rfc1902.Opaque):
-            return Opaque(str(value)) # FIXME
-        if isinstance(value, rfc1905.NoSuchObject):
-            return None
-        if isinstance(value, rfc1905.NoSuchInstance):
-            return None
-        if isinstance(value, rfc1905.EndOfMibView):
-            return None
-        raise SnmpError('Invalid type: %s' % type(value).__name__)
+        return _snmp_types.from_pysnmp(value)
+
+    def rpc_open(self, id, host, port, auth_params):
+        """ Open a session with a host on the broker, returns its key """
+        if self._broker is None:
+            raise SnmpError('Sessions are only supported by the broker')
+        auth_params = dict((str(name), value if value is None else str(value))
+                           for name, value in auth_params.items())
+        self._send_result(id, self._broker.open_session(str(host), port, auth_params))
+
+    def rpc_attach(self, id, key):
+        """ Send the following requests through an open session """
+        conn = None if self._broker is None else self._broker.get_session(key)
+        if conn is None:
+            raise SnmpError('Unknown session: %s' % key)
+        self._conn = conn
+        self._send_result(id, None)
+
+    def rpc_framing(self, id, *framings):
+        """ Switch to binary framing if offered, after replying in the old framing """
+        if 'binary' not in framings or self._receiver is None:
+            self._send_result(id, 'json')
+            return
+
+        self._send_result(id, 'binary')
+        self._use_binary_framing()
+        self._receiver.binary = True
 
     def rpc_get(self, id, *object_ids):
-        pysnmp_var_names = []
-        for object_id in object_ids:
-            pysnmp_var_names.append(rfc1902.ObjectName(str(object_id)))
-        self._conn.get(pysnmp_var_names, (self._on_rpc_get, id))
+        groups = [[(rfc1902.ObjectName(str(object_id)), None)] for object_id in object_ids]
+        _VarBindRequest(self._conn, groups, self._on_rpc_get(id), get=True).start()
+
+    def _on_rpc_get(self, id):
+        def on_done(error, var_binds):
+            if error is not None:
+                self._send_error(id, error)
+                return
 
-    def _on_rpc_get(self, handle, error_indication, error_status, error_index, var_binds, ctx):
-        id = ctx
-        if error_indication:
-            self._send_error(id, str(error_indication))
-        elif error_status:
-            self._send_error(id, error_status.prettyPrint())
-        else:
             res = dict()
             for var_bind in var_binds:
                 object_id = str(self._from_pysnmp(var_bind[0]))
                 res[object_id] = self._from_pysnmp(var_bind[1])
             self._send_result(id, res)
-
-    def rpc_set(self, id, var_binds):
-        pysnmp_var_binds = []
-        for object_id, value in var_binds.items():
-            pysnmp_var_binds.append((rfc1902.ObjectName(str(object_id)), self._to_pysnmp(value)))
-        self._conn.set(pysnmp_var_binds, (self._on_rpc_set, id))
-
-    def _on_rpc_set(self, handle, error_indication, error_status, error_index, var_binds, ctx):
-        id = ctx
-        if error_indication:
-            self._send_error(id, str(error_indication))
-        elif error_status:
-            self._send_error(id, error_status.prettyPrint())
-        else:
-            self._send_result(id, None)
-
-    def rpc_walk(self, id, object_id):
-        self._do_rpc_walk(id, str(object_id), str(object_id), dict())
-
-    def _do_rpc_walk(self, id, request_object_id, object_id, res):
-        pysnmp_var_names = [rfc1902.ObjectName(object_id)]
-        self._conn.get_bulk(pysnmp_var_names, (self._on_rpc_walk, (id, request_object_id, res)))
-
-    def _on_rpc_walk(self, handle, error_indication, error_status, error_index, var_bind_table, ctx):
-        (id, request_object_id, res) = ctx
-        if error_indication:
-            self._send_error(id, str(error_indication))
-        elif error_status:
-            self._send_error(id, error_status.prettyPrint())
-        else:
-            prefix_len = len(request_object_id)
-            last_object_id = None
-            for var_binds in var_bind_table:
-                for var_bind in var_binds:
-                    object_id = str(self._from_pysnmp(var_bind[0]))
-                    if object_id[:prefix_len] != request_object_id:
-                        self._send_result(id, res)
-                        return
-
-                    idx = object_id[(prefix_len + 1):]
-                    res[idx] = self._from_pysnmp(var_bind[1])
-                    last_object_id = object_id
-
-            if last_object_id is None:
-                self._send_result(id, res)
+        return on_done
+
+    def rpc_set(self, id, var_binds, atomic=True):
+        """ Set variables in one PDU if atomic, else var_binds may be a list of groups """
+        if isinstance(var_binds, dict):
+            # Without groups every variable may go in a PDU of its own
+            var_binds = [var_binds] if atomic else [dict([item]) for item in var_binds.items()]
+
+        groups = []
+        object_ids = []
+        for group in var_binds:
+            pysnmp_var_binds = []
+            for object_id, value in group.items():
+                pysnmp_var_binds.append((rfc1902.ObjectName(str(object_id)), self._to_pysnmp(value)))
+                object_ids.append(_oid_subids(object_id))
+            groups.append(pysnmp_var_binds)
+
+        if atomic:
+            groups = [[var_bind for group in groups for var_bind in group]]
+
+        # Even a failed SET may have changed something
+        _walk_cache.invalidate(self._conn.key, object_ids)
+        if any(object_id[:len(table)] == table for object_id in object_ids for table in _INDEX_TABLES):
+            self._conn.interface_index = None
+            _InterfaceIndex.remove(self._conn.key)
+        _VarBindRequest(self._conn, groups, self._on_rpc_set(id)).start()
+
+    def _on_rpc_set(self, id):
+        def on_done(error, var_binds):
+            if error is not None:
+                self._send_error(id, error)
             else:
-                self._do_rpc_walk(id, request_object_id, last_object_id, res)
-
-class SnmpError(Exception):
-    pass
-
-class SnmpValue(object):
-    def __init__(self, value):
-        self.value = value
+                self._send_result(id, None)
+        return on_done
 
-    def __str__(self):
-        return str(self.value)
+    def rpc_walk(self, id, object_id):
+        cache_key = (self._conn.key, (_oid_subids(object_id),))
+        res = _walk_cache.get(cache_key)
+        if res is not None:
+            self._send_result(id, res)
+            return
 
-class OctetString(SnmpValue):
-    def __init__(self, value):
-        self.value = str(value)
+        res = dict()
 
-class ObjectIdentifier(SnmpValue):
-    def __init__(self, value):
-        subids = []
-        for subid in str(value).split('.'):
-            subids.append(str(int(subid)))
-        self.value = '.'.join(subids)
+        def on_var_binds(var_binds):
+            for column, index, value in var_binds:
+                res[_format_index(index)] = self._from_pysnmp(value)
 
-class Integer32(SnmpValue):
-    def __init__(self, value):
-        self.value = int(value)
+        _Walk(self._conn, [object_id], on_var_binds, self._walk_done(id, res, cache_key)).start()
 
-    def __int__(self):
-        return self.value
+    def rpc_walk_table(self, id, columns):
+        """ Walk several columns at once and join the rows by index """
+        cache_key = (self._conn.key, tuple(_oid_subids(column) for column in columns))
+        res = _walk_cache.get(cache_key)
+        if res is not None:
+            self._send_result(id, res)
+            return
 
-    def __long__(self):
-        return self.value
+        res = dict()
+
+        def on_var_binds(var_binds):
+            for column, index, value in var_binds:
+                idx = _format_index(index)
+                row = res.get(idx)
+                if row is None:
+                    row = [None] * len(columns)
+                    res[idx] = row
+                row[column] = self._from_pysnmp(value)
+
+        _Walk(self._conn, columns, on_var_binds, self._walk_done(id, res, cache_key)).start()
+
+    def rpc_walk_stream(self, id, object_id):
+        """ Walk a subtree, sending the rows of each response as a partial reply """
+        def on_var_binds(var_binds):
+            chunk = []
+            for column, index, value in var_binds:
+                chunk.append([_format_index(index), self._from_pysnmp(value)])
+            self._send_partial(id, chunk)
+
+        def wait(resume):
+            if self._backlog() <= _STREAM_BACKLOG:
+                return False
+            self._transmitter.call_when_drained(resume)
+            return True
 
-class Counter32(SnmpValue):
-    def __init__(self, value):
-        self.value = long(value)
+        def on_done(error):
+            self._streams.pop(id, None)
+            if error is None:
+                self._send_result(id, None)
+            else:
+                self._send_error(id, error)
 
-    def __int__(self):
-        return self.value
+        walk = _Walk(self._conn, [object_id], on_var_binds, on_done, wait)
+        self._streams[id] = walk
+        walk.start()
 
-    def __long__(self):
-        return self.value
+    def rpc_cancel(self, id, stream_id):
+        """ Stop a walk of rpc_walk_stream, returns whether it was still going """
+        walk = self._streams.pop(stream_id, None)
+        if walk is not None:
+            walk.cancel()
+        self._send_result(id, walk is not None)
 
-class IpAddress(SnmpValue):
-    pass
+    def rpc_interface_index(self, id):
+        """ Map ifIndex to [ifName, dot1dBasePort], walking only if the saved index is outdated """
+        var_names = [rfc1902.ObjectName(_OID_SYS_UP_TIME), rfc1902.ObjectName(_OID_IF_TABLE_LAST_CHANGE)]
+        self._conn.get(var_names, (self._on_rpc_interface_index, id))
 
-class Gauge32(SnmpValue):
-    pass
+    def _on_rpc_interface_index(self, handle, error_indication, error_status, error_index, var_binds, ctx):
+        id = ctx
+        if error_indication:
+            self._send_error(id, str(error_indication))
+            return
+        elif error_status:
+            self._send_error(id, error_status.prettyPrint())
+            return
 
-class TimeTicks(SnmpValue):
-    pass
+        now = time.time()
+        stamp = []
+        for var_bind in var_binds:
+            value = self._from_pysnmp(var_bind[1])
+            stamp.append(None if value is None else long(value.value))
+        (sys_up_time, if_table_last_change) = stamp
+
+        index = self._conn.interface_index
+        if index is None:
+            index = _InterfaceIndex.load(self._conn.key)
+        if index is not None and index.is_valid(sys_up_time, if_table_last_change, now):
+            self._conn.interface_index = index
+            self._send_result(id, index.rows)
+            return
 
-class Opaque(SnmpValue):
-    pass
+        names = dict()
+        ports = dict()
+
+        def on_var_binds(var_binds):
+            for column, index, value in var_binds:
+                value = self._from_pysnmp(value)
+                if column == 0:
+                    names[_format_index(index)] = str(value)
+                else:
+                    ports[str(value)] = int(_format_index(index))
+
+        def on_done(error):
+            if error is not None:
+                self._send_error(id, error)
+                return
+
+            rows = dict()
+            for if_index, if_name in names.items():
+                rows[if_index] = [if_name, ports.get(if_index)]
+
+            index = _InterfaceIndex(sys_up_time, if_table_last_change, rows, now)
+            self._conn.interface_index = index
+            try:
+                index.save(self._conn.key)
+            except (IOError, OSError):
+                pass
+            self._send_result(id, rows)
+
+        _Walk(self._conn, [_OID_IF_NAME, _OID_DOT1D_BASE_PORT_IF_INDEX], on_var_binds, on_done).start()
+
+    def _walk_done(self, id, res, cache_key=None):
+        if cache_key is not None:
+            generation = _walk_cache.generation(cache_key[0])
+
+        def on_done(error):
+            if error is None:
+                if cache_key is not None:
+                    _walk_cache.put(cache_key, res, generation)
+                self._send_result(id, res)
+            else:
+                self._send_error(id, error)
+        return on_done
 
-class Counter64(SnmpValue):
-    pass
+def _plain_copy(value):
+    """ Copy a message as a round trip through JSON would, keeping SNMP values """
+    if isinstance(value, dict):
+        return dict((key if isinstance(key, basestring) else json.dumps(key), _plain_copy(item))
+                    for (key, item) in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_plain_copy(item) for item in value]
+    return value
 
-class SnmpClient(_JsonRpcPeer):
-    """ SNMP API for the modules """
+class _LocalServer(_Server):
+    """ Server passing copies of requests and replies to a module running in this process """
 
-    def __init__(self):
-        self._pipe_in = os.fdopen(int(os.getenv('SNMP_PIPE_IN')), 'rU')
-        self._pipe_out = os.fdopen(int(os.getenv('SNMP_PIPE_OUT')), 'w')
+    def __init__(self, conn):
+        _Server.__init__(self, conn, None, None, conn.loop)
+        self._client = None
 
-    def transmit(self, json):
-        self._pipe_out.write(json)
-        self._pipe_out.flush()
+    def connect(self, client):
+        self._client = client
 
-    def _call(self, method, *params):
-        self.send(jsonrpc='2.0', method=method, params=params, id=1)
-        line = self._pipe_in.readline()
-        result = self.unserialize(line)
+    def handle_request(self, request):
+        self._dispatch(_plain_copy(request))
 
-        if 'error' in result:
-            raise SnmpError(result['error']['message'])
+    def run_once(self):
+        self._conn.loop.run_once()
 
-        if 'result' in result:
-            return result['result']
+    def send(self, **kwargs):
+        if not self._closed and self._client is not None:
+            self._client._handle_reply(_plain_copy(kwargs))
 
-        return None
+    def _backlog(self):
+        # Replies are handed over right away
+        return 0
 
-    def get(self, *var_names):
-        """ Fetch SNMP variables """
-        return self._call('get', *var_names)
+    def close(self):
+        _Server.close(self)
+        self._client = None
 
-    def set(self, var_binds):
-        """ Set SNMP variables """
-        self._call('set', var_binds)
+class _LocalClient(SnmpClient):
+    """ Client of a module running in this process, see _run_module """
 
-    def walk(self, var_name):
-        """ Iterate SNMP variables """
-        return self._call('walk', var_name)
+    def __init__(self, server):
+        self._server = server
+        self._next_id = 1
+        self._pending = dict()
+        server.connect(self)
 
+    def send(self, **kwargs):
+        self._server.handle_request(kwargs)
+
+    def _receive(self):
+        self._server.run_once()
+
+_snmp_types.bind_pysnmp('OctetString', rfc1902.OctetString, [univ.OctetString])
+_snmp_types.bind_pysnmp('ObjectIdentifier', rfc1902.ObjectName, [univ.ObjectIdentifier], from_pysnmp=lambda value: value.asTuple())
+_snmp_types.bind_pysnmp('Integer32', rfc1902.Integer32, [rfc1902.Integer, univ.Integer])
+_snmp_types.bind_pysnmp('Counter32', rfc1902.Counter32)
+_snmp_types.bind_pysnmp('IpAddress', rfc1902.IpAddress, from_pysnmp=lambda value: value.prettyPrint())
+_snmp_types.bind_pysnmp('Gauge32', rfc1902.Gauge32, [rfc1902.Unsigned32])
+_snmp_types.bind_pysnmp('TimeTicks', rfc1902.TimeTicks)
+_snmp_types.bind_pysnmp('Opaque', rfc1902.Opaque)
+_snmp_types.bind_pysnmp('Counter64', rfc1902.Counter64)
+_snmp_types.register_null(rfc1905.NoSuchObject, rfc1905.NoSuchInstance, rfc1905.EndOfMibView)
@@ -0,0 +1,737 @@
+# -*- coding: utf-8 -*-
+
+# SNMP modules for Ansible
+# Copyright (C) 2015  Peter Nørlund
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Client side of the SNMP connection plugin, imported by the modules. It
+# must stay cheap to import, so it depends on the standard library only.
+# Settings come from the environment set up by the connection plugin.
+
+import os
+import json
+import socket
+import base64
+import struct
+import functools
+import collections
+
+__all__ = ['SnmpValue', 'OctetString', 'ObjectIdentifier', 'Integer32', 'Counter32', 'IpAddress', 'Gauge32', 'TimeTicks', 'Opaque', 'Counter64',
+           'SnmpClient', 'SnmpRequest', 'SnmpStream', 'SnmpError']
+
+# Recently parsed OIDs, cleared when it reaches _OID_CACHE_SIZE entries
+_oid_cache = dict()
+
+SNMP_FRAMING = os.getenv('SNMP_FRAMING', 'binary').lower()
+
+# Binary framing prefixes every message with its length
+_FRAME_HEADER = struct.Struct('>I')
+_INT32 = struct.Struct('>i')
+_UINT32 = struct.Struct('>I')
+_INT64 = struct.Struct('>q')
+_UINT64 = struct.Struct('>Q')
+_DOUBLE = struct.Struct('>d')
+
+_OID_CACHE_SIZE = 4096
+
+class SnmpError(Exception):
+    pass
+
+class _SnmpType(object):
+    """ Conversions of one SNMP type between plugin, wire and pysnmp values """
+
+    def __init__(self, name, tag, value_class, coerce, raw=False, packer=None):
+        self.name = name
+        self.tag = tag
+        self.value_class = value_class
+        self.coerce = coerce
+        self.raw = raw
+        self.packer = packer
+        self.pysnmp_class = None
+        self.pysnmp_to_wire = coerce
+
+def _class_mro(cls):
+    """ Get a class and its bases in lookup order, also for old-style classes """
+    mro = getattr(cls, '__mro__', None)
+    if mro is not None:
+        return mro
+
+    classes = [cls]
+    for base in cls.__bases__:
+        for base_class in _class_mro(base):
+            if base_class not in classes:
+                classes.append(base_class)
+    return tuple(classes)
+
+class _SnmpTypes(object):
+    """ Registry of SNMP types keyed on the class of values """
+
+    def __init__(self):
+        self._types = []
+        self._by_name = dict()
+        self._by_value_class = dict()
+        self._by_pysnmp_class = dict()
+
+    def register(self, snmp_type):
+        self._types.append(snmp_type)
+        self._by_name[snmp_type.name] = snmp_type
+        self._by_value_class[snmp_type.value_class] = snmp_type
+
+    def bind_pysnmp(self, name, pysnmp_class, extra_pysnmp_classes=(), from_pysnmp=None):
+        """ Set the pysnmp class of a type and further pysnmp classes decoded as it """
+        snmp_type = self._by_name[name]
+        snmp_type.pysnmp_class = pysnmp_class
+        if from_pysnmp is not None:
+            snmp_type.pysnmp_to_wire = from_pysnmp
+        for cls in (pysnmp_class,) + tuple(extra_pysnmp_classes):
+            self._by_pysnmp_class[cls] = snmp_type
+
+    def register_null(self, *pysnmp_classes):
+        """ Add pysnmp types meaning that there is no value """
+        for cls in pysnmp_classes:
+            self._by_pysnmp_class[cls] = None
+
+    def types(self):
+        return list(self._types)
+
+    def _lookup(self, table, cls):
+        if cls in table:
+            return table[cls]
+        for base in _class_mro(cls)[1:]:
+            if base in table:
+                table[cls] = table[base]
+                return table[cls]
+        raise KeyError(cls)
+
+    def to_pysnmp(self, value):
+        """ Convert connection plugin object into pysnmp object """
+        if value is None:
+            return None
+        try:
+            snmp_type = self._lookup(self._by_value_class, value.__class__)
+        except KeyError:
+            raise SnmpError('Invalid type: %s' % value.__class__.__name__)
+        return snmp_type.pysnmp_class(snmp_type.coerce(value.value))
+
+    def from_pysnmp(self, value):
+        """ Convert pysnmp object into connection plugin object """
+        if value is None:
+            return None
+        try:
+            snmp_type = self._lookup(self._by_pysnmp_class, value.__class__)
+        except KeyError:
+            raise SnmpError('Invalid type: %s' % value.__class__.__name__)
+        if snmp_type is None:
+            return None
+        return snmp_type.value_class(snmp_type.pysnmp_to_wire(value))
+
+    def to_json(self, value):
+        """ Convert connection plugin object into JSON compatible object """
+        try:
+            snmp_type = self._lookup(self._by_value_class, value.__class__)
+        except KeyError:
+            raise ValueError('Unsupported object type: %s' % value.__class__.__name__)
+        data = snmp_type.coerce(value.value)
+        if snmp_type.raw:
+            data = base64.b64encode(data)
+        return dict(__jsonclass__=[snmp_type.name, data])
+
+    def from_json(self, name, data):
+        """ Convert JSON data into connection plugin object """
+        snmp_type = self._by_name.get(name)
+        if snmp_type is None:
+            raise ValueError('Unsupported object type: %s' % name)
+        if snmp_type.raw:
+            data = base64.b64decode(data)
+        return snmp_type.value_class(data)
+
+class SnmpValue(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+class OctetString(SnmpValue):
+    __slots__ = ()
+
+    def __init__(self, value):
+        self.value = str(value)
+
+def _parse_oid(text):
+    """ Parse a dotted OID, sharing the tuple with earlier parses of it """
+    subids = _oid_cache.get(text)
+    if subids is None:
+        subids = tuple(map(int, text.split('.')))
+        if len(_oid_cache) >= _OID_CACHE_SIZE:
+            _oid_cache.clear()
+        _oid_cache[text] = subids
+    return subids
+
+def _oid_subids(value):
+    """ Get the sub-identifiers of an ObjectIdentifier, tuple or dotted string """
+    if isinstance(value, ObjectIdentifier):
+        return value.subids
+    if isinstance(value, tuple):
+        return value
+    if isinstance(value, basestring):
+        return _parse_oid(value)
+    return tuple([int(subid) for subid in value])
+
+class ObjectIdentifier(SnmpValue):
+    """ OID held as a tuple of sub-identifiers """
+
+    __slots__ = ('subids', '_text')
+
+    def __init__(self, value):
+        if isinstance(value, basestring):
+            self.subids = _parse_oid(str(value))
+        else:
+            self.subids = _oid_subids(value)
+        self._text = None
+
+    @property
+    def value(self):
+        if self._text is None:
+            self._text = '.'.join([str(subid) for subid in self.subids])
+        return self._text
+
+    def __len__(self):
+        return len(self.subids)
+
+    def __hash__(self):
+        return hash(self.subids)
+
+    def __eq__(self, other):
+        if isinstance(other, ObjectIdentifier):
+            return self.subids == other.subids
+        if isinstance(other, tuple):
+            return self.subids == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __lt__(self, other):
+        if not isinstance(other, (ObjectIdentifier, tuple)):
+            return NotImplemented
+        return self.subids < _oid_subids(other)
+
+    def __le__(self, other):
+        if not isinstance(other, (ObjectIdentifier, tuple)):
+            return NotImplemented
+        return self.subids <= _oid_subids(other)
+
+    def __gt__(self, other):
+        if not isinstance(other, (ObjectIdentifier, tuple)):
+            return NotImplemented
+        return self.subids > _oid_subids(other)
+
+    def __ge__(self, other):
+        if not isinstance(other, (ObjectIdentifier, tuple)):
+            return NotImplemented
+        return self.subids >= _oid_subids(other)
+
+class Integer32(SnmpValue):
+    __slots__ = ()
+
+    def __init__(self, value):
+        self.value = int(value)
+
+    def __int__(self):
+        return self.value
+
+    def __long__(self):
+        return self.value
+
+class Counter32(SnmpValue):
+    __slots__ = ()
+
+    def __init__(self, value):
+        self.value = long(value)
+
+    def __int__(self):
+        return self.value
+
+    def __long__(self):
+        return self.value
+
+class IpAddress(SnmpValue):
+    __slots__ = ()
+
+class Gauge32(SnmpValue):
+    __slots__ = ()
+
+class TimeTicks(SnmpValue):
+    __slots__ = ()
+
+class Opaque(SnmpValue):
+    __slots__ = ()
+
+class Counter64(SnmpValue):
+    __slots__ = ()
+
+_snmp_types = _SnmpTypes()
+_snmp_types.register(_SnmpType('OctetString', 'x', OctetString, str, raw=True))
+_snmp_types.register(_SnmpType('ObjectIdentifier', 'o', ObjectIdentifier, str))
+_snmp_types.register(_SnmpType('Integer32', 'n', Integer32, int, packer=_INT32))
+_snmp_types.register(_SnmpType('Counter32', 'c', Counter32, long, packer=_UINT32))
+_snmp_types.register(_SnmpType('IpAddress', 'p', IpAddress, str))
+_snmp_types.register(_SnmpType('Gauge32', 'g', Gauge32, long, packer=_UINT32))
+_snmp_types.register(_SnmpType('TimeTicks', 't', TimeTicks, long, packer=_UINT32))
+_snmp_types.register(_SnmpType('Opaque', 'q', Opaque, str, raw=True))
+_snmp_types.register(_SnmpType('Counter64', 'C', Counter64, long, packer=_UINT64))
+
+class _BinaryCodec(object):
+    """ Compact encoding of RPC messages used with binary framing """
+
+    def __init__(self):
+        self._encoders = {
+            type(None): self._encode_none,
+            bool: self._encode_bool,
+            int: self._encode_int,
+            long: self._encode_int,
+            float: self._encode_float,
+            str: self._encode_str,
+            unicode: self._encode_unicode,
+            list: self._encode_list,
+            tuple: self._encode_list,
+            dict: self._encode_dict,
+        }
+        self._decoders = {
+            'N': self._decode_none,
+            'T': self._decode_true,
+            'F': self._decode_false,
+            'i': self._decode_int,
+            'I': self._decode_long,
+            'd': self._decode_float,
+            's': self._decode_str,
+            'u': self._decode_unicode,
+            '[': self._decode_list,
+            '{': self._decode_dict,
+        }
+
+        for snmp_type in _snmp_types.types():
+            self._encoders[snmp_type.value_class] = functools.partial(self._encode_snmp, snmp_type)
+            self._decoders[snmp_type.tag] = functools.partial(self._decode_snmp, snmp_type)
+
+    def encode(self, value):
+        out = []
+        self._encode(value, out)
+        return ''.join(out)
+
+    def decode(self, data):
+        (value, pos) = self._decode(data, 0)
+        return value
+
+    def _encode(self, value, out):
+        cls = value.__class__
+        encoder = self._encoders.get(cls)
+        if encoder is None:
+            # Subclasses, such as OrderedDict, are encoded as their nearest base
+            for base in _class_mro(cls):
+                encoder = self._encoders.get(base)
+                if encoder is not None:
+                    break
+            else:
+                raise ValueError('Unsupported object type: %s' % cls.__name__)
+            self._encoders[cls] = encoder
+        encoder(value, out)
+
+    def _decode(self, data, pos):
+        decoder = self._decoders.get(data[pos])
+        if decoder is None:
+            raise ValueError('Unsupported type tag: %r' % data[pos])
+        return decoder(data, pos + 1)
+
+    def _encode_bytes(self, tag, value, out):
+        out.append(tag)
+        out.append(_UINT32.pack(len(value)))
+        out.append(value)
+
+    def _decode_bytes(self, data, pos):
+        (length,) = _UINT32.unpack_from(data, pos)
+        pos = pos + _UINT32.size
+        return (data[pos:pos + length], pos + length)
+
+    def _encode_none(self, value, out):
+        out.append('N')
+
+    def _encode_bool(self, value, out):
+        out.append('T' if value else 'F')
+
+    def _encode_int(self, value, out):
+        if -0x8000000000000000 <= value <= 0x7fffffffffffffff:
+            out.append('i')
+            out.append(_INT64.pack(value))
+        else:
+            self._encode_bytes('I', str(value), out)
+
+    def _encode_float(self, value, out):
+        out.append('d')
+        out.append(_DOUBLE.pack(value))
+
+    def _encode_str(self, value, out):
+        self._encode_bytes('s', value, out)
+
+    def _encode_unicode(self, value, out):
+        self._encode_bytes('u', value.encode('utf-8'), out)
+
+    def _encode_list(self, value, out):
+        out.append('[')
+        out.append(_UINT32.pack(len(value)))
+        for item in value:
+            self._encode(item, out)
+
+    def _encode_dict(self, value, out):
+        out.append('{')
+        out.append(_UINT32.pack(len(value)))
+        for (key, item) in value.iteritems():
+            if not isinstance(key, basestring):
+                key = json.dumps(key)
+            self._encode(key, out)
+            self._encode(item, out)
+
+    def _encode_snmp(self, snmp_type, value, out):
+        if snmp_type.packer is not None:
+            out.append(snmp_type.tag)
+            out.append(snmp_type.packer.pack(snmp_type.coerce(value.value)))
+        else:
+            self._encode_bytes(snmp_type.tag, snmp_type.coerce(value.value), out)
+
+    def _decode_none(self, data, pos):
+        return (None, pos)
+
+    def _decode_true(self, data, pos):
+        return (True, pos)
+
+    def _decode_false(self, data, pos):
+        return (False, pos)
+
+    def _decode_int(self, data, pos):
+        return (_INT64.unpack_from(data, pos)[0], pos + _INT64.size)
+
+    def _decode_long(self, data, pos):
+        (value, pos) = self._decode_bytes(data, pos)
+        return (long(value), pos)
+
+    def _decode_float(self, data, pos):
+        return (_DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size)
+
+    def _decode_str(self, data, pos):
+        return self._decode_bytes(data, pos)
+
+    def _decode_unicode(self, data, pos):
+        (value, pos) = self._decode_bytes(data, pos)
+        return (value.decode('utf-8'), pos)
+
+    def _decode_list(self, data, pos):
+        (count,) = _UINT32.unpack_from(data, pos)
+        pos = pos + _UINT32.size
+        items = []
+        for i in xrange(count):
+            (item, pos) = self._decode(data, pos)
+            items.append(item)
+        return (items, pos)
+
+    def _decode_dict(self, data, pos):
+        (count,) = _UINT32.unpack_from(data, pos)
+        pos = pos + _UINT32.size
+        items = dict()
+        for i in xrange(count):
+            (key, pos) = self._decode(data, pos)
+            (items[key], pos) = self._decode(data, pos)
+        return (items, pos)
+
+    def _decode_snmp(self, snmp_type, data, pos):
+        if snmp_type.packer is not None:
+            (value,) = snmp_type.packer.unpack_from(data, pos)
+            return (snmp_type.value_class(value), pos + snmp_type.packer.size)
+        (value, pos) = self._decode_bytes(data, pos)
+        return (snmp_type.value_class(value), pos)
+
+class _JsonRpcPeer(object):
+    # Newline terminated JSON until binary framing is negotiated
+    _binary = False
+    _codec = None
+
+    def __init__(self):
+        pass
+
+    def transmit(self, json):
+        pass
+
+    def transmit_frame(self, frame):
+        pass
+
+    def serialize(self, value):
+        return json.dumps(value, default=self._default_hook)
+
+    def unserialize(self, data):
+        return json.loads(data, object_hook=self._object_hook)
+
+    def send(self, **kwargs):
+        if self._binary:
+            self.transmit_frame(self._codec.encode(kwargs))
+        else:
+            self.transmit(self.serialize(kwargs))
+
+    def _use_binary_framing(self):
+        self._binary = True
+        self._codec = _BinaryCodec()
+
+    def _default_hook(self, o):
+        """ Convert object into JSON compatible objects """
+        return _snmp_types.to_json(o)
+
+    def _object_hook(self, o):
+        """ Convert JSON data into objects """
+        if '__jsonclass__' in o:
+            return _snmp_types.from_json(*o['__jsonclass__'])
+        return o
+
+class SnmpRequest(object):
+    """ SNMP request in flight """
+
+    def __init__(self, client, id):
+        self._client = client
+        self.id = id
+        self._done = False
+        self._result = None
+        self._error = None
+
+    def done(self):
+        """ Check whether the reply has arrived """
+        return self._done
+
+    def result(self):
+        """ Wait for the reply and return the result """
+        while not self._done:
+            self._client._receive()
+
+        if self._error is not None:
+            raise SnmpError(self._error)
+
+        return self._result
+
+    def _complete(self, reply):
+        if 'error' in reply:
+            self._error = reply['error']['message']
+        elif 'result' in reply:
+            self._result = reply['result']
+        self._done = True
+
+class SnmpStream(SnmpRequest):
+    """ SNMP request whose result arrives in chunks """
+
+    def __init__(self, client, id):
+        SnmpRequest.__init__(self, client, id)
+        self._chunks = collections.deque()
+
+    def __iter__(self):
+        try:
+            while True:
+                if self._chunks:
+                    for item in self._chunks.popleft():
+                        yield tuple(item)
+                elif self._done:
+                    break
+                else:
+                    self._client._receive()
+        except GeneratorExit:
+            # Left before the end, so stop the walk
+            if not self._done:
+                self._client._cancel(self.id)
+            raise
+
+        if self._error is not None:
+            raise SnmpError(self._error)
+
+    def _add_chunk(self, chunk):
+        self._chunks.append(chunk)
+
+class InterfaceMap(object):
+    """ Interfaces of a device indexed by ifIndex, ifName and bridge port """
+
+    def __init__(self, rows):
+        self._ports = dict()
+        self._ifindexes = dict()
+        for ifindex, (name, port) in rows.iteritems():
+            ifindex = int(ifindex)
+            self._ifindexes[name] = ifindex
+            if port is not None:
+                self._ports[ifindex] = port
+
+    def port(self, ifindex):
+        """ Bridge port of an ifIndex, or None """
+        return self._ports.get(int(ifindex))
+
+    def resolve(self, names):
+        """ Map interface names to ifIndex, None for unknown names """
+        return dict((name, self._ifindexes.get(name)) for name in names)
+
+    def resolve_ports(self, names):
+        """ Map interface names to bridge port, None for unknown names or interfaces that are not ports """
+        return dict((name, self._ports.get(self._ifindexes.get(name))) for name in names)
+
+class SnmpClient(_JsonRpcPeer):
+    """ SNMP API for the modules """
+
+    _interface_map = None
+
+    def __init__(self):
+        socket_path = os.getenv('SNMP_SOCKET')
+        if socket_path:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(socket_path)
+            self._pipe_in = sock.makefile('rb')
+            self._pipe_out = sock.makefile('wb')
+            sock.close()
+        else:
+            self._pipe_in = os.fdopen(int(os.getenv('SNMP_PIPE_IN')), 'rb')
+            self._pipe_out = os.fdopen(int(os.getenv('SNMP_PIPE_OUT')), 'wb')
+
+        self._next_id = 1
+        self._pending = dict()
+
+        # The broker serves many hosts, so tell it which one to talk to
+        session = os.getenv('SNMP_SESSION')
+        if session:
+            self._call('attach', session)
+
+        if SNMP_FRAMING == 'binary':
+            self._negotiate_framing()
+
+    def _negotiate_framing(self):
+        """ Ask for binary framing, staying with JSON if the server declines """
+        try:
+            framing = self._call('framing', 'binary')
+        except SnmpError:
+            return
+        if framing == 'binary':
+            self._use_binary_framing()
+
+    def transmit(self, json):
+        self._pipe_out.write(json + '\n')
+        self._pipe_out.flush()
+
+    def transmit_frame(self, frame):
+        self._pipe_out.write(_FRAME_HEADER.pack(len(frame)))
+        self._pipe_out.write(frame)
+        self._pipe_out.flush()
+
+    def _read_exactly(self, size):
+        data = self._pipe_in.read(size)
+        if len(data) != size:
+            raise SnmpError('Lost connection to SNMP server')
+        return data
+
+    def _submit(self, method, *params, **kwargs):
+        id = self._next_id
+        self._next_id = self._next_id + 1
+
+        request_class = kwargs.get('request_class', SnmpRequest)
+        request = request_class(self, id)
+        self._pending[id] = request
+        self.send(jsonrpc='2.0', method=method, params=params, id=id)
+        return request
+
+    def _receive(self):
+        """ Read one reply and hand it to its request """
+        if self._binary:
+            (length,) = _FRAME_HEADER.unpack(self._read_exactly(_FRAME_HEADER.size))
+            reply = self._codec.decode(self._read_exactly(length))
+        else:
+            line = self._pipe_in.readline()
+            if not line:
+                raise SnmpError('Lost connection to SNMP server')
+            reply = self.unserialize(line)
+        self._handle_reply(reply)
+
+    def _handle_reply(self, reply):
+        """ Hand a reply to its request """
+        id = reply.get('id')
+        if 'partial' in reply:
+            request = self._pending.get(id)
+            if request is not None:
+                request._add_chunk(reply['partial'])
+            return
+
+        request = self._pending.pop(id, None)
+        if request is not None:
+            request._complete(reply)
+
+    def _call(self, method, *params):
+        return self._submit(method, *params).result()
+
+    def _cancel(self, id):
+        """ Stop a streamed request, ignoring whatever still arrives for it """
+        if self._pending.pop(id, None) is not None:
+            self._submit('cancel', id)
+
+    def wait(self, *requests):
+        """ Wait for several requests and return their results in order """
+        return [request.result() for request in requests]
+
+    def get_async(self, *var_names):
+        """ Start fetching SNMP variables """
+        return self._submit('get', *var_names)
+
+    def set_async(self, var_binds, atomic=True):
+        """ Start setting SNMP variables in one PDU if atomic, else var_binds may be a list of groups """
+        return self._submit('set', var_binds, atomic)
+
+    def walk_async(self, var_name):
+        """ Start iterating SNMP variables """
+        return self._submit('walk', var_name)
+
+    def walk_table_async(self, columns):
+        """ Start walking several table columns """
+        return self._submit('walk_table', columns)
+
+    def get(self, *var_names):
+        """ Fetch SNMP variables """
+        return self._call('get', *var_names)
+
+    def set(self, var_binds, atomic=True):
+        """ Set SNMP variables """
+        self._call('set', var_binds, atomic)
+
+    def walk(self, var_name):
+        """ Iterate SNMP variables """
+        return self._call('walk', var_name)
+
+    def interface_index(self):
+        """ Get interfaces of the device as a dictionary of ifIndex to [ifName, dot1dBasePort] """
+        return self._call('interface_index')
+
+    def interface_map(self):
+        """ Get interfaces of the device as an InterfaceMap """
+        if self._interface_map is None:
+            self._interface_map = InterfaceMap(self.interface_index())
+        return self._interface_map
+
+    def walk_iter(self, var_name):
+        """ Iterate SNMP variables as they arrive """
+        return iter(self._submit('walk_stream', var_name, request_class=SnmpStream))
+
+    def walk_table(self, columns):
+        """ Walk several table columns into a dictionary of rows """
+        return self._call('walk_table', columns)
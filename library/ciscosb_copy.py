@@ -41,7 +41,7 @@ options:
         required: false
 """
 
-import snmp
+import snmp_client as snmp
 import urlparse
 import random
 import time
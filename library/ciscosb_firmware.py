@@ -56,7 +56,7 @@ EXAMPLES = """
 - ciscosb_firmware: gather_facts=yes
 """
 
-import snmp
+import snmp_client as snmp
 
 OID_RND_DEVICE_PARAMS = '1.3.6.1.4.1.9.6.1.101.2'
 
@@ -25,7 +25,7 @@ description:
 author: "Peter Nørlund, @pchri03"
 """
 
-import snmp
+import snmp_client as snmp
 
 OID_RND_ACTION = '1.3.6.1.4.1.9.6.1.101.1.2.0'
 
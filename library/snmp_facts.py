@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# SNMP modules for Ansible
+# Copyright (C) 2026  agent
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION='''
+module: snmp_facts
+short_description: Gather facts through SNMP
+description:
+    - Gather the system group, interfaces, bridge ports and VLANs of a device
+    - All tables are walked at the same time
+    - Requires the snmp connection plugin
+author: "agent"
+options:
+    gather_subset:
+        description:
+            - Subsets of facts to gather. Prefix a subset with ! to leave it out.
+        choices: [ 'all' | 'system' | 'interfaces' | 'bridge' | 'vlans' ]
+        default: all
+        required: false
+'''
+
+EXAMPLES='''
+# Gather all facts
+- snmp_facts:
+
+# Only gather interfaces and VLANs
+- snmp_facts: gather_subset=interfaces,vlans
+
+# Gather everything but the bridge ports
+- snmp_facts: gather_subset="all,!bridge"
+'''
+
+from ansible.module_utils.basic import *
+
+import binascii
+
+import snmp_client as snmp
+
+OID_MIB_2 = '1.3.6.1.2.1'
+
+OID_SYSTEM = OID_MIB_2 + '.1'
+OID_SYS_DESCR = OID_SYSTEM + '.1.0'
+OID_SYS_OBJECT_ID = OID_SYSTEM + '.2.0'
+OID_SYS_UP_TIME = OID_SYSTEM + '.3.0'
+OID_SYS_CONTACT = OID_SYSTEM + '.4.0'
+OID_SYS_NAME = OID_SYSTEM + '.5.0'
+OID_SYS_LOCATION = OID_SYSTEM + '.6.0'
+
+OID_IF_ENTRY = OID_MIB_2 + '.2.2.1'
+OID_IF_DESCR = OID_IF_ENTRY + '.2'
+OID_IF_TYPE = OID_IF_ENTRY + '.3'
+OID_IF_MTU = OID_IF_ENTRY + '.4'
+OID_IF_SPEED = OID_IF_ENTRY + '.5'
+OID_IF_PHYS_ADDRESS = OID_IF_ENTRY + '.6'
+OID_IF_ADMIN_STATUS = OID_IF_ENTRY + '.7'
+OID_IF_OPER_STATUS = OID_IF_ENTRY + '.8'
+
+OID_IF_X_ENTRY = OID_MIB_2 + '.31.1.1.1'
+OID_IF_NAME = OID_IF_X_ENTRY + '.1'
+OID_IF_HIGH_SPEED = OID_IF_X_ENTRY + '.15'
+OID_IF_ALIAS = OID_IF_X_ENTRY + '.18'
+
+OID_DOT1D_BRIDGE = OID_MIB_2 + '.17'
+OID_DOT1D_BASE_PORT_IF_INDEX = OID_DOT1D_BRIDGE + '.1.4.1.2'
+
+OID_DOT1Q_VLAN = OID_DOT1D_BRIDGE + '.7.1.4'
+OID_DOT1Q_VLAN_STATIC_ENTRY = OID_DOT1Q_VLAN + '.3.1'
+OID_DOT1Q_VLAN_STATIC_NAME = OID_DOT1Q_VLAN_STATIC_ENTRY + '.1'
+OID_DOT1Q_VLAN_STATIC_EGRESS_PORTS = OID_DOT1Q_VLAN_STATIC_ENTRY + '.2'
+OID_DOT1Q_VLAN_STATIC_UNTAGGED_PORTS = OID_DOT1Q_VLAN_STATIC_ENTRY + '.4'
+OID_DOT1Q_PVID = OID_DOT1Q_VLAN + '.5.1.1'
+
+SUBSETS = ['system', 'interfaces', 'bridge', 'vlans']
+
+SYSTEM_FACTS = [
+    ('snmp_sysdescr', OID_SYS_DESCR),
+    ('snmp_sysobjectid', OID_SYS_OBJECT_ID),
+    ('snmp_sysuptime', OID_SYS_UP_TIME),
+    ('snmp_syscontact', OID_SYS_CONTACT),
+    ('snmp_sysname', OID_SYS_NAME),
+    ('snmp_syslocation', OID_SYS_LOCATION)
+]
+
+INTERFACE_COLUMNS = [OID_IF_DESCR, OID_IF_TYPE, OID_IF_MTU, OID_IF_SPEED, OID_IF_PHYS_ADDRESS,
+                     OID_IF_ADMIN_STATUS, OID_IF_OPER_STATUS, OID_IF_NAME, OID_IF_HIGH_SPEED, OID_IF_ALIAS]
+
+IF_STATUS = {
+    1: 'up',
+    2: 'down',
+    3: 'testing',
+    4: 'unknown',
+    5: 'dormant',
+    6: 'notPresent',
+    7: 'lowerLayerDown'
+}
+
+def parse_subsets(module, value):
+    """ Turn gather_subset into a set of subsets """
+    subsets = set()
+    excluded = set()
+    for item in value:
+        item = item.strip()
+        if item.startswith('!'):
+            item = item[1:]
+            target = excluded
+        else:
+            target = subsets
+        if item == 'all':
+            target.update(SUBSETS)
+        elif item in SUBSETS:
+            target.add(item)
+        else:
+            module.fail_json(msg="Invalid gather_subset: %s" % item)
+
+    # A list of exclusions alone means everything else
+    if not subsets:
+        subsets.update(SUBSETS)
+    return subsets - excluded
+
+def text(value):
+    return None if value is None else str(value)
+
+def number(value):
+    return None if value is None else long(value.value)
+
+def portlist_to_ports(value):
+    """ Bridge ports of a PortList, the most significant bit being port 1 """
+    if value is None:
+        return []
+    bits = int(binascii.hexlify(value.value) or '0', 16)
+    length = len(value.value) * 8
+    return [port for port in range(1, length + 1) if bits & (1 << (length - port))]
+
+def system_facts(values):
+    facts = dict()
+    for fact, oid in SYSTEM_FACTS:
+        facts[fact] = text(values.get(oid))
+    uptime = number(values.get(OID_SYS_UP_TIME))
+    facts['snmp_sysuptime'] = None if uptime is None else uptime // 100
+    return facts
+
+def interface_facts(rows, ports):
+    """ Map interface names to their facts, ports mapping ifIndex to bridge port """
+    interfaces = dict()
+    for ifindex, row in rows.iteritems():
+        (descr, if_type, mtu, speed, phys_address, admin_status, oper_status, name, high_speed, alias) = row
+
+        # ifSpeed tops out at 4 Gbit/s, so prefer ifHighSpeed
+        if high_speed is not None and long(high_speed.value):
+            speed = long(high_speed.value)
+        elif speed is not None:
+            speed = long(speed.value) // 1000000
+
+        interface = dict(
+            ifindex = int(ifindex),
+            descr = text(descr),
+            alias = text(alias),
+            type = number(if_type),
+            mtu = number(mtu),
+            speed = speed,
+            mac = ':'.join('%02x' % ord(c) for c in phys_address.value) if phys_address is not None and phys_address.value else None,
+            admin_status = IF_STATUS.get(number(admin_status)),
+            oper_status = IF_STATUS.get(number(oper_status)),
+            port = ports.get(int(ifindex))
+        )
+        interfaces[text(name) or text(descr) or ifindex] = interface
+    return interfaces
+
+def bridge_facts(rows):
+    """ Map bridge ports to their ifIndex and port VLAN id """
+    ports = dict()
+    for port, (ifindex, pvid) in rows.iteritems():
+        ports[port] = dict(ifindex=number(ifindex), pvid=number(pvid))
+    return ports
+
+def vlan_facts(rows):
+    """ Map VLAN ids to their name and tagged and untagged bridge ports """
+    vlans = dict()
+    for vlan, (name, egress, untagged) in rows.iteritems():
+        untagged = portlist_to_ports(untagged)
+        vlans[vlan] = dict(
+            name = text(name),
+            tagged = [port for port in portlist_to_ports(egress) if port not in untagged],
+            untagged = untagged
+        )
+    return vlans
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            gather_subset = dict(required=False, type='list', default=['all'])
+        ),
+        supports_check_mode=True
+    )
+
+    subsets = parse_subsets(module, module.params['gather_subset'])
+
+    try:
+        client = snmp.SnmpClient()
+
+        # Start every request before waiting for any of them
+        requests = dict()
+        if 'system' in subsets:
+            requests['system'] = client.get_async(*[oid for fact, oid in SYSTEM_FACTS])
+        if 'interfaces' in subsets:
+            requests['interfaces'] = client.walk_table_async(INTERFACE_COLUMNS)
+        if 'bridge' in subsets or 'interfaces' in subsets:
+            requests['bridge'] = client.walk_table_async([OID_DOT1D_BASE_PORT_IF_INDEX, OID_DOT1Q_PVID])
+        if 'vlans' in subsets:
+            requests['vlans'] = client.walk_table_async([OID_DOT1Q_VLAN_STATIC_NAME, OID_DOT1Q_VLAN_STATIC_EGRESS_PORTS,
+                                                         OID_DOT1Q_VLAN_STATIC_UNTAGGED_PORTS])
+        names = sorted(requests)
+        results = dict(zip(names, client.wait(*[requests[name] for name in names])))
+
+        facts = dict()
+        if 'system' in subsets:
+            facts.update(system_facts(results['system']))
+        if 'bridge' in results:
+            bridge_ports = bridge_facts(results['bridge'])
+            if 'bridge' in subsets:
+                facts['snmp_bridge_ports'] = bridge_ports
+        if 'interfaces' in subsets:
+            ports = dict((port['ifindex'], int(bridge_port)) for bridge_port, port in bridge_ports.iteritems()
+                         if port['ifindex'] is not None)
+            facts['snmp_interfaces'] = interface_facts(results['interfaces'], ports)
+        if 'vlans' in subsets:
+            facts['snmp_vlans'] = vlan_facts(results['vlans'])
+
+        module.exit_json(changed=False, ansible_facts=facts)
+    except snmp.SnmpError as e:
+        module.fail_json(msg=str(e))
+
+if __name__ == '__main__':
+    main()
@@ -50,11 +50,29 @@ options:
         description:
             - Toggle promisicous mode
         required: false
+    interfaces:
+        description:
+            - List of interfaces to set at once, instead of ifname or ifindex
+            - Every item has ifname or ifindex and any of alias, status, traps and promisc
+            - All interfaces are looked up, read and changed with as few requests as possible
+        required: false
+'''
+
+EXAMPLES='''
+# Set alias of gi1
+- snmp_interface: ifname="gi1" alias="Uplink"
+
+# Set several interfaces at once
+- snmp_interface:
+    interfaces:
+      - { ifname: "gi1", alias: "Uplink", status: "up" }
+      - { ifname: "gi2", alias: "Printer" }
+      - { ifindex: 49, status: "down", traps: "no" }
 '''
 
 from ansible.module_utils.basic import *
 
-import snmp
+import snmp_client as snmp
 
 OID_IF_X_ENTRY = '1.3.6.1.2.1.31.1.1.1'
 OID_IF_ENTRY   = '1.3.6.1.2.1.2.2.1'
@@ -75,102 +93,136 @@ IF_LINK_UP_DOWN_TRAP_ENABLE_DISABLED = 2
 SNMP_TRUE = 1
 SNMP_FALSE = 2
 
-def get_ifindex(client, name):
-    names = client.walk(OID_IF_NAME)
-    for if_index, if_name in names.iteritems():
-        if str(if_name) == name:
-            return if_index
-    return None    
+SETTINGS = ['alias', 'status', 'traps', 'promisc']
+
+# Column holding each setting
+SETTING_COLUMNS = dict(
+    alias   = OID_IF_ALIAS,
+    status  = OID_IF_ADMIN_STATUS,
+    traps   = OID_IF_LINK_UP_DOWN_TRAP_ENABLE,
+    promisc = OID_IF_PROMISCUOUS_MODE
+)
+
+def parse_interface(module, item):
+    """ Validate an interface and turn its settings into SNMP values """
+    if not isinstance(item, dict):
+        module.fail_json(msg="Interfaces must be dictionaries: %s" % item)
+
+    unknown = set(item) - set(['ifname', 'ifindex'] + SETTINGS)
+    if unknown:
+        module.fail_json(msg="Unsupported interface settings: %s" % ', '.join(sorted(unknown)))
+    if ('ifname' in item) == ('ifindex' in item):
+        module.fail_json(msg="Interfaces need either ifname or ifindex: %s" % item)
+
+    ifindex = item.get('ifindex')
+    if ifindex is not None:
+        try:
+            ifindex = int(ifindex)
+        except (TypeError, ValueError):
+            module.fail_json(msg="Invalid ifindex: %s" % ifindex)
+
+    desired = dict()
+    if item.get('alias') is not None:
+        desired['alias'] = snmp.OctetString(item['alias'])
+    if item.get('status') is not None:
+        if item['status'] not in ('up', 'down'):
+            module.fail_json(msg="Unsupported interface status: %s" % item['status'])
+        desired['status'] = snmp.Integer32(IF_ADMIN_STATUS_UP if item['status'] == 'up' else IF_ADMIN_STATUS_DOWN)
+    if item.get('traps') is not None:
+        enabled = module.boolean(item['traps'])
+        desired['traps'] = snmp.Integer32(IF_LINK_UP_DOWN_TRAP_ENABLE_ENABLED if enabled else IF_LINK_UP_DOWN_TRAP_ENABLE_DISABLED)
+    if item.get('promisc') is not None:
+        desired['promisc'] = snmp.Integer32(SNMP_TRUE if module.boolean(item['promisc']) else SNMP_FALSE)
+    if not desired:
+        module.fail_json(msg="Interfaces need one of %s: %s" % (', '.join(SETTINGS), item))
+
+    return dict(ifname=item.get('ifname'), ifindex=ifindex, desired=desired)
+
+def resolve_ifindexes(module, client, interfaces):
+    """ Fill in the ifIndex of interfaces given by name, failing on interfaces given twice """
+    if any(interface['ifindex'] is None for interface in interfaces):
+        ifindexes = client.interface_map().resolve(interface['ifname'] for interface in interfaces
+                                                   if interface['ifindex'] is None)
+
+        for interface in interfaces:
+            if interface['ifindex'] is None:
+                ifindex = ifindexes[interface['ifname']]
+                if ifindex is None:
+                    module.fail_json(msg="No such interface: %s" % interface['ifname'])
+                interface['ifindex'] = ifindex
+
+    seen = set()
+    for interface in interfaces:
+        if interface['ifindex'] in seen:
+            module.fail_json(msg="Interface given more than once: %s" % (interface['ifname'] or interface['ifindex']))
+        seen.add(interface['ifindex'])
+
+def same_value(current, desired):
+    if current is None:
+        return False
+    if isinstance(desired, snmp.OctetString):
+        return str(current) == desired.value
+    return int(current) == desired.value
 
 def main():
     module = AnsibleModule(
         argument_spec = dict(
             ifname      = dict(required=False),
             ifindex     = dict(required=False),
+            interfaces  = dict(required=False, type='list'),
 
             alias     = dict(required=False),
             status     = dict(required=False, choices=['up', 'down']),
             traps     = dict(required=False, choices=BOOLEANS),
             promisc   = dict(required=False, choices=BOOLEANS)
         ),
-        mutually_exclusive=[['ifname', 'ifindex']],
-        required_one_of=[['ifname', 'ifindex'],
-                         ['alias', 'status', 'traps', 'promisc']],
+        mutually_exclusive=[['ifname', 'ifindex', 'interfaces'],
+                            ['interfaces', 'alias'], ['interfaces', 'status'],
+                            ['interfaces', 'traps'], ['interfaces', 'promisc']],
+        required_one_of=[['ifname', 'ifindex', 'interfaces']],
         supports_check_mode=True
     )
 
     params = module.params
 
-    ifname = params['ifname']
-    ifindex = params['ifindex']
-    alias = params['alias']
-    status = params['status']
-    traps = params['traps']
-    promisc = params['promisc']
+    if params['interfaces'] is not None:
+        items = params['interfaces']
+    else:
+        items = [dict((key, params[key]) for key in ['ifname', 'ifindex'] + SETTINGS if params[key] is not None)]
+    interfaces = [parse_interface(module, item) for item in items]
 
     try:
         client = snmp.SnmpClient()
 
-        if not ifindex:
-            ifindex = get_ifindex(client, ifname)
-            if not ifindex:
-                module.fail_json(msg="No such interface")
-
-        oid_if_alias = OID_IF_ALIAS + '.' + str(ifindex)
-        oid_if_admin_status = OID_IF_ADMIN_STATUS + '.' + str(ifindex)
-        oid_if_link_up_down_trap_enable = OID_IF_LINK_UP_DOWN_TRAP_ENABLE + '.' + str(ifindex)
-        oid_if_promiscuous_mode = OID_IF_PROMISCUOUS_MODE + '.' + str(ifindex)
+        resolve_ifindexes(module, client, interfaces)
 
+        # Current values of every setting of every interface in one request
         var_names = []
-        if alias is not None:
-            var_names.append(oid_if_alias)
-        if status is not None:
-            var_names.append(oid_if_admin_status)
-        if traps is not None:
-            var_names.append(oid_if_link_up_down_trap_enable)
-        if promisc is not None:
-            var_names.append(oid_if_promiscuous_mode)
-
+        for interface in interfaces:
+            for setting in interface['desired']:
+                var_names.append(SETTING_COLUMNS[setting] + '.' + str(interface['ifindex']))
         values = client.get(*var_names)
 
-        var_binds = dict()
-
-        if alias:
-            value = str(values[oid_if_alias])
-            if value != alias:
-                var_binds[oid_if_alias] = snmp.OctetString(alias)
-
-        if status:
-            if_status = int(values[oid_if_admin_status])
-            if status == 'up' and if_status != IF_ADMIN_STATUS_UP:
-                var_binds[oid_if_admin_status] = snmp.Integer32(IF_ADMIN_STATUS_UP)
-            elif status == 'down' and if_status != IF_ADMIN_STATUS_DOWN:
-                var_binds[oid_if_admin_status] = snmp.Integer32(IF_ADMIN_STATUS_DOWN)
-
-        if traps:
-            traps = module.boolean(traps)
-            if_link_up_down_trap_enable = int(values[oid_if_link_up_down_trap_enable])
-            if traps and if_link_up_down_trap_enable != IF_LINK_UP_DOWN_TRAP_ENABLE_ENABLED:
-                var_binds[oid_if_link_up_down_trap_enable] = snmp.Integer32(IF_LINK_UP_DOWN_TRAP_ENABLE_ENABLED)
-            elif not traps and if_link_up_down_trap_enable != IF_LINK_UP_DOWN_TRAP_ENABLE_DISABLED:
-                var_binds[oid_if_link_up_down_trap_enable] = snmp.Integer32(IF_LINK_UP_DOWN_TRAP_ENABLE_DISABLED)
-
-        if promisc:
-            promisc = module.boolean(promisc)
-            if_promiscuous_mode = int(values[oid_if_promiscuous_mode])
-            if promisc and if_promiscuous_mode != SNMP_TRUE:
-                var_binds[oid_if_promiscuous_mode] = snmp.Integer32(SNMP_TRUE)
-            elif not promisc and if_promiscuous_mode != SNMP_FALSE:
-                var_binds[oid_if_promiscuous_mode] = snmp.Integer32(SNMP_FALSE)
-
-        if not var_binds:
-            module.exit_json(changed=False)
-
-        if module.check_mode:
-            module.exit_json(changed=True)
-
-        client.set(var_binds)
-        module.exit_json(changed=True)
+        # Each interface is changed in a single PDU
+        groups = []
+        results = []
+        for interface in interfaces:
+            var_binds = dict()
+            changes = []
+            for setting, value in interface['desired'].items():
+                oid = SETTING_COLUMNS[setting] + '.' + str(interface['ifindex'])
+                if not same_value(values.get(oid), value):
+                    var_binds[oid] = value
+                    changes.append(setting)
+            if var_binds:
+                groups.append(var_binds)
+            results.append(dict(ifname=interface['ifname'], ifindex=interface['ifindex'],
+                                changed=bool(changes), changes=sorted(changes)))
+
+        if groups and not module.check_mode:
+            client.set(groups, atomic=False)
+
+        module.exit_json(changed=bool(groups), interfaces=results)
     except snmp.SnmpError as e:
         module.fail_json(msg=str(e))
 
@@ -45,7 +45,7 @@ options:
 
 from ansible.module_utils.basic import *
 
-import snmp
+import snmp_client as snmp
 
 OID_SYS_DESCR    = '1.3.6.1.2.1.1.1.0'
 OID_SYS_CONTACT  = '1.3.6.1.2.1.1.4.0'
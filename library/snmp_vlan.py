@@ -45,6 +45,11 @@ options:
     vlan:
         description:
             - VLAN id
+            - Without ifname, ifindex or port, this may also be a range or a comma separated list of ids and ranges
+        required: false
+    vlans:
+        description:
+            - List of VLANs to create or delete, given as ids, ranges or dictionaries of vlan, name and state
         required: false
     state:
         description:
@@ -59,6 +64,12 @@ options:
         description:
             - Port VLAN id
         required: false
+    membership:
+        description:
+            - Complete port membership of VLANs, keyed by VLAN id
+            - Every VLAN has lists of tagged and untagged ports, given as interface names or bridge port numbers
+            - Ports left out are removed from the VLAN. VLANs left out are not changed.
+        required: false
 '''
 
 EXAMPLES='''
@@ -71,6 +82,16 @@ EXAMPLES='''
 # Delete VLAN
 - snmp_vlan: vlan=201 state=absent
 
+# Create VLAN 300 to 499 and 600
+- snmp_vlan: vlan="300-499,600" state=present
+
+# Create and delete several VLANs at once
+- snmp_vlan:
+    vlans:
+      - { vlan: 200, name: "Test" }
+      - { vlan: "210-219", name: "Lab" }
+      - { vlan: 201, state: absent }
+
 # Map VLAN 200 to port gi1
 - snmp_vlan: ifname="gi1" vlan=200 state=present
 
@@ -79,16 +100,22 @@ EXAMPLES='''
 
 # Enable GVRP on port gi1
 - snmp_vlan: ifname="gi1" gvrp=on
+
+# Set the ports of VLAN 1, 200 and 201
+- snmp_vlan:
+    membership:
+      1: { untagged: [ "gi1", "gi2", "gi3" ] }
+      200: { tagged: [ "gi1", "gi48" ], untagged: [ "gi4", "gi5" ] }
+      201: { tagged: [ "gi1", "gi48" ] }
 '''
 
-import snmp
+import binascii
 
-OID_MIB_2 = '1.3.6.1.2.1'
+import snmp_client as snmp
 
-OID_IF_NAME = OID_MIB_2 + '.31.1.1.1.1'
+OID_MIB_2 = '1.3.6.1.2.1'
 
 OID_DOT1D_BRIDGE = OID_MIB_2 + '.17'
-OID_DOT1D_BASE_PORT_IF_INDEX = OID_DOT1D_BRIDGE + '.1.4.1.2'
 
 OID_Q_BRIDGE_MIB = OID_DOT1D_BRIDGE + '.7'
 OID_Q_BRIDGE_MIB_OBJECTS = OID_Q_BRIDGE_MIB + '.1'
@@ -97,6 +124,13 @@ OID_DOT1Q_GVRP_STATUS = OID_DOT1Q_BASE + '.5.0'
 
 OID_DOT1Q_VLAN = OID_Q_BRIDGE_MIB_OBJECTS + '.4'
 
+OID_DOT1Q_VLAN_STATIC_TABLE = OID_DOT1Q_VLAN + '.3'
+OID_DOT1Q_VLAN_STATIC_ENTRY = OID_DOT1Q_VLAN_STATIC_TABLE + '.1'
+OID_DOT1Q_VLAN_STATIC_NAME = OID_DOT1Q_VLAN_STATIC_ENTRY + '.1'
+OID_DOT1Q_VLAN_STATIC_EGRESS_PORTS = OID_DOT1Q_VLAN_STATIC_ENTRY + '.2'
+OID_DOT1Q_VLAN_STATIC_UNTAGGED_PORTS = OID_DOT1Q_VLAN_STATIC_ENTRY + '.4'
+OID_DOT1Q_VLAN_STATIC_ROW_STATUS = OID_DOT1Q_VLAN_STATIC_ENTRY + '.5'
+
 OID_DOT1Q_PORT_VLAN_TABLE = OID_DOT1Q_VLAN + '.5'
 OID_DOT1Q_PORT_VLAN_ENTRY = OID_DOT1Q_PORT_VLAN_TABLE + '.1'
 OID_DOT1Q_PORT_GVRP_STATUS = OID_DOT1Q_PORT_VLAN_ENTRY + '.4'
@@ -104,26 +138,219 @@ OID_DOT1Q_PORT_GVRP_STATUS = OID_DOT1Q_PORT_VLAN_ENTRY + '.4'
 SNMP_ENABLED = 1
 SNMP_DISABLED = 2
 
+ROW_STATUS_CREATE_AND_GO = 4
+ROW_STATUS_DESTROY = 6
+
 def ifindex_to_port(client, ifindex):
-    ifindexes = client.walk(OID_DOT1D_BASE_PORT_IF_INDEX)
-    for port, _ifindex in ifindexes.iteritems():
-        if int(_ifindex) == ifindex:
-            return int(port)
-    return None
-
-def ifname_to_ifindex(client, ifname):
-    ifnames = client.walk(OID_IF_NAME)
-    for ifindex, _ifname in ifnames.iteritems():
-        if str(_ifname) == ifname:
-            return int(ifindex)
-    return None
+    return client.interface_map().port(ifindex)
 
 def ifname_to_port(client, ifname):
-    ifindex = ifname_to_ifindex(client, ifname)
-    if ifindex:
-        return ifindex_to_port(client, ifindex)
-    else:
-        return None
+    return client.interface_map().resolve_ports([ifname])[ifname]
+
+def portlist_to_int(value):
+    """ Turn a PortList into an integer, the most significant bit being port 1 """
+    return int(binascii.hexlify(value) or '0', 16)
+
+def int_to_portlist(bits, length):
+    return binascii.unhexlify('%0*x' % (length * 2, bits))
+
+def port_bit(port, length):
+    return 1 << (length * 8 - port)
+
+def bits_to_ports(bits, length):
+    return [port for port in range(1, length * 8 + 1) if bits & port_bit(port, length)]
+
+def as_list(value):
+    """ Accept lists as well as comma separated strings """
+    if value is None:
+        return []
+    if isinstance(value, basestring):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    if not isinstance(value, list):
+        return [value]
+    return value
+
+def resolve_ports(module, client, names):
+    """ Map interface names and port numbers to bridge port numbers """
+    ports = dict()
+    if_names = []
+    for name in names:
+        if isinstance(name, int) or (isinstance(name, basestring) and name.isdigit()):
+            ports[name] = int(name)
+        else:
+            if_names.append(name)
+
+    if if_names:
+        for name, port in client.interface_map().resolve_ports(if_names).iteritems():
+            if port is None:
+                module.fail_json(msg="No such port/interface: %s" % name)
+            ports[name] = port
+    return ports
+
+def apply_membership(module, client, membership):
+    """ Make the egress and untagged ports of VLANs match membership """
+    if not isinstance(membership, dict):
+        module.fail_json(msg="membership must map VLAN ids to tagged and untagged ports")
+
+    wanted = dict()
+    names = set()
+    for vlan, ports in membership.items():
+        try:
+            vlan = int(vlan)
+        except ValueError:
+            module.fail_json(msg="Invalid VLAN id: %s" % vlan)
+        if ports is None:
+            ports = dict()
+        if not isinstance(ports, dict) or set(ports) - set(['tagged', 'untagged']):
+            module.fail_json(msg="VLAN %d needs a dictionary of tagged and untagged ports" % vlan)
+        tagged = as_list(ports.get('tagged'))
+        untagged = as_list(ports.get('untagged'))
+        wanted[vlan] = (tagged, untagged)
+        names.update(tagged)
+        names.update(untagged)
+
+    ports = resolve_ports(module, client, names)
+
+    # Walking the row status along makes VLANs created or deleted since drop the cached walk
+    rows = client.walk_table([OID_DOT1Q_VLAN_STATIC_EGRESS_PORTS, OID_DOT1Q_VLAN_STATIC_UNTAGGED_PORTS,
+                              OID_DOT1Q_VLAN_STATIC_ROW_STATUS])
+
+    # Per VLAN: PortList length, current egress and untagged, wanted egress and untagged
+    states = dict()
+    for vlan, (tagged, untagged) in wanted.items():
+        row = rows.get(str(vlan))
+        if row is None or row[0] is None:
+            module.fail_json(msg="No such VLAN: %d" % vlan)
+        (egress, current_untagged) = row[:2]
+        length = len(egress.value)
+
+        want_egress = 0
+        want_untagged = 0
+        for name in tagged + untagged:
+            port = ports[name]
+            if port < 1 or port > length * 8:
+                module.fail_json(msg="Port %s is out of range for VLAN %d" % (name, vlan))
+            want_egress = want_egress | port_bit(port, length)
+            if name in untagged:
+                want_untagged = want_untagged | port_bit(port, length)
+
+        current_untagged = 0 if current_untagged is None else portlist_to_int(current_untagged.value)
+        states[vlan] = (length, portlist_to_int(egress.value), current_untagged, want_egress, want_untagged)
+
+    steps = [[], [], [], []]
+    changes = dict()
+    for vlan, (length, egress, untagged, want_egress, want_untagged) in sorted(states.items()):
+        oid_egress = OID_DOT1Q_VLAN_STATIC_EGRESS_PORTS + '.' + str(vlan)
+        oid_untagged = OID_DOT1Q_VLAN_STATIC_UNTAGGED_PORTS + '.' + str(vlan)
+
+        # Steps add egress, remove untagged, add untagged and remove egress
+        # ports, so untagged ports stay a subset of the egress ports. Each
+        # step writes the value the bitmap has after it, if it changes.
+        values = [(oid_egress, egress, egress | want_egress),
+                  (oid_untagged, untagged, untagged & want_untagged),
+                  (oid_untagged, untagged & want_untagged, want_untagged),
+                  (oid_egress, egress | want_egress, want_egress)]
+        for step, (oid, before, after) in enumerate(values):
+            if before != after:
+                steps[step].append({oid: snmp.OctetString(int_to_portlist(after, length))})
+
+        change = dict()
+        for key, bits in (('added', want_egress & ~egress), ('removed', egress & ~want_egress),
+                          ('untagged_added', want_untagged & ~untagged), ('untagged_removed', untagged & ~want_untagged)):
+            if bits:
+                change[key] = bits_to_ports(bits, length)
+        if change:
+            changes[str(vlan)] = change
+
+    if changes and not module.check_mode:
+        for groups in steps:
+            if groups:
+                client.set(groups, atomic=False)
+
+    module.exit_json(changed=bool(changes), vlans=changes)
+
+def parse_vlan_ids(module, value):
+    """ Parse VLAN ids and ranges such as "100-120,200" """
+    ids = []
+    for item in as_list(value):
+        try:
+            if isinstance(item, basestring) and '-' in item:
+                (first, last) = [int(bound) for bound in item.split('-', 1)]
+            else:
+                first = last = int(item)
+        except ValueError:
+            module.fail_json(msg="Invalid VLAN id or range: %s" % item)
+        if first < 1 or last > 4094 or first > last:
+            module.fail_json(msg="Invalid VLAN id or range: %s" % item)
+        ids.extend(range(first, last + 1))
+    return ids
+
+def parse_vlans(module, items, state, name):
+    """ Map VLAN ids to their desired state and name """
+    vlans = dict()
+    for item in items:
+        if isinstance(item, dict):
+            if set(item) - set(['vlan', 'name', 'state']) or 'vlan' not in item:
+                module.fail_json(msg="VLANs are given as vlan, name and state")
+            item_state = item.get('state') or state
+            item_name = item.get('name', name)
+            item = item['vlan']
+        else:
+            item_state = state
+            item_name = name
+
+        if item_state not in ('present', 'absent'):
+            module.fail_json(msg="Invalid VLAN state: %s" % item_state)
+        for vlan in parse_vlan_ids(module, item):
+            vlans[vlan] = (item_state, item_name)
+    return vlans
+
+def gvrp_var_binds(module, client, oid, gvrp):
+    """ Get the var-binds setting the GVRP status at oid, if it differs """
+    if not gvrp:
+        return dict()
+    wanted = SNMP_ENABLED if module.boolean(gvrp) else SNMP_DISABLED
+    values = client.get(oid)
+    if int(values[oid]) == wanted:
+        return dict()
+    return {oid: snmp.Integer32(wanted)}
+
+def apply_vlans(module, client, vlans, gvrp=None):
+    """ Create, rename and delete VLANs, toggling GVRP globally in the same SET """
+    rows = client.walk_table([OID_DOT1Q_VLAN_STATIC_ROW_STATUS, OID_DOT1Q_VLAN_STATIC_NAME])
+
+    groups = []
+    created = []
+    renamed = []
+    deleted = []
+    for vlan, (state, name) in sorted(vlans.items()):
+        oid_row_status = OID_DOT1Q_VLAN_STATIC_ROW_STATUS + '.' + str(vlan)
+        oid_name = OID_DOT1Q_VLAN_STATIC_NAME + '.' + str(vlan)
+        row = rows.get(str(vlan))
+        exists = row is not None and row[0] is not None
+
+        if state == 'absent':
+            if exists:
+                groups.append({oid_row_status: snmp.Integer32(ROW_STATUS_DESTROY)})
+                deleted.append(vlan)
+        elif not exists:
+            var_binds = {oid_row_status: snmp.Integer32(ROW_STATUS_CREATE_AND_GO)}
+            if name is not None:
+                var_binds[oid_name] = snmp.OctetString(name)
+            groups.append(var_binds)
+            created.append(vlan)
+        elif name is not None and (row[1] is None or str(row[1]) != name):
+            groups.append({oid_name: snmp.OctetString(name)})
+            renamed.append(vlan)
+
+    gvrp_changes = gvrp_var_binds(module, client, OID_DOT1Q_GVRP_STATUS, gvrp)
+    if gvrp_changes:
+        groups.append(gvrp_changes)
+
+    if groups and not module.check_mode:
+        client.set(groups, atomic=False)
+
+    module.exit_json(changed=bool(groups), created=created, renamed=renamed, deleted=deleted)
 
 def main():
     module = AnsibleModule(
@@ -134,15 +361,39 @@ def main():
 
             gvrp = dict(required=False, choices=BOOLEANS),
             vlan = dict(required=False),
+            vlans = dict(required=False, type='list'),
             state = dict(required=False, choices=['present', 'absent']),
             name = dict(required=False),
-            pvid = dict(required=False)
+            pvid = dict(required=False),
+            membership = dict(required=False, type='dict')
         ),
+        mutually_exclusive=[['membership', 'ifname'], ['membership', 'ifindex'], ['membership', 'port'],
+                            ['membership', 'gvrp'], ['membership', 'vlan'], ['membership', 'vlans'],
+                            ['vlans', 'vlan'], ['vlans', 'ifname'], ['vlans', 'ifindex'], ['vlans', 'port']],
         supports_check_mode=True
     )
 
     params = module.params
 
+    if params['membership'] is not None:
+        try:
+            apply_membership(module, snmp.SnmpClient(), params['membership'])
+        except snmp.SnmpError as e:
+            module.fail_json(msg=str(e))
+
+    has_selector = params['ifname'] or params['ifindex'] or params['port']
+
+    if params['vlans'] is not None or (params['vlan'] and not has_selector):
+        if params['pvid'] is not None:
+            module.fail_json(msg="pvid needs ifname, ifindex or port")
+        state = params['state'] or 'present'
+        items = params['vlans'] if params['vlans'] is not None else [params['vlan']]
+        vlans = parse_vlans(module, items, state, params['name'])
+        try:
+            apply_vlans(module, snmp.SnmpClient(), vlans, params['gvrp'])
+        except snmp.SnmpError as e:
+            module.fail_json(msg=str(e))
+
     ifname = params['ifname']
     ifindex = params['ifindex']
     port = params['port']
@@ -152,15 +403,9 @@ def main():
     name = params['name']
     pvid = params['pvid']
 
-    has_selector = ifname or ifindex or port
-
-    var_names = []
-
     client = snmp.SnmpClient()
 
     if has_selector:
-        var_binds = dict()
-
         if not port:
             if ifindex:
                 port = ifindex_to_port(client, ifindex)
@@ -169,34 +414,9 @@ def main():
             if not port:
                 module.fail_json(msg="No such port/interface")
 
-        oid_dot1q_port_gvrp_status = OID_DOT1Q_PORT_GVRP_STATUS + '.' + str(port)
-
-        if gvrp:
-            var_names.append(oid_dot1q_port_gvrp_status)
-    
-        values = client.get(*var_names)
-
-        if gvrp:
-            gvrp = module.boolean(gvrp)
-            if gvrp and int(values[oid_dot1q_port_gvrp_status]) != SNMP_ENABLED:
-                var_binds[oid_dot1q_port_gvrp_status] = snmp.Integer32(SNMP_ENABLED)
-            elif not gvrp and int(values[oid_dot1q_port_gvrp_status]) != SNMP_DISABLED:
-                var_binds[oid_dot1q_port_gvrp_status] = snmp.Integer32(SNMP_DISABLED)
-
+        var_binds = gvrp_var_binds(module, client, OID_DOT1Q_PORT_GVRP_STATUS + '.' + str(port), gvrp)
     else:
-        var_binds = dict()
-
-        if gvrp:
-            var_names.append(OID_DOT1Q_GVRP_STATUS)
-
-        values = client.get(*var_names)
-
-        if gvrp:
-            gvrp = module.boolean(gvrp)
-            if gvrp and int(values[OID_DOT1Q_GVRP_STATUS]) != SNMP_ENABLED:
-                var_binds[OID_DOT1Q_GVRP_STATUS] = snmp.Integer32(SNMP_ENABLED)
-            elif not gvrp and int(values[OID_DOT1Q_GVRP_STATUS]) != SNMP_DISABLED:
-                var_binds[OID_DOT1Q_GVRP_STATUS] = snmp.Integer32(SNMP_DISABLED)
+        var_binds = gvrp_var_binds(module, client, OID_DOT1Q_GVRP_STATUS, gvrp)
 
     if not var_binds:
         module.exit_json(changed=False)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import imp
+import os
+import sys
+
+TOP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOP_DIR, 'connection_plugins'))
+
+import snmp_client
+
+def load_module(name):
+    """ Import a module of the library directory """
+    return imp.load_source(name, os.path.join(TOP_DIR, 'library', name + '.py'))
+
+class Exited(Exception):
+    pass
+
+class Failed(Exception):
+    pass
+
+class Module(object):
+    """ Stands in for AnsibleModule, exit_json and fail_json raise instead of exiting """
+
+    def __init__(self, check_mode=False, **params):
+        self.params = params
+        self.check_mode = check_mode
+
+    def boolean(self, value):
+        return str(value).lower() in ('yes', 'on', '1', 'true')
+
+    def exit_json(self, **kwargs):
+        raise Exited(kwargs)
+
+    def fail_json(self, **kwargs):
+        raise Failed(kwargs['msg'])
+
+def module_class(check_mode=False, **params):
+    """ AnsibleModule replacement giving every argument not in params its default """
+    def create(argument_spec, **kwargs):
+        values = dict((name, params.get(name, spec.get('default'))) for name, spec in argument_spec.items())
+        return Module(check_mode, **values)
+    return create
+
+class Client(object):
+    """ Stands in for SnmpClient, serving a dictionary of OIDs and recording SETs """
+
+    def __init__(self, values, interfaces=None):
+        self.values = values
+        self.interfaces = interfaces or dict()
+        self.sets = []
+
+    def get(self, *names):
+        return dict((name, self.values.get(name)) for name in names)
+
+    def set(self, var_binds, atomic=True):
+        groups = [var_binds] if isinstance(var_binds, dict) else var_binds
+        self.sets.append(groups)
+        for group in groups:
+            self.values.update(group)
+
+    def walk_table(self, columns):
+        rows = dict()
+        for i, column in enumerate(columns):
+            for oid, value in self.values.items():
+                if oid.startswith(column + '.'):
+                    rows.setdefault(oid[len(column) + 1:], [None] * len(columns))[i] = value
+        return rows
+
+    def interface_map(self):
+        """ interfaces maps ifIndex to ifName and bridge port """
+        return snmp_client.InterfaceMap(dict((str(ifindex), row) for ifindex, row in self.interfaces.items()))
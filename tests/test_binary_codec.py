@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp_client
+
+# One value of every SNMP type, at the edges of their ranges
+SNMP_VALUES = [
+    snmp_client.OctetString('\x00\xffabc\n'),
+    snmp_client.ObjectIdentifier('1.3.6.1.2.1.31.1.1.1.1.4294967295'),
+    snmp_client.Integer32(-2 ** 31),
+    snmp_client.Integer32(2 ** 31 - 1),
+    snmp_client.Counter32(2 ** 32 - 1),
+    snmp_client.IpAddress('192.0.2.1'),
+    snmp_client.Gauge32(2 ** 32 - 1),
+    snmp_client.TimeTicks(4294967295),
+    snmp_client.Opaque('\x9f\x78\x04\x3f\x80\x00\x00'),
+    snmp_client.Counter64(2 ** 64 - 1),
+    snmp_client.Counter64(0)
+]
+
+PLAIN_VALUES = [None, True, False, 0, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 64, 1.5, '', 'abc\x00', u'\xe6\xf8\xe5', [], {}]
+
+class MyInt(int):
+    pass
+
+class MyLong(long):
+    pass
+
+class MyStr(str):
+    pass
+
+class MyUnicode(unicode):
+    pass
+
+class MyList(list):
+    pass
+
+class Peer(snmp_client._JsonRpcPeer):
+    def __init__(self):
+        self.lines = []
+        self.frames = []
+
+    def transmit(self, json):
+        self.lines.append(json)
+
+    def transmit_frame(self, frame):
+        self.frames.append(frame)
+
+class CodecTestMixin(object):
+    def round_trip(self, value):
+        raise NotImplementedError
+
+    def assertSnmpEqual(self, value, result):
+        self.assertEqual(result.__class__, value.__class__)
+        self.assertEqual(result.value, value.value)
+
+    def test_covers_every_type(self):
+        classes = set(value.__class__ for value in SNMP_VALUES)
+        self.assertEqual(classes, set(snmp_type.value_class for snmp_type in snmp_client._snmp_types.types()))
+
+    def test_snmp_values(self):
+        for value in SNMP_VALUES:
+            self.assertSnmpEqual(value, self.round_trip(value))
+
+    def test_plain_values(self):
+        for value in PLAIN_VALUES:
+            result = self.round_trip(value)
+            self.assertEqual(result, value)
+            self.assertEqual(type(result) is bool, type(value) is bool)
+
+    def test_reply(self):
+        var_binds = [[snmp_client.ObjectIdentifier('1.3.6.1.4.1.9.%d' % i), value] for (i, value) in enumerate(SNMP_VALUES)]
+        reply = dict(jsonrpc='2.0', id=7, result=var_binds)
+        result = self.round_trip(reply)
+        self.assertEqual(result['id'], 7)
+        self.assertEqual(len(result['result']), len(var_binds))
+        for ((oid, value), (expected_oid, expected_value)) in zip(result['result'], reply['result']):
+            self.assertSnmpEqual(expected_oid, oid)
+            self.assertSnmpEqual(expected_value, value)
+
+    def test_subclasses(self):
+        ordered = collections.OrderedDict([('b', 1), ('a', 2)])
+        self.assertEqual(self.round_trip(ordered), {'b': 1, 'a': 2})
+        self.assertEqual(self.round_trip([MyInt(-5), MyLong(2 ** 64), MyStr('abc'), MyUnicode(u'\xe6'), MyList([1])]),
+                         [-5, 2 ** 64, 'abc', u'\xe6', [1]])
+
+    def test_bool_is_not_int(self):
+        self.assertTrue(self.round_trip([True])[0] is True)
+        self.assertTrue(self.round_trip([1])[0] is not True)
+
+    def test_unsupported_type(self):
+        self.assertRaises(ValueError, self.round_trip, object())
+
+class BinaryCodecTest(CodecTestMixin, unittest.TestCase):
+    def round_trip(self, value):
+        codec = snmp_client._BinaryCodec()
+        return codec.decode(codec.encode(value))
+
+    def test_dict_keys_become_strings(self):
+        self.assertEqual(self.round_trip({1: 'a', None: 'b'}), {'1': 'a', 'null': 'b'})
+
+    def test_unknown_tag(self):
+        self.assertRaises(ValueError, snmp_client._BinaryCodec().decode, '?')
+
+class JsonCodecTest(CodecTestMixin, unittest.TestCase):
+    def round_trip(self, value):
+        peer = Peer()
+        return peer.unserialize(peer.serialize(value))
+
+    def test_plain_values(self):
+        # JSON turns str into unicode, which compares equal for ASCII only
+        for value in PLAIN_VALUES:
+            if isinstance(value, str):
+                value = value.decode('latin-1')
+            self.assertEqual(self.round_trip(value), value)
+
+class FramingTest(unittest.TestCase):
+    def make_client(self, reply):
+        client = object.__new__(snmp_client.SnmpClient)
+        client.lines = []
+        client.frames = []
+        client.transmit = client.lines.append
+        client.transmit_frame = client.frames.append
+
+        def call(method, *params):
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+        client._call = call
+        return client
+
+    def test_binary_accepted(self):
+        client = self.make_client('binary')
+        client._negotiate_framing()
+        client.send(id=1, result=snmp_client.Counter64(2 ** 64 - 1))
+        self.assertEqual(client.lines, [])
+        self.assertEqual(len(client.frames), 1)
+
+    def test_fallback_when_declined(self):
+        client = self.make_client('json')
+        client._negotiate_framing()
+        client.send(id=1, result=snmp_client.Counter64(2 ** 64 - 1))
+        self.assertEqual(client.frames, [])
+        result = client.unserialize(client.lines[0])['result']
+        self.assertTrue(isinstance(result, snmp_client.Counter64))
+        self.assertEqual(result.value, 2 ** 64 - 1)
+
+    def test_fallback_when_unsupported(self):
+        client = self.make_client(snmp_client.SnmpError('Method not found: framing'))
+        client._negotiate_framing()
+        client.send(id=1, result=snmp_client.OctetString('\xff'))
+        self.assertEqual(client.frames, [])
+        self.assertEqual(client.unserialize(client.lines[0])['result'].value, '\xff')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+AUTH = dict(community='public')
+
+class Connection(object):
+    """ Stands in for _SnmpConnection, which would set up a pysnmp engine """
+
+    def __init__(self, host, port, auth_params, key):
+        self.key = key
+
+class Server(object):
+    def __init__(self, broker, key, last_active):
+        self._broker = broker
+        self._key = key
+        self.last_active = last_active
+        self.closed = False
+
+    def session_key(self):
+        return self._key
+
+    def close(self):
+        self.closed = True
+        self._broker.remove_server(self)
+
+class BrokerTest(unittest.TestCase):
+    def setUp(self):
+        self.connection_class = snmp._SnmpConnection
+        snmp._SnmpConnection = Connection
+        self.broker = snmp._Broker('/nonexistent/broker.sock')
+
+    def tearDown(self):
+        snmp._SnmpConnection = self.connection_class
+
+    def test_sessions_are_shared(self):
+        key = self.broker.open_session('192.0.2.1', 161, AUTH)
+        self.assertEqual(self.broker.open_session('192.0.2.1', 161, dict(AUTH)), key)
+        self.assertTrue(self.broker.get_session(key) is self.broker.get_session(key))
+        self.assertEqual(self.broker.get_session(key).key, key)
+
+    def test_sessions_differ_by_auth(self):
+        public = self.broker.open_session('192.0.2.1', 161, AUTH)
+        private = self.broker.open_session('192.0.2.1', 161, dict(community='private'))
+        other_port = self.broker.open_session('192.0.2.1', 1161, AUTH)
+        self.assertEqual(len(set([public, private, other_port])), 3)
+
+    def test_unknown_session(self):
+        self.assertEqual(self.broker.get_session('nope'), None)
+
+    def test_idle_servers_are_closed(self):
+        idle = Server(self.broker, None, 100.0)
+        busy = Server(self.broker, None, 200.0)
+        self.broker.add_server(idle)
+        self.broker.add_server(busy)
+        self.broker._expire(150.0)
+        self.assertTrue(idle.closed)
+        self.assertFalse(busy.closed)
+
+    def test_idle_sessions_are_dropped(self):
+        idle = self.broker.open_session('192.0.2.1', 161, AUTH)
+        attached = self.broker.open_session('192.0.2.2', 161, AUTH)
+        self.broker.add_server(Server(self.broker, attached, float('inf')))
+        self.broker._expire(float('inf'))
+        self.assertEqual(self.broker.get_session(idle), None)
+        self.assertNotEqual(self.broker.get_session(attached), None)
+
+class BrokerConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.timeout = snmp.SNMP_TIMEOUT
+
+    def tearDown(self):
+        snmp.SNMP_TIMEOUT = self.timeout
+
+    def test_key_follows_settings(self):
+        key = snmp._broker_config_key()
+        self.assertEqual(snmp._broker_config_key(), key)
+        snmp.SNMP_TIMEOUT = self.timeout + 1
+        self.assertNotEqual(snmp._broker_config_key(), key)
+
+if __name__ == '__main__':
+    unittest.main()
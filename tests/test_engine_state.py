@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+ADDRESS = ('192.0.2.1', 161)
+ENGINE_ID = '\x80\x00\x00\x09\x03\x00\xff'
+
+class EngineStateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = snmp.SNMP_STATE_DIR
+        snmp.SNMP_STATE_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(snmp.SNMP_STATE_DIR)
+        snmp.SNMP_STATE_DIR = self.state_dir
+
+    def test_round_trip(self):
+        store = snmp._EngineStateStore(False)
+        self.assertEqual(store.get(ADDRESS), None)
+        store.put(ADDRESS, ENGINE_ID, ENGINE_ID, '', 3, 1000)
+        self.assertEqual(store.get(ADDRESS), (ENGINE_ID, ENGINE_ID, '', 3, 1000))
+        self.assertEqual(store.get(('192.0.2.1', 1161)), None)
+        self.assertEqual(os.listdir(snmp.SNMP_STATE_DIR), [])
+
+    def test_engine_time_moves_on(self):
+        store = snmp._EngineStateStore(False)
+        store.put(ADDRESS, ENGINE_ID, ENGINE_ID, '', 3, 1000)
+        store._states['%s:%s' % ADDRESS]['saved'] = int(time.time()) - 60
+        self.assertEqual(store.get(ADDRESS)[4], 1060)
+
+    def test_persisted(self):
+        snmp._EngineStateStore(True).put(ADDRESS, ENGINE_ID, ENGINE_ID, 'ctx', 3, 1000)
+        snmp._EngineStateStore(True).put(('192.0.2.2', 161), 'other', 'other', '', 1, 5)
+        store = snmp._EngineStateStore(True)
+        self.assertEqual(store.get(ADDRESS)[:4], (ENGINE_ID, ENGINE_ID, 'ctx', 3))
+        self.assertEqual(store.get(('192.0.2.2', 161))[0], 'other')
+
+        store.remove(ADDRESS)
+        self.assertEqual(snmp._EngineStateStore(True).get(ADDRESS), None)
+        self.assertNotEqual(snmp._EngineStateStore(True).get(('192.0.2.2', 161)), None)
+
+        mode = os.stat(os.path.join(snmp.SNMP_STATE_DIR, 'usm-engines.json')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o600)
+
+    def test_unreadable_file(self):
+        with open(os.path.join(snmp.SNMP_STATE_DIR, 'usm-engines.json'), 'w') as f:
+            f.write('{')
+        store = snmp._EngineStateStore(True)
+        self.assertEqual(store.get(ADDRESS), None)
+        store.put(ADDRESS, ENGINE_ID, ENGINE_ID, '', 3, 1000)
+        self.assertEqual(snmp._EngineStateStore(True).get(ADDRESS)[0], ENGINE_ID)
+
+    def test_damaged_entry(self):
+        snmp._EngineStateStore(True).put(ADDRESS, ENGINE_ID, ENGINE_ID, '', 3, 1000)
+        snmp._update_state('usm-engines.json', lambda data: data['%s:%s' % ADDRESS].pop('boots'))
+        self.assertEqual(snmp._EngineStateStore(True).get(ADDRESS), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+class Dispatcher(object):
+    """ Stands in for a pysnmp transport dispatcher """
+
+    def __init__(self):
+        self.ticks = []
+        self.pending = False
+
+    def handleTimerTick(self, now):
+        self.ticks.append(now)
+
+    def getSocketMap(self):
+        return {}
+
+    def jobsArePending(self):
+        return self.pending
+
+class Handler(object):
+    def __init__(self, fd):
+        self.fd = fd
+        self.reading = True
+        self.reads = 0
+
+    def fileno(self):
+        return self.fd
+
+    def readable(self):
+        return self.reading
+
+    def writable(self):
+        return False
+
+    def handle_read_event(self):
+        self.reads = self.reads + 1
+        os.read(self.fd, 1)
+
+class Poller(object):
+    """ Wraps a poller, counting the changes of registrations """
+
+    def __init__(self, poller):
+        self._poller = poller
+        self.changes = 0
+
+    def register(self, fd, events):
+        self.changes = self.changes + 1
+        self._poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self.changes = self.changes + 1
+        self._poller.modify(fd, events)
+
+    def unregister(self, fd):
+        self.changes = self.changes + 1
+        self._poller.unregister(fd)
+
+    def poll(self, *args):
+        return self._poller.poll(*args)
+
+class EventLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = snmp._EventLoop()
+        self.dispatcher = Dispatcher()
+        self.loop.add_dispatcher(self.dispatcher)
+
+        # The first run ticks right away
+        self.loop.run_once(0)
+        del self.dispatcher.ticks[:]
+
+    def test_sleeps_until_limit_when_idle(self):
+        start = time.time()
+        self.loop.run_once(0.25)
+        self.assertTrue(time.time() - start >= 0.25)
+
+    def test_wakes_at_deadline(self):
+        start = time.time()
+        self.loop.add_deadline(start + 0.15)
+        self.loop.run_once(5)
+        self.assertTrue(0.15 <= time.time() - start < 1)
+
+    def test_cancelled_deadline_does_not_wake(self):
+        start = time.time()
+        self.loop.cancel_deadline(self.loop.add_deadline(start + 0.05))
+        self.loop.run_once(0.3)
+        self.assertTrue(time.time() - start >= 0.3)
+
+    def test_runs_missed_ticks_in_order(self):
+        resolution = snmp.SNMP_TIMER_RESOLUTION
+        self.loop.run_once(resolution * 3.5)
+        ticks = self.dispatcher.ticks
+        self.assertEqual(len(ticks), 3)
+        for first, second in zip(ticks, ticks[1:]):
+            self.assertAlmostEqual(second - first, resolution, places=3)
+
+    def test_ticks_while_jobs_are_pending(self):
+        self.dispatcher.pending = True
+        start = time.time()
+        self.loop.run_once(5)
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(self.dispatcher.ticks)
+
+    def test_registers_only_on_changes(self):
+        poller = Poller(self.loop._poller)
+        self.loop._poller = poller
+        (read_fd, write_fd) = os.pipe()
+        try:
+            handler = Handler(read_fd)
+            self.loop.add(handler)
+            for i in range(5):
+                os.write(write_fd, b'x')
+                self.loop.run_once(1)
+            self.assertEqual(handler.reads, 5)
+            self.assertEqual(poller.changes, 1)
+
+            handler.reading = False
+            self.loop.run_once(0)
+            self.loop.run_once(0)
+            self.assertEqual(poller.changes, 2)
+
+            handler.reading = True
+            self.loop.run_once(0)
+            self.loop.remove(handler)
+            self.assertEqual(poller.changes, 4)
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins')
+sys.path.insert(0, PLUGIN_DIR)
+
+import snmp
+
+MODULE = '''#!/usr/bin/python
+import os
+import sys
+import json
+import signal
+import snmp_client
+
+import helper
+
+signal.signal(signal.SIGUSR1, lambda signum, frame: None)
+os.chdir('/')
+os.environ['LEFT_BEHIND'] = '1'
+sys.stderr.write('warning\\n')
+print(json.dumps(dict(changed=False, argv=sys.argv, foo=os.environ.get('FOO'), helper=helper.VALUE)))
+sys.exit(%s)
+'''
+
+class Connection(object):
+    """ Stands in for _SnmpConnection, the modules do not talk SNMP """
+
+    loop = None
+    key = 'test'
+
+class Plugin(object):
+    """ Stands in for the connection plugin running the module """
+
+    host = 'test'
+
+    def _get_snmp_connection(self):
+        return Connection()
+
+class InProcessTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_path, 'module.py')
+        with open(os.path.join(self.tmp_path, 'helper.py'), 'w') as f:
+            f.write('VALUE = 42\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def write_module(self, exit_code):
+        with open(self.path, 'w') as f:
+            f.write(MODULE % exit_code)
+
+    def run_subprocess(self, env):
+        env = dict(os.environ, PYTHONPATH=PLUGIN_DIR, **env)
+        p = subprocess.Popen([sys.executable, self.path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        (stdout, stderr) = p.communicate()
+        return (p.returncode, stdout, stderr)
+
+    def run_in_process(self, cmd):
+        (rc, stdin, stdout, stderr) = snmp.Connection._exec_module_in_process.__func__(Plugin(), cmd)
+        return (rc, stdout, stderr)
+
+    def test_same_as_subprocess(self):
+        for exit_code in ('0', '3', 'None', '"failed"'):
+            self.write_module(exit_code)
+            cmd = 'LANG=C FOO=\'a "b"\' /usr/bin/python %s' % self.path
+            self.assertEqual(self.run_in_process(cmd), self.run_subprocess(dict(LANG='C', FOO='a "b"')))
+
+    def test_state_is_restored(self):
+        self.write_module('0')
+        cwd = os.getcwd()
+        argv = list(sys.argv)
+        path = list(sys.path)
+        handler = snmp.signal.getsignal(snmp.signal.SIGUSR1)
+
+        self.run_in_process('/usr/bin/python %s' % self.path)
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(sys.argv, argv)
+        self.assertEqual(sys.path, path)
+        self.assertFalse('LEFT_BEHIND' in os.environ)
+        self.assertFalse('helper' in sys.modules)
+        self.assertEqual(snmp.signal.getsignal(snmp.signal.SIGUSR1), handler)
+
+    def test_temporary_directory_is_removed(self):
+        self.write_module('0')
+        (rc, stdout, stderr) = self.run_in_process('/usr/bin/python %s; rm -rf %s/ >/dev/null 2>&1' %
+                                                   (self.path, self.tmp_path))
+        self.assertEqual(rc, 0)
+        self.assertFalse(os.path.exists(self.tmp_path))
+
+    def test_other_modules_run_in_subprocess(self):
+        with open(self.path, 'w') as f:
+            f.write('print("{}")\n')
+        self.assertEqual(snmp.Connection._exec_module_in_process.__func__(Plugin(), '/usr/bin/python %s' % self.path), None)
+        self.write_module('0')
+        self.assertEqual(snmp.Connection._exec_module_in_process.__func__(Plugin(), 'cat %s' % self.path), None)
+
+if __name__ == '__main__':
+    unittest.main()
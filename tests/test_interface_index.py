@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import stat
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+ROWS = {'1': ['gi1', 1], '2': ['gi2', 2]}
+
+class InterfaceIndexTest(unittest.TestCase):
+    def setUp(self):
+        # Saved at 1000 s of wall clock time with the device up for 50 s
+        self.index = snmp._InterfaceIndex(5000, 42, ROWS, 1000.0)
+
+    def test_valid_while_uptime_follows_wall_clock(self):
+        self.assertTrue(self.index.is_valid(5000 + 3600 * 100, 42, 1000.0 + 3600))
+
+    def test_invalid_when_table_changed(self):
+        self.assertFalse(self.index.is_valid(5000 + 3600 * 100, 43, 1000.0 + 3600))
+
+    def test_invalid_after_reboot_with_larger_uptime(self):
+        # Rebooted 10 minutes after saving and up for 50 minutes since
+        self.assertFalse(self.index.is_valid(3000 * 100, 42, 1000.0 + 3600))
+
+    def test_invalid_after_reboot_with_smaller_uptime(self):
+        self.assertFalse(self.index.is_valid(1000, 42, 1000.0 + 3600))
+
+    def test_invalid_when_clock_went_backwards(self):
+        self.assertFalse(self.index.is_valid(5000, 42, 999.0))
+
+    def test_missing_values(self):
+        self.assertFalse(self.index.is_valid(None, 42, 1000.0))
+        self.assertFalse(self.index.is_valid(5000, None, 1000.0))
+
+class StateDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = snmp.SNMP_STATE_DIR
+        snmp.SNMP_STATE_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(snmp.SNMP_STATE_DIR)
+        snmp.SNMP_STATE_DIR = self.state_dir
+
+class SavedIndexTest(StateDirTestCase):
+    def test_round_trip(self):
+        snmp._InterfaceIndex(5000, 42, ROWS, 1000.0).save('host')
+        index = snmp._InterfaceIndex.load('host')
+        self.assertEqual((index.sys_up_time, index.if_table_last_change, index.rows, index.saved_at),
+                         (5000, 42, ROWS, 1000.0))
+        self.assertEqual(snmp._InterfaceIndex.load('other'), None)
+
+        mode = os.stat(os.path.join(snmp.SNMP_STATE_DIR, 'index-host.json')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o600)
+
+    def test_remove(self):
+        snmp._InterfaceIndex(5000, 42, ROWS, 1000.0).save('host')
+        snmp._InterfaceIndex.remove('host')
+        self.assertEqual(snmp._InterfaceIndex.load('host'), None)
+        snmp._InterfaceIndex.remove('host')
+
+    def test_failed_save_keeps_old_index(self):
+        snmp._InterfaceIndex(5000, 42, ROWS, 1000.0).save('host')
+        self.assertRaises(TypeError, snmp._InterfaceIndex(5000, 42, object(), 1000.0).save, 'host')
+        self.assertEqual(snmp._InterfaceIndex.load('host').rows, ROWS)
+        self.assertEqual(os.listdir(snmp.SNMP_STATE_DIR), ['index-host.json'])
+
+class Connection(object):
+    key = 'host'
+    interface_index = None
+
+class Server(snmp._Server):
+    def __init__(self, conn):
+        snmp._Server.__init__(self, conn, None, None, None)
+
+    def send(self, **kwargs):
+        pass
+
+class InvalidationTest(StateDirTestCase):
+    def setUp(self):
+        StateDirTestCase.setUp(self)
+        self.request_class = snmp._VarBindRequest
+        snmp._VarBindRequest = lambda *args: self
+        self.conn = Connection()
+        self.conn.interface_index = snmp._InterfaceIndex(5000, 42, ROWS, 1000.0)
+        self.conn.interface_index.save('host')
+
+    def tearDown(self):
+        snmp._VarBindRequest = self.request_class
+        StateDirTestCase.tearDown(self)
+
+    def start(self):
+        """ Stands in for the _VarBindRequest of rpc_set """
+
+    def test_set_of_interface_tables(self):
+        Server(self.conn).rpc_set(1, {'1.3.6.1.2.1.31.1.1.1.18.1': snmp.OctetString('Uplink')})
+        self.assertEqual(self.conn.interface_index, None)
+        self.assertEqual(snmp._InterfaceIndex.load('host'), None)
+
+    def test_set_of_other_tables(self):
+        Server(self.conn).rpc_set(1, {'1.3.6.1.2.1.1.5.0': snmp.OctetString('sw1')})
+        self.assertNotEqual(self.conn.interface_index, None)
+        self.assertNotEqual(snmp._InterfaceIndex.load('host'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+class MaxRepetitionsTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = object.__new__(snmp._SnmpConnection)
+        self.conn.max_repetitions = snmp._DEFAULT_MAX_REPETITIONS
+        self.conn.max_message_size = 1472
+        self.conn._var_bind_size = None
+
+    def test_grows_while_responses_are_full(self):
+        self.conn.update_max_repetitions(10, 10, 200, False)
+        self.assertEqual(self.conn.max_repetitions, 20)
+        self.conn.update_max_repetitions(20, 20, 400, False)
+        self.assertEqual(self.conn.max_repetitions, 40)
+
+    def test_limited_by_message_size(self):
+        # 100 bytes per repetition leave room for 14 in 1472 bytes
+        self.conn.update_max_repetitions(10, 10, 1000, False)
+        self.assertEqual(self.conn.max_repetitions, 14)
+
+    def test_limited_by_setting(self):
+        self.conn.max_message_size = 1000000
+        for i in range(20):
+            self.conn.update_max_repetitions(self.conn.max_repetitions, self.conn.max_repetitions, 1, False)
+        self.assertEqual(self.conn.max_repetitions, snmp.SNMP_MAX_REPETITIONS)
+
+    def test_end_of_walk_teaches_nothing(self):
+        self.conn.update_max_repetitions(10, 3, 60, False)
+        self.assertEqual(self.conn.max_repetitions, 10)
+
+    def test_truncated_response(self):
+        self.conn.update_max_repetitions(10, 6, 700, True)
+        self.assertEqual(self.conn.max_repetitions, 6)
+        self.assertEqual(self.conn.max_message_size, 700)
+
+    def test_too_big(self):
+        self.conn.update_max_repetitions(10, 10, 500, False)
+        self.assertEqual(self.conn.max_repetitions, 20)
+        self.assertTrue(self.conn.reduce_max_repetitions(too_big=True))
+        self.assertEqual(self.conn.max_repetitions, 10)
+
+        # The message size that failed is never tried again
+        self.assertEqual(self.conn.max_message_size, 999)
+        self.conn.update_max_repetitions(10, 10, 500, False)
+        self.assertEqual(self.conn.max_repetitions, 19)
+
+    def test_reduce_stops_at_one(self):
+        self.conn.max_repetitions = 2
+        self.assertTrue(self.conn.reduce_max_repetitions())
+        self.assertEqual(self.conn.max_repetitions, 1)
+        self.assertFalse(self.conn.reduce_max_repetitions())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+class OidTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.trie = snmp._OidTrie()
+        self.trie.add((1, 3, 6), 'internet')
+        self.trie.add((1, 3, 6, 1, 2, 1), 'mib-2')
+        self.trie.add((1, 3, 6, 1, 2, 1, 2, 2), 'ifTable')
+        self.trie.add((1, 3, 6, 1, 4), 'private')
+
+    def test_get(self):
+        self.assertEqual(self.trie.get((1, 3, 6, 1, 2, 1)), 'mib-2')
+        self.assertEqual(self.trie.get((1, 3, 6, 1)), None)
+        self.assertEqual(self.trie.get((1, 3, 6, 1), 'none'), 'none')
+        self.assertEqual(self.trie.get((2,)), None)
+
+    def test_none_is_a_value(self):
+        self.trie.add((1, 3, 6, 1), None)
+        self.assertEqual(self.trie.get((1, 3, 6, 1), 'none'), None)
+        self.assertEqual(self.trie.prefixes((1, 3, 6, 1, 2)), ['internet', None])
+
+    def test_prefixes(self):
+        self.assertEqual(self.trie.prefixes((1, 3, 6, 1, 2, 1, 2, 2, 1, 7, 5)), ['internet', 'mib-2', 'ifTable'])
+        self.assertEqual(self.trie.prefixes((1, 3, 6, 1, 2, 1)), ['internet', 'mib-2'])
+        self.assertEqual(self.trie.prefixes((1, 3)), [])
+
+    def test_subtree(self):
+        self.assertEqual(sorted(self.trie.subtree((1, 3, 6, 1))), ['ifTable', 'mib-2', 'private'])
+        self.assertEqual(self.trie.subtree((1, 3, 6, 1, 2, 1, 2, 2)), ['ifTable'])
+        self.assertEqual(self.trie.subtree((1, 3, 7)), [])
+
+    def test_remove_prunes(self):
+        self.trie.remove((1, 3, 6, 1, 2, 1, 2, 2))
+        self.assertEqual(self.trie.get((1, 3, 6, 1, 2, 1, 2, 2)), None)
+        self.assertEqual(self.trie._find((1, 3, 6, 1, 2, 1, 2)), None)
+        self.assertEqual(self.trie.get((1, 3, 6, 1, 2, 1)), 'mib-2')
+
+        # Nodes on the way to other values stay
+        self.trie.remove((1, 3, 6, 1, 2, 1))
+        self.assertEqual(self.trie.get((1, 3, 6, 1, 4)), 'private')
+        self.trie.remove((1, 3, 6, 9))
+
+if __name__ == '__main__':
+    unittest.main()
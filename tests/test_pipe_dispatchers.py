@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import os
+import select
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+class Loop(object):
+    def add(self, handler):
+        pass
+
+    def remove(self, handler):
+        pass
+
+class Receiver(object):
+    """ Stands in for _Server, collecting what arrives """
+
+    def __init__(self):
+        self.messages = []
+        self.eof = False
+
+    def handle_line(self, line):
+        self.messages.append(line)
+
+    def handle_frame(self, frame):
+        self.messages.append(frame)
+
+    def handle_eof(self):
+        self.eof = True
+
+class PipeDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        (pipe_in, pipe_out) = os.pipe()
+        self.receiver = Receiver()
+        self.reader = snmp._ReceiveDispatcher(pipe_in, self.receiver, Loop())
+        self.writer = snmp._TransmitDispatcher(pipe_out, Loop())
+        os.close(pipe_in)
+        os.close(pipe_out)
+        self.drained = []
+        self.writer.call_when_drained(lambda: self.drained.append(self.writer.backlog()))
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def transfer(self):
+        while True:
+            while self.reader.readable() and select.select([self.reader], [], [], 0)[0]:
+                self.reader.handle_read_event()
+            if not self.writer.writable():
+                break
+            self.writer.handle_write_event()
+
+    def test_lines(self):
+        lines = ['x' * 1000000, '', '{"id": 1}', 'y' * (snmp._READ_SIZE - 1)]
+        for line in lines:
+            self.writer.send_line(line)
+        self.assertEqual(self.writer.backlog(), sum(len(line) + 1 for line in lines))
+        self.transfer()
+        self.assertEqual(self.receiver.messages, lines)
+        self.assertEqual(self.drained, [0])
+
+    def test_frames(self):
+        frames = ['\n' * 1000000, '', '\x00\xff']
+        self.reader.binary = True
+        for frame in frames:
+            self.writer.send_frame(frame)
+        self.transfer()
+        self.assertEqual(self.receiver.messages, frames)
+
+    def test_eof(self):
+        self.writer.send_line('last')
+        self.transfer()
+        self.writer.close()
+        self.transfer()
+        self.assertEqual(self.receiver.messages, ['last'])
+        self.assertTrue(self.receiver.eof)
+        self.assertFalse(self.reader.readable())
+
+if __name__ == '__main__':
+    unittest.main()
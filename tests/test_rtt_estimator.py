@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+class Loop(object):
+    def add_deadline(self, when):
+        return [when]
+
+    def cancel_deadline(self, deadline):
+        pass
+
+class Dispatcher(object):
+    def getTimerResolution(self):
+        return 0.1
+
+class Generator(object):
+    """ Stands in for the pysnmp command generator, holding the callbacks """
+
+    def __init__(self):
+        self.callbacks = []
+
+    def getCmd(self, auth, transport, object_ids, callback):
+        self.callbacks.append(callback)
+
+    def time_out(self):
+        """ Time out every request in flight at once """
+        (callbacks, self.callbacks) = (self.callbacks, [])
+        for (cb_fun, cb_ctx) in callbacks:
+            cb_fun(None, 'requestTimedOut', 0, 0, [], cb_ctx)
+
+class RttEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.rtt = snmp._RttEstimator(1.0, 0.2, 10.0, 0.1)
+
+    def test_backoff(self):
+        self.rtt.backoff(self.rtt.transmitted())
+        self.assertEqual(self.rtt.rto, 2.0)
+        self.rtt.backoff(self.rtt.transmitted())
+        self.assertEqual(self.rtt.rto, 4.0)
+
+    def test_backoff_once_per_timeout_event(self):
+        sequences = [self.rtt.transmitted() for i in range(5)]
+        for sequence in sequences:
+            self.rtt.backoff(sequence)
+        self.assertEqual(self.rtt.rto, 2.0)
+
+        # Transmissions after the backoff may back off again
+        self.rtt.backoff(self.rtt.transmitted())
+        self.assertEqual(self.rtt.rto, 4.0)
+
+    def test_backoff_ceiling(self):
+        for i in range(10):
+            self.rtt.backoff(self.rtt.transmitted())
+        self.assertEqual(self.rtt.rto, 10.0)
+
+    def test_sample(self):
+        for i in range(10):
+            self.rtt.sample(0.01)
+        self.assertEqual(self.rtt.rto, 0.2)
+
+class ConcurrentTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = object.__new__(snmp._SnmpConnection)
+        self.connection.loop = Loop()
+        self.connection.dispatcher = Dispatcher()
+        self.connection.generator = Generator()
+        self.connection.auth = None
+        self.connection.transport = None
+        self.connection.rtt = snmp._RttEstimator(1.0, 0.2, 10.0, 0.1)
+        self.connection._usm_state = None
+        self.connection._engine_state_restored = False
+        self.connection._timeout = 1.0
+        self.connection._apply_timeout = lambda: None
+        self.results = []
+
+    def callback(self, handle, error_indication, error_status, error_index, var_binds, ctx):
+        self.results.append(error_indication)
+
+    def test_concurrent_timeouts_back_off_once(self):
+        for i in range(8):
+            self.connection.get(['1.3.6.1.2.1.1.3.0'], (self.callback, None))
+
+        self.connection.generator.time_out()
+        self.assertEqual(self.connection.rtt.rto, 2.0)
+        self.assertEqual(len(self.connection.generator.callbacks), 8)
+
+        # The retransmissions time out together as well
+        self.connection.generator.time_out()
+        self.assertEqual(self.connection.rtt.rto, 4.0)
+
+    def test_retries_run_out(self):
+        self.connection.get(['1.3.6.1.2.1.1.3.0'], (self.callback, None))
+        for i in range(snmp.SNMP_RETRIES + 1):
+            self.connection.generator.time_out()
+        self.assertEqual(self.results, ['requestTimedOut'])
+        self.assertEqual(self.connection.rtt.rto, min(10.0, 2.0 ** (snmp.SNMP_RETRIES + 1)))
+
+if __name__ == '__main__':
+    unittest.main()
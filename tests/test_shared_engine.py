@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+USER = dict(user='admin', engine_id=None, auth_protocol='sha', auth_key='secret1',
+            priv_protocol='aes', priv_key='secret2')
+
+class Engine(snmp._SnmpEngine):
+    """ _SnmpEngine without the pysnmp engine and dispatcher """
+
+    def __init__(self):
+        self._users = dict()
+
+class SharedEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine_class = snmp._SnmpEngine
+        snmp._SnmpEngine = Engine
+        self.engines = list(snmp._snmp_engines)
+        del snmp._snmp_engines[:]
+
+    def tearDown(self):
+        snmp._SnmpEngine = self.engine_class
+        snmp._snmp_engines[:] = self.engines
+
+    def test_shared_by_communities_and_users(self):
+        shared = snmp._get_snmp_engine(dict(community='public'))
+        self.assertTrue(snmp._get_snmp_engine(dict(community='private')) is shared)
+        self.assertTrue(snmp._get_snmp_engine(USER) is shared)
+        self.assertTrue(snmp._get_snmp_engine(dict(USER)) is shared)
+        self.assertTrue(snmp._get_snmp_engine(dict(USER, user='operator', auth_key='other')) is shared)
+        self.assertEqual(len(snmp._snmp_engines), 1)
+
+    def test_user_with_other_keys(self):
+        shared = snmp._get_snmp_engine(USER)
+        other = snmp._get_snmp_engine(dict(USER, auth_key='changed'))
+        self.assertFalse(other is shared)
+        self.assertTrue(snmp._get_snmp_engine(dict(USER, auth_key='changed')) is other)
+
+        # The same user of another engine ID has keys of its own
+        self.assertTrue(snmp._get_snmp_engine(dict(USER, engine_id='8000000903', auth_key='third')) is shared)
+        self.assertEqual(len(snmp._snmp_engines), 2)
+
+if __name__ == '__main__':
+    unittest.main()
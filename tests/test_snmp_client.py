@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import StringIO
+import subprocess
+import unittest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins')
+sys.path.insert(0, PLUGIN_DIR)
+
+import snmp_client
+
+def make_client(replies):
+    """ Client reading the given replies and collecting its requests """
+    client = object.__new__(snmp_client.SnmpClient)
+    client._pipe_in = StringIO.StringIO(''.join(client.serialize(reply) + '\n' for reply in replies))
+    client._pipe_out = StringIO.StringIO()
+    client._next_id = 1
+    client._pending = dict()
+    return client
+
+def requests(client):
+    return [client.unserialize(line) for line in client._pipe_out.getvalue().splitlines()]
+
+class PipeliningTest(unittest.TestCase):
+    def test_replies_in_any_order(self):
+        client = make_client([dict(jsonrpc='2.0', id=3, result='c'),
+                              dict(jsonrpc='2.0', id=2, error=dict(code=0, message='b failed')),
+                              dict(jsonrpc='2.0', id=1, result='a')])
+        first = client.get_async('1.3.6.1.2.1.1.1.0')
+        second = client.get_async('1.3.6.1.2.1.1.2.0')
+        third = client.walk_async('1.3.6.1.2.1.2.2.1.2')
+
+        # Every request is sent before any reply is read
+        self.assertEqual([request['id'] for request in requests(client)], [1, 2, 3])
+        self.assertEqual(client.wait(first, third), ['a', 'c'])
+        self.assertTrue(second.done())
+        self.assertRaises(snmp_client.SnmpError, second.result)
+        self.assertEqual(client._pending, dict())
+
+    def test_lost_connection(self):
+        client = make_client([])
+        self.assertRaises(snmp_client.SnmpError, client.get, '1.3.6.1.2.1.1.1.0')
+
+class StreamTest(unittest.TestCase):
+    def test_chunks(self):
+        client = make_client([dict(jsonrpc='2.0', id=1, partial=[['1', 'a'], ['2', 'b']]),
+                              dict(jsonrpc='2.0', id=1, partial=[['3', 'c']]),
+                              dict(jsonrpc='2.0', id=1, result=None)])
+        self.assertEqual(list(client.walk_iter('1.3.6.1.2.1.31.1.1.1.1')), [('1', 'a'), ('2', 'b'), ('3', 'c')])
+
+    def test_error_after_chunks(self):
+        client = make_client([dict(jsonrpc='2.0', id=1, partial=[['1', 'a']]),
+                              dict(jsonrpc='2.0', id=1, error=dict(code=0, message='requestTimedOut'))])
+        stream = client.walk_iter('1.3.6.1.2.1.31.1.1.1.1')
+        self.assertEqual(stream.next(), ('1', 'a'))
+        self.assertRaises(snmp_client.SnmpError, stream.next)
+
+    def test_break_cancels(self):
+        client = make_client([dict(jsonrpc='2.0', id=1, partial=[['1', 'a'], ['2', 'b']]),
+                              # Sent before the server saw the cancel
+                              dict(jsonrpc='2.0', id=1, partial=[['3', 'c']]),
+                              dict(jsonrpc='2.0', id=2, result=True),
+                              dict(jsonrpc='2.0', id=3, result={'1.3.6.1.2.1.1.5.0': 'sw1'})])
+        for item in client.walk_iter('1.3.6.1.2.1.31.1.1.1.1'):
+            break
+
+        self.assertEqual(requests(client)[1]['method'], 'cancel')
+        self.assertEqual(requests(client)[1]['params'], [1])
+        self.assertFalse(1 in client._pending)
+
+        # The channel stays usable, the leftovers of the walk are skipped
+        self.assertEqual(client.get('1.3.6.1.2.1.1.5.0'), {'1.3.6.1.2.1.1.5.0': 'sw1'})
+        self.assertEqual(client._pending, dict())
+
+    def test_finished_stream_is_not_cancelled(self):
+        client = make_client([dict(jsonrpc='2.0', id=1, partial=[['1', 'a']]),
+                              dict(jsonrpc='2.0', id=1, result=None)])
+        stream = client.walk_iter('1.3.6.1.2.1.31.1.1.1.1')
+        self.assertEqual(list(stream), [('1', 'a')])
+        stream.close()
+        self.assertEqual(len(requests(client)), 1)
+
+class ImportTest(unittest.TestCase):
+    def test_controller_packages_are_not_imported(self):
+        code = ('import sys; sys.path.insert(0, %r); import snmp_client; '
+                'print(sorted(set(name.split(".")[0] for name in sys.modules) & set(["ansible", "pysnmp", "pyasn1"])))')
+        output = subprocess.check_output([sys.executable, '-c', code % PLUGIN_DIR])
+        self.assertEqual(output.strip(), '[]')
+
+class InterfaceMapTest(unittest.TestCase):
+    def test_lookups(self):
+        interfaces = snmp_client.InterfaceMap({'1': ['gi1', 1], '2': ['gi2', 2], '49': ['vlan1', None]})
+        self.assertEqual(interfaces.port(2), 2)
+        self.assertEqual(interfaces.port('49'), None)
+        self.assertEqual(interfaces.resolve(['gi2', 'vlan1', 'gi9']), dict(gi2=2, vlan1=49, gi9=None))
+        self.assertEqual(interfaces.resolve_ports(['gi1', 'vlan1', 'gi9']), dict(gi1=1, vlan1=None, gi9=None))
+
+    def test_fetched_once(self):
+        client = make_client([dict(jsonrpc='2.0', id=1, result={'1': ['gi1', 1]})])
+        self.assertTrue(client.interface_map() is client.interface_map())
+        self.assertEqual(client.interface_map().resolve(['gi1']), dict(gi1=1))
+        self.assertEqual([request['method'] for request in requests(client)], ['interface_index'])
+
+if __name__ == '__main__':
+    unittest.main()
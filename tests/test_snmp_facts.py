@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_module import Failed, Module, load_module, snmp_client
+
+snmp_facts = load_module('snmp_facts')
+
+def interface_row(speed, high_speed, name='gi1'):
+    return [snmp_client.OctetString('GigabitEthernet1'), snmp_client.Integer32(6), snmp_client.Integer32(1500),
+            speed, snmp_client.OctetString('\x00\x11\x22\x33\x44\x55'), snmp_client.Integer32(1),
+            snmp_client.Integer32(2), snmp_client.OctetString(name), high_speed, None]
+
+class ParseSubsetsTest(unittest.TestCase):
+    def test_subsets(self):
+        parse = lambda value: snmp_facts.parse_subsets(Module(), value)
+        self.assertEqual(parse(['all']), set(snmp_facts.SUBSETS))
+        self.assertEqual(parse(['system', ' vlans']), set(['system', 'vlans']))
+        self.assertEqual(parse(['!interfaces']), set(['system', 'bridge', 'vlans']))
+        self.assertEqual(parse(['all', '!bridge', '!vlans']), set(['system', 'interfaces']))
+        self.assertEqual(parse(['!all']), set())
+
+    def test_invalid(self):
+        for value in (['hardware'], ['!'], ['system', '!routes']):
+            self.assertRaises(Failed, snmp_facts.parse_subsets, Module(), value)
+
+class PortListTest(unittest.TestCase):
+    def test_ports(self):
+        self.assertEqual(snmp_facts.portlist_to_ports(snmp_client.OctetString('\xa0\x01')), [1, 3, 16])
+        self.assertEqual(snmp_facts.portlist_to_ports(snmp_client.OctetString('\x00\x00')), [])
+
+    def test_empty(self):
+        self.assertEqual(snmp_facts.portlist_to_ports(snmp_client.OctetString('')), [])
+        self.assertEqual(snmp_facts.portlist_to_ports(None), [])
+
+class InterfaceFactsTest(unittest.TestCase):
+    def test_facts(self):
+        interfaces = snmp_facts.interface_facts({'1': interface_row(snmp_client.Gauge32(1000000000),
+                                                                    snmp_client.Gauge32(1000))}, {1: 3})
+        self.assertEqual(interfaces['gi1'], dict(ifindex=1, descr='GigabitEthernet1', alias=None, type=6, mtu=1500,
+                                                 speed=1000, mac='00:11:22:33:44:55', admin_status='up',
+                                                 oper_status='down', port=3))
+
+    def test_speed(self):
+        rows = {'1': interface_row(snmp_client.Gauge32(4294967295), snmp_client.Gauge32(40000), 'fo1'),
+                '2': interface_row(snmp_client.Gauge32(100000000), snmp_client.Gauge32(0), 'fa2'),
+                '3': interface_row(snmp_client.Gauge32(10000000), None, 'et3'),
+                '4': interface_row(None, None, 'lo4')}
+        interfaces = snmp_facts.interface_facts(rows, dict())
+        self.assertEqual(dict((name, interface['speed']) for name, interface in interfaces.items()),
+                         dict(fo1=40000, fa2=100, et3=10, lo4=None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_module import Client, Exited, Failed, Module, load_module, module_class, snmp_client
+
+snmp_interface = load_module('snmp_interface')
+
+INTERFACES = {1: ['gi1', 1], 2: ['gi2', 2], 49: ['vlan1', None]}
+
+def oid(column, ifindex):
+    return '%s.%d' % (column, ifindex)
+
+class ParseInterfaceTest(unittest.TestCase):
+    def test_settings(self):
+        interface = snmp_interface.parse_interface(Module(), dict(ifindex='49', alias='Uplink', status='down',
+                                                                  traps='no', promisc='yes'))
+        self.assertEqual(interface['ifindex'], 49)
+        self.assertEqual(interface['ifname'], None)
+        desired = interface['desired']
+        self.assertEqual(desired['alias'].value, 'Uplink')
+        self.assertEqual(desired['status'].value, snmp_interface.IF_ADMIN_STATUS_DOWN)
+        self.assertEqual(desired['traps'].value, snmp_interface.IF_LINK_UP_DOWN_TRAP_ENABLE_DISABLED)
+        self.assertEqual(desired['promisc'].value, snmp_interface.SNMP_TRUE)
+
+    def test_invalid(self):
+        for item in ('gi1', dict(ifname='gi1'), dict(alias='x'), dict(ifname='gi1', ifindex=1, alias='x'),
+                     dict(ifname='gi1', speed=10), dict(ifname='gi1', status='testing'),
+                     dict(ifindex='gi1', alias='x'), dict(ifindex=[1], alias='x')):
+            self.assertRaises(Failed, snmp_interface.parse_interface, Module(), item)
+
+class ResolveIfindexesTest(unittest.TestCase):
+    def resolve(self, *items):
+        interfaces = [snmp_interface.parse_interface(Module(), dict(item, alias='x')) for item in items]
+        snmp_interface.resolve_ifindexes(Module(), Client(dict(), INTERFACES), interfaces)
+        return [interface['ifindex'] for interface in interfaces]
+
+    def test_names_and_indexes(self):
+        self.assertEqual(self.resolve(dict(ifname='gi2'), dict(ifindex=49), dict(ifname='gi1')), [2, 49, 1])
+
+    def test_unknown_name(self):
+        self.assertRaises(Failed, self.resolve, dict(ifname='gi3'))
+
+    def test_given_twice(self):
+        self.assertRaises(Failed, self.resolve, dict(ifname='gi1'), dict(ifname='gi1'))
+        self.assertRaises(Failed, self.resolve, dict(ifname='gi1'), dict(ifindex='1'))
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.client_class = snmp_client.SnmpClient
+        self.module_class = snmp_interface.AnsibleModule
+        self.client = Client({oid(snmp_interface.OID_IF_ALIAS, 1): snmp_client.OctetString('Uplink'),
+                              oid(snmp_interface.OID_IF_ALIAS, 2): snmp_client.OctetString(''),
+                              oid(snmp_interface.OID_IF_ADMIN_STATUS, 2): snmp_client.Integer32(1)}, INTERFACES)
+        snmp_client.SnmpClient = lambda: self.client
+
+    def tearDown(self):
+        snmp_client.SnmpClient = self.client_class
+        snmp_interface.AnsibleModule = self.module_class
+
+    def run_module(self, check_mode=False, **params):
+        snmp_interface.AnsibleModule = module_class(check_mode, **params)
+        try:
+            snmp_interface.main()
+        except Exited as e:
+            return e.args[0]
+        self.fail('The module did not exit')
+
+    def test_one_interface(self):
+        result = self.run_module(ifname='gi1', alias='Uplink')
+        self.assertFalse(result['changed'])
+        self.assertEqual(self.client.sets, [])
+
+        result = self.run_module(ifindex='2', alias='Printer', status='down')
+        self.assertTrue(result['changed'])
+        self.assertEqual(result['interfaces'], [dict(ifname=None, ifindex=2, changed=True, changes=['alias', 'status'])])
+        self.assertEqual(len(self.client.sets), 1)
+        self.assertEqual(str(self.client.values[oid(snmp_interface.OID_IF_ALIAS, 2)]), 'Printer')
+
+    def test_interfaces_in_one_set(self):
+        result = self.run_module(interfaces=[dict(ifname='gi1', alias='Uplink'), dict(ifname='gi2', alias='Printer'),
+                                             dict(ifindex=49, status='down')])
+        self.assertEqual([interface['changed'] for interface in result['interfaces']], [False, True, True])
+        self.assertEqual(len(self.client.sets), 1)
+        self.assertEqual([sorted(group) for group in self.client.sets[0]],
+                         [[oid(snmp_interface.OID_IF_ALIAS, 2)], [oid(snmp_interface.OID_IF_ADMIN_STATUS, 49)]])
+
+    def test_check_mode(self):
+        result = self.run_module(check_mode=True, ifname='gi2', alias='Printer')
+        self.assertTrue(result['changed'])
+        self.assertEqual(self.client.sets, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp_client
+
+# Old-style classes, as pyasn1 0.1 used by pysnmp 4.2 has them
+class Asn1Item:
+    pass
+
+class Integer(Asn1Item):
+    def __init__(self, value):
+        self.value = value
+
+    def __int__(self):
+        return int(self.value)
+
+    def __long__(self):
+        return long(self.value)
+
+class Integer32(Integer):
+    pass
+
+class Counter64(Integer):
+    pass
+
+class OctetString(Asn1Item):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return self.value
+
+class Null(Asn1Item):
+    pass
+
+class NoSuchInstance(Null):
+    pass
+
+class Unsigned32(Integer32):
+    pass
+
+class OldStyleTypesTest(unittest.TestCase):
+    def setUp(self):
+        self.types = snmp_client._SnmpTypes()
+        for snmp_type in snmp_client._snmp_types.types():
+            self.types.register(snmp_client._SnmpType(snmp_type.name, snmp_type.tag, snmp_type.value_class,
+                                                      snmp_type.coerce, snmp_type.raw, snmp_type.packer))
+        self.types.bind_pysnmp('Integer32', Integer32, [Integer])
+        self.types.bind_pysnmp('Counter64', Counter64)
+        self.types.bind_pysnmp('OctetString', OctetString)
+        self.types.register_null(NoSuchInstance)
+
+    def test_from_pysnmp(self):
+        value = self.types.from_pysnmp(Integer32(5))
+        self.assertTrue(isinstance(value, snmp_client.Integer32))
+        self.assertEqual(value.value, 5)
+
+        value = self.types.from_pysnmp(Counter64(2 ** 40))
+        self.assertTrue(isinstance(value, snmp_client.Counter64))
+        self.assertEqual(value.value, 2 ** 40)
+
+        value = self.types.from_pysnmp(OctetString('abc'))
+        self.assertTrue(isinstance(value, snmp_client.OctetString))
+        self.assertEqual(value.value, 'abc')
+
+    def test_from_pysnmp_subclass(self):
+        value = self.types.from_pysnmp(Unsigned32(7))
+        self.assertTrue(isinstance(value, snmp_client.Integer32))
+        self.assertEqual(value.value, 7)
+
+    def test_from_pysnmp_null(self):
+        self.assertEqual(self.types.from_pysnmp(NoSuchInstance()), None)
+
+    def test_from_pysnmp_unknown(self):
+        self.assertRaises(snmp_client.SnmpError, self.types.from_pysnmp, Null())
+
+    def test_to_pysnmp(self):
+        value = self.types.to_pysnmp(snmp_client.Integer32(9))
+        self.assertTrue(isinstance(value, Integer32))
+        self.assertEqual(int(value), 9)
+
+    def test_to_json_rejects_old_style_instances(self):
+        self.assertRaises(ValueError, self.types.to_json, OctetString('x'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_module import Client, Exited, Failed, Module, load_module, module_class, snmp_client
+
+snmp_vlan = load_module('snmp_vlan')
+
+INTERFACES = {1: ['gi1', 1], 2: ['gi2', 2], 3: ['gi3', 3], 49: ['vlan1', None]}
+
+def oid(column, index):
+    return '%s.%d' % (column, index)
+
+def portlist(bits):
+    return snmp_client.OctetString(chr(bits))
+
+class MembershipTest(unittest.TestCase):
+    def setUp(self):
+        # VLAN 10 has ports 1 and 2 untagged
+        self.client = Client({oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_EGRESS_PORTS, 10): portlist(0xc0),
+                              oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_UNTAGGED_PORTS, 10): portlist(0xc0),
+                              oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_ROW_STATUS, 10): snmp_client.Integer32(1)},
+                             INTERFACES)
+
+    def apply(self, membership, check_mode=False):
+        try:
+            snmp_vlan.apply_membership(Module(check_mode), self.client, membership)
+        except Exited as e:
+            return e.args[0]
+        self.fail('The module did not exit')
+
+    def bitmaps(self):
+        return [(oid.rsplit('.', 2)[1], ord(value.value)) for group in self.client.sets
+                for var_binds in group for oid, value in var_binds.items()]
+
+    def test_untagged_stay_subset_of_egress(self):
+        result = self.apply({'10': dict(tagged='gi2', untagged=['3'])})
+        self.assertEqual(result['vlans'], {'10': dict(added=[3], removed=[1], untagged_added=[3], untagged_removed=[1, 2])})
+
+        # Add egress, remove untagged, add untagged, remove egress
+        self.assertEqual(self.bitmaps(), [('2', 0xe0), ('4', 0x00), ('4', 0x20), ('2', 0x60)])
+
+    def test_unchanged(self):
+        result = self.apply({10: dict(untagged='gi1, gi2')})
+        self.assertFalse(result['changed'])
+        self.assertEqual(self.client.sets, [])
+
+    def test_check_mode(self):
+        result = self.apply({10: dict(tagged=['gi3'])}, check_mode=True)
+        self.assertTrue(result['changed'])
+        self.assertEqual(self.client.sets, [])
+
+    def test_invalid(self):
+        for membership in ({20: dict(tagged='gi1')}, {10: dict(tagged='gi4')}, {10: dict(tagged='vlan1')},
+                           {10: dict(tagged='9')}, {'x': None}, {10: dict(egress='gi1')}, ['gi1']):
+            self.assertRaises(Failed, self.apply, membership)
+
+class VlansTest(unittest.TestCase):
+    def setUp(self):
+        self.client_class = snmp_client.SnmpClient
+        self.module_class = snmp_vlan.AnsibleModule
+        self.client = Client({oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_ROW_STATUS, 1): snmp_client.Integer32(1),
+                              oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_NAME, 1): snmp_client.OctetString('default'),
+                              oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_ROW_STATUS, 10): snmp_client.Integer32(1),
+                              oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_NAME, 10): snmp_client.OctetString('old'),
+                              snmp_vlan.OID_DOT1Q_GVRP_STATUS: snmp_client.Integer32(snmp_vlan.SNMP_DISABLED)},
+                             INTERFACES)
+        snmp_client.SnmpClient = lambda: self.client
+
+    def tearDown(self):
+        snmp_client.SnmpClient = self.client_class
+        snmp_vlan.AnsibleModule = self.module_class
+
+    def run_module(self, **params):
+        snmp_vlan.AnsibleModule = module_class(**params)
+        try:
+            snmp_vlan.main()
+        except Exited as e:
+            return e.args[0]
+        self.fail('The module did not exit')
+
+    def test_parse_vlan_ids(self):
+        self.assertEqual(snmp_vlan.parse_vlan_ids(Module(), '100-102, 200'), [100, 101, 102, 200])
+        self.assertEqual(snmp_vlan.parse_vlan_ids(Module(), [5, '7']), [5, 7])
+        for value in ('0', '4095', '5-3', 'x', '1-x'):
+            self.assertRaises(Failed, snmp_vlan.parse_vlan_ids, Module(), value)
+
+    def test_parse_vlans(self):
+        vlans = snmp_vlan.parse_vlans(Module(), ['2-3', dict(vlan=3, name='Voice'), dict(vlan=4, state='absent')],
+                                      'present', None)
+        self.assertEqual(vlans, {2: ('present', None), 3: ('present', 'Voice'), 4: ('absent', None)})
+        for item in (dict(name='x'), dict(vlan=2, tagged='gi1'), dict(vlan=2, state='gone')):
+            self.assertRaises(Failed, snmp_vlan.parse_vlans, Module(), [item], 'present', None)
+
+    def test_one_set(self):
+        result = self.run_module(vlans=[dict(vlan=1, state='absent'), dict(vlan=10, name='new'), 20], gvrp='yes')
+        self.assertEqual((result['created'], result['renamed'], result['deleted']), ([20], [10], [1]))
+        self.assertEqual(len(self.client.sets), 1)
+        self.assertEqual(int(self.client.values[snmp_vlan.OID_DOT1Q_GVRP_STATUS]), snmp_vlan.SNMP_ENABLED)
+        self.assertEqual(int(self.client.values[oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_ROW_STATUS, 1)]),
+                         snmp_vlan.ROW_STATUS_DESTROY)
+        self.assertEqual(str(self.client.values[oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_NAME, 10)]), 'new')
+        self.assertEqual(int(self.client.values[oid(snmp_vlan.OID_DOT1Q_VLAN_STATIC_ROW_STATUS, 20)]),
+                         snmp_vlan.ROW_STATUS_CREATE_AND_GO)
+
+    def test_unchanged(self):
+        result = self.run_module(vlans=['1', '10'], gvrp='no')
+        self.assertFalse(result['changed'])
+        self.assertEqual(self.client.sets, [])
+
+    def test_single_vlan_keeps_gvrp(self):
+        result = self.run_module(vlan='30', gvrp='yes')
+        self.assertEqual(result['created'], [30])
+        self.assertEqual(len(self.client.sets), 1)
+        self.assertEqual(int(self.client.values[snmp_vlan.OID_DOT1Q_GVRP_STATUS]), snmp_vlan.SNMP_ENABLED)
+
+    def test_pvid_needs_port(self):
+        self.assertRaises(Failed, self.run_module, vlan='30', pvid='30')
+        self.assertEqual(self.client.sets, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+from pyasn1.type import univ
+
+class UsmKeyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = snmp.SNMP_STATE_DIR
+        snmp.SNMP_STATE_DIR = tempfile.mkdtemp()
+        self.computed = []
+
+    def tearDown(self):
+        shutil.rmtree(snmp.SNMP_STATE_DIR)
+        snmp.SNMP_STATE_DIR = self.state_dir
+
+    def compute(self, key):
+        def compute():
+            self.computed.append(key)
+            return key
+        return compute
+
+    def test_str_key(self):
+        cache = snmp._UsmKeyCache(False)
+        for i in range(2):
+            key = cache.get(self.compute('\x01\x02'), 'hash', (1, 3, 6), 'secret')
+            self.assertEqual(key, '\x01\x02')
+            self.assertTrue(isinstance(key, str))
+        self.assertEqual(len(self.computed), 1)
+
+    def test_octet_string_key(self):
+        cache = snmp._UsmKeyCache(False)
+        for i in range(2):
+            key = cache.get(self.compute(univ.OctetString('\x01\x02')), 'hash', (1, 3, 6), 'secret')
+            self.assertTrue(isinstance(key, univ.OctetString))
+            self.assertEqual(key.asOctets(), '\x01\x02')
+        self.assertEqual(len(self.computed), 1)
+
+    def test_no_key(self):
+        cache = snmp._UsmKeyCache(False)
+        for i in range(2):
+            self.assertEqual(cache.get(self.compute(None), 'hash', (1, 3, 6), ''), None)
+        self.assertEqual(len(self.computed), 2)
+
+    def test_persisted(self):
+        snmp._UsmKeyCache(True).get(self.compute('\x01'), 'hash', (1, 3, 6), 'secret')
+        snmp._UsmKeyCache(True).get(self.compute(univ.OctetString('\x02')), 'localize', (1, 3, 6), 'secret', 'engine')
+
+        cache = snmp._UsmKeyCache(True)
+        key = cache.get(self.compute('\xff'), 'hash', (1, 3, 6), 'secret')
+        self.assertEqual(key, '\x01')
+        self.assertTrue(isinstance(key, str))
+        key = cache.get(self.compute(univ.OctetString('\xff')), 'localize', (1, 3, 6), 'secret', 'engine')
+        self.assertEqual(key.asOctets(), '\x02')
+        self.assertTrue(isinstance(key, univ.OctetString))
+        self.assertEqual(len(self.computed), 2)
+
+        with open(os.path.join(snmp.SNMP_STATE_DIR, 'usm-keys.json')) as f:
+            self.assertFalse('secret' in f.read())
+
+if __name__ == '__main__':
+    unittest.main()
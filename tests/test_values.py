@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp_client
+
+class ObjectIdentifierTest(unittest.TestCase):
+    def test_forms(self):
+        oid = snmp_client.ObjectIdentifier('1.3.6.1.2.1.1.5.0')
+        self.assertEqual(oid.subids, (1, 3, 6, 1, 2, 1, 1, 5, 0))
+        self.assertEqual(oid.value, '1.3.6.1.2.1.1.5.0')
+        self.assertEqual(str(oid), '1.3.6.1.2.1.1.5.0')
+        self.assertEqual(len(oid), 9)
+        self.assertEqual(snmp_client.ObjectIdentifier(u'1.3.6.1').subids, (1, 3, 6, 1))
+        self.assertEqual(snmp_client.ObjectIdentifier((1, 3, 6, 1)).value, '1.3.6.1')
+        self.assertEqual(snmp_client.ObjectIdentifier([1, 3, 6, 1]).subids, (1, 3, 6, 1))
+        self.assertEqual(snmp_client.ObjectIdentifier(oid).subids, oid.subids)
+
+    def test_compares_as_tuple(self):
+        low = snmp_client.ObjectIdentifier('1.3.6.1.2.1.2')
+        high = snmp_client.ObjectIdentifier('1.3.6.1.2.1.10')
+        self.assertTrue(low < high)
+        self.assertTrue(high >= low)
+        self.assertEqual(sorted([high, low]), [low, high])
+        self.assertEqual(low, (1, 3, 6, 1, 2, 1, 2))
+        self.assertNotEqual(low, high)
+        self.assertNotEqual(low, '1.3.6.1.2.1.2')
+        self.assertEqual(hash(low), hash((1, 3, 6, 1, 2, 1, 2)))
+        self.assertTrue((1, 3, 6, 1, 2, 1, 2) in set([low]))
+
+    def test_parses_are_shared(self):
+        first = snmp_client.ObjectIdentifier('1.3.6.1.2.1.31.1.1.1.1')
+        second = snmp_client.ObjectIdentifier('1.3.6.1.2.1.31.1.1.1.1')
+        self.assertTrue(first.subids is second.subids)
+
+    def test_slots(self):
+        for value in (snmp_client.ObjectIdentifier('1.3'), snmp_client.Integer32(1), snmp_client.OctetString('x')):
+            self.assertFalse(hasattr(value, '__dict__'))
+
+class IntegerTest(unittest.TestCase):
+    def test_conversions(self):
+        self.assertEqual(int(snmp_client.Integer32('-5')), -5)
+        self.assertEqual(long(snmp_client.Counter32(2 ** 32 - 1)), 2 ** 32 - 1)
+        self.assertEqual(str(snmp_client.Integer32(7)), '7')
+        self.assertEqual(snmp_client.OctetString(u'abc').value, 'abc')
+
+if __name__ == '__main__':
+    unittest.main()
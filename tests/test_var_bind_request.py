@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+from pysnmp.proto import rfc1902
+
+class Connection(object):
+    """ Stands in for _SnmpConnection, answering tooBig to PDUs above too_big var-binds """
+
+    def __init__(self, max_var_binds, too_big=None, timeout=False):
+        self.max_message_size = 1472
+        self.max_var_binds = max_var_binds
+        self._too_big = too_big
+        self._timeout = timeout
+        self.pdus = []
+
+        # Responses arrive from the event loop, never during the request
+        self.queue = collections.deque()
+
+    def get(self, names, callback):
+        self._answer([(name, rfc1902.Integer32(1)) for name in names], callback)
+
+    def set(self, var_binds, callback):
+        self._answer(var_binds, callback)
+
+    def _answer(self, var_binds, callback):
+        (cb_fun, cb_ctx) = callback
+        self.pdus.append(len(var_binds))
+        if self._timeout and len(var_binds) > 1:
+            response = (None, 'requestTimedOut', 0, 0, [], cb_ctx)
+        elif self._too_big is not None and len(var_binds) > self._too_big:
+            response = (None, None, rfc1902.Integer(snmp._ERROR_STATUS_TOO_BIG), 0, [], cb_ctx)
+        else:
+            response = (None, None, 0, 0, var_binds, cb_ctx)
+        self.queue.append((cb_fun, response))
+
+def groups(*sizes):
+    """ Groups of var-binds of the given sizes with distinct names """
+    result = []
+    for group, size in enumerate(sizes):
+        result.append([(rfc1902.ObjectName('1.3.6.1.4.1.9.%d.%d' % (group, i)), rfc1902.Integer32(i))
+                       for i in range(size)])
+    return result
+
+class VarBindRequestTest(unittest.TestCase):
+    def run_request(self, conn, groups, get=False):
+        results = []
+        snmp._VarBindRequest(conn, groups, lambda error, var_binds: results.append((error, var_binds)), get).start()
+        while conn.queue:
+            (cb_fun, response) = conn.queue.popleft()
+            cb_fun(*response)
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def test_packs_groups(self):
+        conn = Connection(10)
+        (error, var_binds) = self.run_request(conn, groups(4, 4, 4, 1))
+        self.assertEqual(error, None)
+        self.assertEqual(len(var_binds), 13)
+        self.assertEqual(conn.pdus, [8, 5])
+
+    def test_group_is_never_split(self):
+        conn = Connection(2)
+        self.run_request(conn, groups(3, 1))
+        self.assertEqual(conn.pdus, [3, 1])
+
+    def test_message_size(self):
+        conn = Connection(1000)
+        conn.max_message_size = snmp._PDU_OVERHEAD + snmp._estimate_size(groups(10)[0]) * 2
+        self.run_request(conn, groups(10, 10, 10))
+        self.assertEqual(conn.pdus, [20, 10])
+
+    def test_too_big_splits_and_learns(self):
+        conn = Connection(64, too_big=2)
+        (error, var_binds) = self.run_request(conn, groups(*[1] * 8))
+        self.assertEqual(error, None)
+        self.assertEqual(len(var_binds), 8)
+        self.assertEqual(conn.max_var_binds, 2)
+
+        # The next request goes straight to the learned size
+        del conn.pdus[:]
+        self.run_request(conn, groups(*[1] * 8))
+        self.assertEqual(conn.pdus, [2, 2, 2, 2])
+
+    def test_too_big_single_group(self):
+        conn = Connection(64, too_big=2)
+        (error, var_binds) = self.run_request(conn, groups(3))
+        self.assertEqual(error, rfc1902.Integer(snmp._ERROR_STATUS_TOO_BIG).prettyPrint())
+
+    def test_get_timeout_splits_once(self):
+        conn = Connection(64, timeout=True)
+        (error, var_binds) = self.run_request(conn, groups(*[1] * 4), get=True)
+        self.assertEqual(error, 'requestTimedOut')
+        self.assertEqual(conn.pdus, [4, 2, 2])
+
+    def test_nothing_to_do(self):
+        self.assertEqual(self.run_request(Connection(64), []), (None, []))
+
+if __name__ == '__main__':
+    unittest.main()
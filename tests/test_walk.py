@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import collections
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+from pysnmp.proto import rfc1902, rfc1905
+
+IF_NAME = '1.3.6.1.2.1.31.1.1.1.1'
+IF_ALIAS = '1.3.6.1.2.1.31.1.1.1.18'
+
+class Agent(object):
+    """ Agent answering GETBULK from a dictionary, queueing the responses until deliver() """
+
+    def __init__(self, values, too_big=None):
+        self._values = dict((snmp._oid_subids(oid), value) for oid, value in values.items())
+        self._oids = sorted(self._values)
+        self._too_big = too_big
+        self.requests = []
+        self.queue = collections.deque()
+
+    def get_bulk(self, var_names, callback, non_repeaters=0, max_repetitions=10):
+        (cb_fun, cb_ctx) = callback
+        self.requests.append(max_repetitions)
+
+        # Some agents answer tooBig rather than truncating the response
+        if self._too_big is not None and max_repetitions * len(var_names) > self._too_big:
+            error_status = rfc1902.Integer(snmp._ERROR_STATUS_TOO_BIG)
+            self.queue.append(lambda: cb_fun(None, None, error_status, 0, [], cb_ctx))
+            return
+
+        cursors = [tuple(name.asTuple()) for name in var_names]
+        table = []
+        for repetition in range(max_repetitions):
+            row = []
+            for position, oid in enumerate(cursors):
+                index = bisect.bisect_right(self._oids, oid)
+                if index < len(self._oids):
+                    oid = self._oids[index]
+                    row.append((rfc1902.ObjectName(oid), self._values[oid]))
+                else:
+                    row.append((rfc1902.ObjectName(oid), rfc1905.endOfMibView))
+                cursors[position] = oid
+            table.append(row)
+        self.queue.append(lambda: cb_fun(None, None, 0, 0, table, cb_ctx))
+
+    def time_out(self, var_names, callback, non_repeaters=0, max_repetitions=10):
+        (cb_fun, cb_ctx) = callback
+        self.queue.append(lambda: cb_fun(None, 'requestTimedOut', 0, 0, [], cb_ctx))
+
+    def deliver(self, count=None):
+        while self.queue and count != 0:
+            self.queue.popleft()()
+            if count is not None:
+                count = count - 1
+
+def make_connection(agent):
+    conn = object.__new__(snmp._SnmpConnection)
+    conn.key = 'test'
+    conn.max_repetitions = snmp._DEFAULT_MAX_REPETITIONS
+    conn.max_message_size = snmp.SNMP_MAX_MESSAGE_SIZE
+    conn.max_var_binds = snmp.SNMP_MAX_VAR_BINDS
+    conn._var_bind_size = None
+    conn.interface_index = None
+    conn.get_bulk = agent.get_bulk
+    return conn
+
+class Server(snmp._Server):
+    """ Server collecting its replies """
+
+    def __init__(self, conn):
+        snmp._Server.__init__(self, conn, None, None, None)
+        self.replies = []
+
+    def send(self, **kwargs):
+        self.replies.append(kwargs)
+
+    def _backlog(self):
+        return 0
+
+def interfaces(count, aliases=()):
+    values = dict()
+    for i in range(1, count + 1):
+        values['%s.%d' % (IF_NAME, i)] = rfc1902.OctetString('gi%d' % i)
+    for i in aliases:
+        values['%s.%d' % (IF_ALIAS, i)] = rfc1902.OctetString('port %d' % i)
+    # Beyond the walked columns
+    values['1.3.6.1.2.1.31.1.1.1.19.1'] = rfc1902.Integer32(0)
+    return values
+
+def plain(result):
+    if isinstance(result, list):
+        return [plain(value) for value in result]
+    if isinstance(result, dict):
+        return dict((key, plain(value)) for key, value in result.items())
+    if result is None or isinstance(result, basestring):
+        return result
+    return result.value
+
+class WalkTest(unittest.TestCase):
+    def test_walk(self):
+        agent = Agent(interfaces(25))
+        server = Server(make_connection(agent))
+        server.rpc_walk(1, IF_NAME)
+        agent.deliver()
+        self.assertEqual(plain(server.replies[-1]['result']), dict(('%d' % i, 'gi%d' % i) for i in range(1, 26)))
+        self.assertEqual(len(server.replies), 1)
+
+    def test_walk_table_joins_rows(self):
+        agent = Agent(interfaces(3, aliases=[1, 3]))
+        server = Server(make_connection(agent))
+        server.rpc_walk_table(1, [IF_NAME, IF_ALIAS])
+        agent.deliver()
+        self.assertEqual(plain(server.replies[-1]['result']),
+                         {'1': ['gi1', 'port 1'], '2': ['gi2', None], '3': ['gi3', 'port 3']})
+
+    def test_walk_table_in_one_stream_of_requests(self):
+        agent = Agent(interfaces(40, aliases=range(1, 41)))
+        server = Server(make_connection(agent))
+        server.rpc_walk_table(1, [IF_NAME, IF_ALIAS])
+        agent.deliver()
+        self.assertEqual(len(server.replies[-1]['result']), 40)
+
+        # The columns share the var-binds of each request
+        self.assertTrue(all(repetitions * 2 <= snmp.SNMP_MAX_REPETITIONS for repetitions in agent.requests))
+
+    def test_end_of_mib_view(self):
+        values = dict(('1.3.6.1.2.1.31.1.1.1.1.%d' % i, rfc1902.OctetString('gi%d' % i)) for i in range(1, 4))
+        agent = Agent(values)
+        server = Server(make_connection(agent))
+        server.rpc_walk(1, IF_NAME)
+        agent.deliver()
+        self.assertEqual(plain(server.replies[-1]['result']), {'1': 'gi1', '2': 'gi2', '3': 'gi3'})
+
+    def test_too_big_reduces_max_repetitions(self):
+        agent = Agent(interfaces(30), too_big=4)
+        conn = make_connection(agent)
+        server = Server(conn)
+        server.rpc_walk(1, IF_NAME)
+        agent.deliver()
+        self.assertEqual(len(server.replies[-1]['result']), 30)
+        self.assertTrue(conn.max_repetitions <= 4)
+
+    def test_timeout(self):
+        agent = Agent(interfaces(3))
+        conn = make_connection(agent)
+        conn.get_bulk = agent.time_out
+        server = Server(conn)
+        server.rpc_walk(1, IF_NAME)
+        agent.deliver()
+        self.assertEqual(server.replies, [dict(jsonrpc='2.0', error=dict(code=0, message='requestTimedOut'), id=1)])
+
+class WalkStreamTest(unittest.TestCase):
+    def test_partial_replies(self):
+        agent = Agent(interfaces(25))
+        server = Server(make_connection(agent))
+        server.rpc_walk_stream(1, IF_NAME)
+        agent.deliver()
+        rows = [row for reply in server.replies[:-1] for row in plain(reply['partial'])]
+        self.assertEqual(rows, [['%d' % i, 'gi%d' % i] for i in range(1, 26)])
+        self.assertEqual(server.replies[-1], dict(jsonrpc='2.0', result=None, id=1))
+
+    def test_cancel(self):
+        agent = Agent(interfaces(25))
+        server = Server(make_connection(agent))
+        server.rpc_walk_stream(1, IF_NAME)
+        agent.deliver(1)
+        self.assertEqual(len(server.replies), 1)
+
+        server.rpc_cancel(2, 1)
+        self.assertEqual(server.replies[-1], dict(jsonrpc='2.0', result=True, id=2))
+
+        # The response in flight is dropped and nothing more is requested
+        requests = len(agent.requests)
+        agent.deliver()
+        self.assertEqual(len(server.replies), 2)
+        self.assertEqual(len(agent.requests), requests)
+
+        # Other requests go on as usual
+        server.rpc_walk(3, IF_NAME)
+        agent.deliver()
+        self.assertEqual(len(server.replies[-1]['result']), 25)
+
+    def test_cancel_after_end(self):
+        agent = Agent(interfaces(3))
+        server = Server(make_connection(agent))
+        server.rpc_walk_stream(1, IF_NAME)
+        agent.deliver()
+        server.rpc_cancel(2, 1)
+        self.assertEqual(server.replies[-1], dict(jsonrpc='2.0', result=False, id=2))
+
+    def test_close_cancels(self):
+        agent = Agent(interfaces(25))
+        server = Server(make_connection(agent))
+        server.rpc_walk_stream(1, IF_NAME)
+        server.close()
+        requests = len(agent.requests)
+        agent.deliver()
+        self.assertEqual(len(agent.requests), requests)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'connection_plugins'))
+
+import snmp
+
+IF_NAME = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 1)
+IF_ALIAS = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 18)
+IF_DESCR = (1, 3, 6, 1, 2, 1, 2, 2, 1, 2)
+
+NAMES = ('host', (IF_NAME,))
+TABLE = ('host', (IF_NAME, IF_ALIAS))
+DESCRS = ('host', (IF_DESCR,))
+
+class WalkCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = snmp._WalkCache(60, 2)
+
+    def put(self, key, value):
+        self.cache.put(key, value, self.cache.generation(key[0]))
+
+    def test_hit(self):
+        self.put(NAMES, {'1': snmp.OctetString('gi1')})
+        self.assertEqual(self.cache.get(NAMES)['1'].value, 'gi1')
+        self.assertEqual(self.cache.get(('other', (IF_NAME,))), None)
+
+    def test_results_are_copies(self):
+        result = {'1': [snmp.OctetString('gi1'), None]}
+        self.put(TABLE, result)
+        result['1'][0].value = 'changed before'
+        result['2'] = None
+
+        hit = self.cache.get(TABLE)
+        self.assertEqual(sorted(hit), ['1'])
+        self.assertEqual(hit['1'][0].value, 'gi1')
+        hit['1'][0].value = 'changed after'
+        hit['1'][1] = snmp.OctetString('x')
+        self.assertEqual(self.cache.get(TABLE)['1'][0].value, 'gi1')
+        self.assertEqual(self.cache.get(TABLE)['1'][1], None)
+
+    def test_disabled(self):
+        cache = snmp._WalkCache(0, 2)
+        cache.put(NAMES, dict(), cache.generation('host'))
+        self.assertEqual(cache.get(NAMES), None)
+
+    def test_expiry(self):
+        self.cache = snmp._WalkCache(-1, 2)
+        self.put(NAMES, dict())
+        self.assertEqual(self.cache.get(NAMES), None)
+
+    def test_least_recently_used_is_dropped(self):
+        self.put(NAMES, dict())
+        self.put(TABLE, dict())
+        self.cache.get(NAMES)
+        self.put(DESCRS, dict())
+        self.assertEqual(self.cache.get(TABLE), None)
+        self.assertEqual(self.cache.get(NAMES), dict())
+        self.assertEqual(self.cache.get(DESCRS), dict())
+
+    def test_set_invalidates_overlapping_walks(self):
+        self.put(NAMES, dict())
+        self.put(DESCRS, dict())
+        self.cache.invalidate('host', [IF_NAME + (3,)])
+        self.assertEqual(self.cache.get(NAMES), None)
+        self.assertEqual(self.cache.get(DESCRS), dict())
+
+    def test_set_of_a_table_invalidates_its_columns(self):
+        self.put(TABLE, dict())
+        self.cache.invalidate('host', [IF_NAME[:-2]])
+        self.assertEqual(self.cache.get(TABLE), None)
+
+    def test_set_during_walk(self):
+        generation = self.cache.generation('host')
+        self.cache.invalidate('host', [(1, 3, 6, 1, 2, 1, 1, 5, 0)])
+        self.cache.put(NAMES, dict(), generation)
+        self.assertEqual(self.cache.get(NAMES), None)
+
+if __name__ == '__main__':
+    unittest.main()